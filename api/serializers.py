@@ -1,8 +1,10 @@
 from rest_framework import serializers
+from core.activity import recompute_streaks
 from core.models import (
     User, UserProgress, CompletedChallenge, 
     UserBadge, ViewedArticle, ViewedProduct, CurrentChallenge
 )
+from data.streaks import is_known_zone
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,14 +12,27 @@ class UserSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'partner1_name', 'partner2_name', 
             'relationship_status', 'relationship_duration', 
-            'challenge_frequency', 'preferred_categories', 
+            'challenge_frequency', 'timezone', 'preferred_categories', 
             'excluded_categories', 'created_at', 'last_login'
         ]
 
+    def validate_timezone(self, value):
+        if not is_known_zone(value):
+            raise serializers.ValidationError("Unknown timezone")
+        return value
+
+    def update(self, instance, validated_data):
+        previous_timezone = instance.timezone
+        user = super().update(instance, validated_data)
+        if user.timezone != previous_timezone:
+            # Days are counted in the couple's timezone, so recount them
+            recompute_streaks([user], rebuild=True)
+        return user
+
 class UserProgressSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProgress
-        fields = ['id', 'user', 'streak', 'last_completed', 'spark_level', 'total_completed']
+        fields = ['id', 'user', 'streak', 'longest_streak', 'last_completed', 'spark_level', 'total_completed']
 
 class CompletedChallengeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,6 +24,7 @@ urlpatterns = [
     # Challenge related endpoints
     path('challenges/', views.get_challenges, name='challenges-list'),
     path('challenges/<str:challenge_id>/', views.get_challenge, name='challenge-detail'),
+    path('challenges/<str:challenge_id>/similar/', views.get_similar_challenges, name='challenge-similar'),
     path('complete-challenge/', views.complete_challenge_api, name='complete-challenge'),
     path('generate-challenge/', views.generate_challenge_api, name='generate-challenge'),
     
@@ -35,6 +36,9 @@ urlpatterns = [
     path('products/', views.get_products, name='products-list'),
     path('products/<str:product_id>/', views.get_product, name='product-detail'),
     
+    # Health checks
+    path('health/ai/', views.ai_health, name='ai-health'),
+    
     # API Auth
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
\ No newline at end of file
@@ -1,3 +1,5 @@
+import time
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
@@ -8,15 +10,21 @@ from core.models import (
     UserBadge, ViewedArticle, ViewedProduct, CurrentChallenge
 )
 
+from core import services
+from core.challenge_store import similar_challenges
+
 from .serializers import (
     UserSerializer, UserProgressSerializer, CompletedChallengeSerializer,
     UserBadgeSerializer, ViewedArticleSerializer, ViewedProductSerializer,
     CurrentChallengeSerializer, UserWithProgressSerializer, UserWithFullDataSerializer
 )
 
-from data.challenges import get_challenge_by_id, get_challenge_by_category, get_random_challenge
+from data.challenges import CATALOG, get_challenge_by_id, get_challenge_by_category, get_random_challenge, sample_challenge
 from data.education import get_all_articles, get_article_by_id
 from data.products import get_all_products, get_product_by_id
+from utils import ai_metrics, circuit_breaker
+from utils.ai_generator import AI_AVAILABLE, AI_BREAKER, AI_METRICS, BACKEND, GENERATION_FLIGHT
+from utils.ai_policy import get_policy
 
 # Model ViewSets for basic CRUD operations
 class UserViewSet(viewsets.ModelViewSet):
@@ -95,6 +103,17 @@ def get_challenge(request, challenge_id):
         return Response(challenge)
     return Response({"error": "Challenge not found"}, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['GET'])
+def get_similar_challenges(request, challenge_id):
+    """Get the challenges most similar to a given one"""
+    if get_challenge_by_id(challenge_id) is None:
+        return Response({"error": "Challenge not found"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        k = min(max(int(request.query_params.get('k', 5)), 1), 50)
+    except ValueError:
+        return Response({"error": "k must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(similar_challenges([challenge_id], k))
+
 @api_view(['POST'])
 def complete_challenge_api(request):
     """Mark a challenge as completed and update progress"""
@@ -108,27 +127,14 @@ def complete_challenge_api(request):
     try:
         user = User.objects.get(pk=user_id)
         
-        # Create the completed challenge
-        completed, created = CompletedChallenge.objects.get_or_create(
-            user=user, 
-            challenge_id=challenge_id,
-            defaults={"category": category}
-        )
+        # Record the completion and update progress in one transaction
+        result = services.complete_challenge(user, challenge_id, category)
         
-        if not created:
+        if not result.created:
             return Response({"message": "Challenge already completed"})
-            
-        # Update user progress
-        progress, _ = UserProgress.objects.get_or_create(user=user)
-        progress.total_completed += 1
-        
-        # Logic for streak and spark level updates
-        # ... (to be implemented based on core.views logic)
-        
-        progress.save()
         
         # Return the updated progress
-        serializer = UserProgressSerializer(progress)
+        serializer = UserProgressSerializer(result.progress)
         return Response(serializer.data)
         
     except User.DoesNotExist:
@@ -185,20 +191,14 @@ def generate_challenge_api(request):
             preferred = user.preferred_categories
             excluded = user.excluded_categories
             
-            if preferred:
-                # Get a random preferred category
-                import random
-                category = random.choice(preferred)
-                challenge = get_challenge_by_category(category, exclude_ids=completed_ids)
-            else:
-                # Get a random challenge, avoiding excluded categories
-                challenge = get_random_challenge(exclude_ids=completed_ids)
-                
-                # Make sure it's not in excluded categories
-                attempts = 0
-                while challenge.get('category') in excluded and attempts < 10:
-                    challenge = get_random_challenge(exclude_ids=completed_ids)
-                    attempts += 1
+            # Draw from preferred categories if set, otherwise from every
+            # category the user hasn't excluded
+            allowed = preferred or CATALOG.categories()
+            allowed = [c for c in allowed if c not in excluded]
+            challenge = sample_challenge(allowed, exclude_ids=completed_ids)
+        
+        if not challenge:
+            return Response({"error": "No challenges available"}, status=status.HTTP_404_NOT_FOUND)
                     
         # Save as current challenge
         current, _ = CurrentChallenge.objects.update_or_create(
@@ -212,4 +212,44 @@ def generate_challenge_api(request):
         return Response(challenge)
         
     except User.DoesNotExist:
-        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+@api_view(['GET'])
+def ai_health(request):
+    """State of the AI provider circuit breaker, the global call budget and generation coalescing"""
+    try:
+        breaker = AI_BREAKER.snapshot()
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    try:
+        budget = get_policy().headroom()
+    except Exception as e:
+        budget = {"error": str(e)}
+
+    # Counters of this process, and of all workers over the last hour
+    single_flight = {"process": GENERATION_FLIGHT.stats()}
+    try:
+        summary = AI_METRICS.summary(time.time() - 3600)
+        single_flight["last_hour"] = {
+            "executions": summary["by_event"][ai_metrics.FLIGHT].get("executions", 0),
+            "calls_saved": summary["calls_saved"],
+        }
+    except Exception as e:
+        single_flight["last_hour"] = {"error": str(e)}
+
+    healthy = AI_AVAILABLE and breaker["state"] == circuit_breaker.CLOSED
+    return Response({
+        "healthy": healthy,
+        "ai_available": AI_AVAILABLE,
+        "backend": BACKEND.name,
+        "breaker": {
+            "state": breaker["state"],
+            "failures": breaker["failures"],
+            "opened_at": breaker["opened_at"] or None,
+            "failure_threshold": AI_BREAKER.failure_threshold,
+            "reset_timeout": AI_BREAKER.reset_timeout,
+        },
+        "budget": budget,
+        "single_flight": single_flight,
+    }, status=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE)
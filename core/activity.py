@@ -0,0 +1,168 @@
+"""
+Completion activity log and daily rollups.
+Every completion appends a CompletionEvent and folds into the user's
+DailyActivity row for that day (number of completions and a bitmask of the
+categories done), inside the completion transaction. Days are counted in
+the couple's timezone. The calendar, streaks and analytics then read one
+compact row per active day instead of scanning and grouping
+CompletedChallenge; recompute_streaks() rebuilds streaks from those rows.
+Resetting a user's progress clears both (clear_activity()).
+"""
+
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import CompletionEvent, DailyActivity, User, UserProgress
+from core.user_state import invalidate_user_state
+from data.streaks import compute_streaks, get_zone, local_day
+
+# Bit per category in DailyActivity.categories. The order is stored in the
+# database, so new categories must only ever be appended.
+CATEGORY_ORDER = [
+    "Communication Boosters",
+    "Physical Touch & Affection",
+    "Creative Date Night Ideas",
+    "Sexual Exploration",
+    "Emotional Connection",
+]
+CATEGORY_BITS = {category: 1 << i for i, category in enumerate(CATEGORY_ORDER)}
+
+
+def category_bit(category):
+    """Bit for a category; 0 for categories outside the catalog (e.g. free-form AI ones)"""
+    return CATEGORY_BITS.get(category, 0)
+
+
+def categories_in(mask):
+    """Category names whose bits are set in a mask"""
+    return [category for category, bit in CATEGORY_BITS.items() if mask & bit]
+
+
+def activity_day(moment, tz=None):
+    """Calendar day of a moment in the given timezone (the current one by default)"""
+    return timezone.localtime(moment, tz).date()
+
+
+def record_completion(user, challenge_id, category, occurred_at=None, tz=None):
+    """
+    Append a completion event and fold it into the day's rollup.
+    Call inside the completion transaction so both stay consistent with
+    CompletedChallenge.
+    """
+    occurred_at = occurred_at or timezone.now()
+    day = activity_day(occurred_at, tz)
+    bit = category_bit(category)
+
+    with transaction.atomic():
+        CompletionEvent.objects.create(user=user, challenge_id=challenge_id, category=category,
+                                       occurred_at=occurred_at)
+
+        rollup = DailyActivity.objects.filter(user=user, day=day)
+        if rollup.update(count=F('count') + 1, categories=F('categories').bitor(bit)):
+            return
+        try:
+            # Savepoint so losing a race to create the row doesn't break the transaction
+            with transaction.atomic():
+                DailyActivity.objects.create(user=user, day=day, count=1, categories=bit)
+        except IntegrityError:
+            rollup.update(count=F('count') + 1, categories=F('categories').bitor(bit))
+
+
+def clear_activity(user):
+    """Delete a user's completion events and rollups, e.g. when their progress is reset"""
+    with transaction.atomic():
+        CompletionEvent.objects.filter(user=user).delete()
+        DailyActivity.objects.filter(user=user).delete()
+
+
+def active_days(user, start, end):
+    """Days in [start, end] on which the user completed anything, oldest first"""
+    return list(
+        DailyActivity.objects
+        .filter(user=user, day__gte=start, day__lte=end, count__gt=0)
+        .order_by('day')
+        .values_list('day', flat=True)
+    )
+
+
+def rebuild_daily_activity(user_ids=None, zones=None, batch_size=1000):
+    """
+    Recompute rollups from the event log (for all users, or some), replacing
+    existing rows. Days are counted in each user's timezone; `zones` maps
+    user IDs to timezones and is looked up when not given. Returns the
+    number of rollup rows written.
+    """
+    events = CompletionEvent.objects.order_by()
+    rollups = DailyActivity.objects.all()
+    users = User.objects.all()
+    if user_ids is not None:
+        events = events.filter(user_id__in=user_ids)
+        rollups = rollups.filter(user_id__in=user_ids)
+        users = users.filter(id__in=user_ids)
+    if zones is None:
+        zones = {user_id: get_zone(name) for user_id, name in users.values_list('id', 'timezone').iterator()}
+
+    days = {}
+    rows = events.values_list('user_id', 'category', 'occurred_at')
+    for user_id, category, occurred_at in rows.iterator(chunk_size=5000):
+        key = (user_id, activity_day(occurred_at, zones.get(user_id)))
+        count, mask = days.get(key, (0, 0))
+        days[key] = (count + 1, mask | category_bit(category))
+
+    with transaction.atomic():
+        rollups.delete()
+        DailyActivity.objects.bulk_create([
+            DailyActivity(user_id=user_id, day=day, count=count, categories=mask)
+            for (user_id, day), (count, mask) in days.items()
+        ], batch_size=batch_size)
+    return len(days)
+
+
+def recompute_streaks(users, now=None, rebuild=False):
+    """
+    Recompute current and longest streaks for a batch of users from their
+    daily rollups (rebuilt from the event log first if `rebuild`), in each
+    couple's timezone. A reset clears both, so it is never undone here.
+    Only progress rows that change are written, in one bulk_update.
+    Returns the number of users whose streaks changed.
+    """
+    now = now or timezone.now()
+    zones = {user.id: get_zone(user.timezone) for user in users}
+    if not zones:
+        return 0
+    if rebuild:
+        rebuild_daily_activity(list(zones), zones)
+
+    days = {user_id: [] for user_id in zones}
+    rows = (
+        DailyActivity.objects
+        .filter(user_id__in=list(zones), count__gt=0)
+        .order_by('user_id', 'day')
+        .values_list('user_id', 'day')
+    )
+    for user_id, day in rows.iterator(chunk_size=5000):
+        days[user_id].append(day)
+
+    changed = []
+    for progress in UserProgress.objects.filter(user_id__in=list(zones)):
+        streaks = compute_streaks(days[progress.user_id], local_day(now, zones[progress.user_id]))
+        if (progress.streak, progress.longest_streak) != tuple(streaks):
+            progress.streak, progress.longest_streak = streaks
+            changed.append(progress)
+
+    with transaction.atomic():
+        UserProgress.objects.bulk_update(changed, ['streak', 'longest_streak'], batch_size=1000)
+        # bulk_update doesn't send post_save, so invalidate explicitly
+        for progress in changed:
+            invalidate_user_state(progress.user_id)
+    return len(changed)
+
+
+def month_bounds(year, month):
+    """First and last day of a month"""
+    first = datetime.date(year, month, 1)
+    following = (first + datetime.timedelta(days=32)).replace(day=1)
+    return first, following - datetime.timedelta(days=1)
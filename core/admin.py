@@ -1,7 +1,8 @@
 from django.contrib import admin
 from core.models import (
     User, UserProgress, CompletedChallenge, UserBadge, 
-    ViewedArticle, ViewedProduct, CurrentChallenge
+    ViewedArticle, ViewedProduct, CurrentChallenge, GeneratedChallenge,
+    CompletionEvent, DailyActivity
 )
 
 @admin.register(User)
@@ -42,4 +43,21 @@ class ViewedProductAdmin(admin.ModelAdmin):
 class CurrentChallengeAdmin(admin.ModelAdmin):
     list_display = ('user', 'challenge_id', 'category', 'generated_at')
     list_filter = ('category', 'generated_at')
-    search_fields = ('user__partner1_name', 'user__partner2_name', 'challenge_id')
\ No newline at end of file
+    search_fields = ('user__partner1_name', 'user__partner2_name', 'challenge_id')
+
+@admin.register(GeneratedChallenge)
+class GeneratedChallengeAdmin(admin.ModelAdmin):
+    list_display = ('challenge_id', 'title', 'category', 'difficulty', 'created_at')
+    list_filter = ('category', 'difficulty')
+    search_fields = ('challenge_id', 'title')
+
+@admin.register(CompletionEvent)
+class CompletionEventAdmin(admin.ModelAdmin):
+    list_display = ('user', 'challenge_id', 'category', 'occurred_at')
+    list_filter = ('category',)
+    search_fields = ('user__partner1_name', 'user__partner2_name', 'challenge_id')
+
+@admin.register(DailyActivity)
+class DailyActivityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'day', 'count', 'categories')
+    search_fields = ('user__partner1_name', 'user__partner2_name')
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Register cache invalidation handlers
+        from core import signals  # noqa: F401
+
+        # Resolve generated challenge IDs through the catalog
+        from core.challenge_store import get_generated_challenge
+        from data.challenges import CATALOG
+        CATALOG.add_source(get_generated_challenge)
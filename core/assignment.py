@@ -0,0 +1,169 @@
+"""
+Batch challenge assignment.
+Picks a category and a static challenge for many users at once: completion
+history comes from one query, category weights and draws are computed for
+every user together on NumPy matrices (users x categories, users x
+challenges), and CurrentChallenge rows are written with one bulk_update and
+one bulk_create. The per-user path in core.views uses the same weighting.
+Rotation (`manage.py rotate_challenges`) uses due_users() to find couples
+whose challenge_frequency says they should get a new challenge.
+"""
+
+import datetime
+from dataclasses import dataclass, field
+from typing import Dict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import CompletedChallenge, CurrentChallenge, User
+from core.user_state import invalidate_user_state
+from data.challenges import ALL_CHALLENGES, CATALOG
+
+# Random jitter added to every category weight so picks don't get stuck
+WEIGHT_JITTER = 0.2
+
+# Days between challenges per User.challenge_frequency; "biweekly" is shown
+# as "Twice a week" on the profile form. Unknown values rotate daily.
+ROTATION_DAYS = {'daily': 1, 'weekly': 7, 'biweekly': 3}
+
+
+@dataclass(frozen=True)
+class AssignmentResult:
+    """Outcome of a batch assignment"""
+    created: int = 0
+    updated: int = 0
+    assignments: Dict[int, str] = field(default_factory=dict)  # user ID -> challenge ID
+
+
+def allowed_categories(user, categories):
+    """
+    Categories a user can be given: their preferred ones (or all) minus the
+    excluded ones, or every category if that leaves nothing.
+    """
+    available = [c for c in categories if c not in user.excluded_categories]
+    if user.preferred_categories:
+        available = [c for c in user.preferred_categories if c in available]
+    return available or list(categories)
+
+
+def category_weights(counts, allowed, rng):
+    """
+    Inverse-frequency weights per user and category: 1 - share of the
+    user's completions in that category (1 without history), plus jitter.
+    `counts` and `allowed` are users x categories; disallowed cells get 0.
+    """
+    counts = np.where(allowed, counts, 0).astype(np.float64)
+    totals = counts.sum(axis=1, keepdims=True)
+    shares = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+    weights = 1 - shares + rng.random(counts.shape) * WEIGHT_JITTER
+    return np.where(allowed, weights, 0.0)
+
+
+def sample_rows(weights, rng):
+    """One column index per row, drawn with probability proportional to the row's weights"""
+    cumulative = np.cumsum(weights, axis=1)
+    draws = rng.random((len(weights), 1)) * cumulative[:, -1:]
+    return np.minimum((cumulative <= draws).sum(axis=1), weights.shape[1] - 1)
+
+
+def rotation_cutoff(today, days):
+    """Challenges generated before this instant are `days` or more calendar days old"""
+    start = today - datetime.timedelta(days=days - 1)
+    return timezone.make_aware(datetime.datetime.combine(start, datetime.time.min))
+
+
+def due_users(now=None):
+    """Users with no current challenge, or one older than their challenge frequency allows"""
+    today = timezone.localdate(now)
+    due = Q(current_challenge__isnull=True)
+    for frequency, days in ROTATION_DAYS.items():
+        due |= Q(challenge_frequency=frequency, current_challenge__generated_at__lt=rotation_cutoff(today, days))
+    due |= (
+        ~Q(challenge_frequency__in=list(ROTATION_DAYS))
+        & Q(current_challenge__generated_at__lt=rotation_cutoff(today, 1))
+    )
+    return User.objects.filter(due)
+
+
+def assign_challenges(users, rng=None):
+    """
+    Give each user a new current challenge from the static catalog,
+    weighted towards their less-completed categories and avoiding
+    challenges they've done. Categories whose challenges the user has all
+    done are skipped; a user who has done everything allowed gets repeats.
+    """
+    users = list(users)
+    if not users:
+        return AssignmentResult()
+    rng = rng or np.random.default_rng()
+
+    categories = CATALOG.categories()
+    category_index = {category: i for i, category in enumerate(categories)}
+    challenge_index = {challenge['id']: i for i, challenge in enumerate(ALL_CHALLENGES)}
+    challenge_category = np.array([category_index[c['category']] for c in ALL_CHALLENGES])
+    row_of = {user.id: row for row, user in enumerate(users)}
+
+    # Completions of every user in one query: per-category counts (AI
+    # challenges included) and the static challenges already done
+    counts = np.zeros((len(users), len(categories)), dtype=np.int64)
+    done = np.zeros((len(users), len(ALL_CHALLENGES)), dtype=bool)
+    completions = (
+        CompletedChallenge.objects
+        .filter(user_id__in=list(row_of))
+        .values_list('user_id', 'challenge_id', 'category')
+    )
+    for user_id, challenge_id, category in completions.iterator(chunk_size=5000):
+        row = row_of[user_id]
+        if category in category_index:
+            counts[row, category_index[category]] += 1
+        if challenge_id in challenge_index:
+            done[row, challenge_index[challenge_id]] = True
+
+    allowed = np.zeros((len(users), len(categories)), dtype=bool)
+    for row, user in enumerate(users):
+        allowed[row, [category_index[c] for c in allowed_categories(user, categories)]] = True
+
+    # Skip categories with nothing left to do, unless that rules out all of them
+    remaining = (~done).astype(np.int64) @ np.eye(len(categories), dtype=np.int64)[challenge_category]
+    open_categories = allowed & (remaining > 0)
+    allowed = np.where(open_categories.any(axis=1, keepdims=True), open_categories, allowed)
+
+    chosen = sample_rows(category_weights(counts, allowed, rng), rng)
+
+    # Uniform pick among the chosen category's undone challenges (any of
+    # them if all are done)
+    in_category = challenge_category[None, :] == chosen[:, None]
+    candidates = in_category & ~done
+    candidates = np.where(candidates.any(axis=1, keepdims=True), candidates, in_category)
+    picks = np.argmax(np.where(candidates, rng.random(candidates.shape), -1.0), axis=1)
+
+    assignments = {user.id: ALL_CHALLENGES[pick]['id'] for user, pick in zip(users, picks)}
+    return AssignmentResult(*write_assignments(assignments), assignments)
+
+
+def write_assignments(assignments):
+    """Upsert CurrentChallenge rows for {user ID: challenge ID}; returns (created, updated)"""
+    now = timezone.now()
+    with transaction.atomic():
+        existing = list(CurrentChallenge.objects.filter(user_id__in=list(assignments)))
+        for current in existing:
+            challenge_id = assignments[current.user_id]
+            current.challenge_id = challenge_id
+            current.category = CATALOG.get(challenge_id)['category']
+            current.generated_at = now
+        CurrentChallenge.objects.bulk_update(existing, ['challenge_id', 'category', 'generated_at'], batch_size=1000)
+
+        have = {current.user_id for current in existing}
+        CurrentChallenge.objects.bulk_create([
+            CurrentChallenge(user_id=user_id, challenge_id=challenge_id,
+                             category=CATALOG.get(challenge_id)['category'])
+            for user_id, challenge_id in assignments.items() if user_id not in have
+        ], batch_size=1000)
+
+        # Bulk writes don't send post_save, so invalidate explicitly
+        for user_id in assignments:
+            invalidate_user_state(user_id)
+    return len(assignments) - len(existing), len(existing)
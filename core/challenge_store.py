@@ -0,0 +1,149 @@
+"""
+Store for AI-generated challenges.
+Challenges handed out to users are saved in the GeneratedChallenge table so
+their IDs resolve like static ones (current challenge, completed history).
+Lookups go through the static catalog first, then a per-process LRU over
+the table. Generated challenges never change once saved (their IDs are
+derived from their content), so cached entries never need invalidating.
+A semantic index over static and saved generated challenges answers
+"challenges like these" queries; new challenges are added as they're saved.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.models import GeneratedChallenge
+from data.challenges import ALL_CHALLENGES, CATALOG
+from utils import challenge_index
+from utils.semantic_index import SemanticIndex
+
+# Number of generated challenges kept in memory per process
+GENERATED_CHALLENGE_CACHE_SIZE = getattr(settings, 'GENERATED_CHALLENGE_CACHE_SIZE', 1024)
+
+
+class GeneratedChallengeLRU:
+    """Thread-safe LRU of generated challenges, loaded from the database on a miss"""
+
+    def __init__(self, max_size=GENERATED_CHALLENGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0}
+
+    def _put(self, challenge_id, challenge):
+        with self._lock:
+            self._entries[challenge_id] = challenge
+            self._entries.move_to_end(challenge_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, challenge_id):
+        """Get a generated challenge by ID, or None if it was never saved"""
+        with self._lock:
+            challenge = self._entries.get(challenge_id)
+            if challenge is not None:
+                self._entries.move_to_end(challenge_id)
+                self.metrics['hits'] += 1
+                return dict(challenge)
+            self.metrics['misses'] += 1
+
+        row = GeneratedChallenge.objects.filter(challenge_id=challenge_id).first()
+        if row is None:
+            return None
+        challenge = row.as_challenge()
+        self._put(challenge_id, challenge)
+        return dict(challenge)
+
+    def remember(self, challenge):
+        self._put(challenge['id'], dict(challenge))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+GENERATED_CHALLENGES = GeneratedChallengeLRU()
+
+
+def save_generated_challenge(challenge):
+    """
+    Persist a generated challenge so its ID can be resolved later.
+    Returns the challenge under its content-derived ID (model-supplied IDs
+    aren't unique); static challenges are returned unchanged.
+    """
+    if not challenge or challenge.get('id') in CATALOG:
+        return challenge
+
+    challenge = dict(challenge, id=challenge_index.challenge_id(challenge))
+    extra = {
+        key: value for key, value in challenge.items()
+        if key not in ('id', 'title', 'description', 'category', 'difficulty')
+    }
+    digest = challenge_index.fingerprint(challenge)
+    GeneratedChallenge.objects.bulk_create([GeneratedChallenge(
+        challenge_id=challenge['id'],
+        fingerprint=digest,
+        title=challenge.get('title', '')[:200],
+        description=challenge.get('description', ''),
+        category=challenge.get('category', ''),
+        difficulty=challenge.get('difficulty', 'medium'),
+        extra=extra,
+    )], ignore_conflicts=True)
+    # The same content may already be stored under another ID (its category
+    # is part of the ID); then the insert was dropped and that row's ID is
+    # the one every worker can resolve
+    stored = GeneratedChallenge.objects.filter(fingerprint=digest).first()
+    if stored is not None and stored.challenge_id != challenge['id']:
+        challenge = stored.as_challenge()
+        GENERATED_CHALLENGES.remember(challenge)
+        return challenge
+    GENERATED_CHALLENGES.remember(challenge)
+    if _semantic_index is not None:
+        _semantic_index.add([challenge])
+    return challenge
+
+
+def get_generated_challenge(challenge_id):
+    """Catalog source for generated challenge IDs"""
+    return GENERATED_CHALLENGES.get(challenge_id)
+
+
+_semantic_index = None
+_semantic_index_lock = threading.Lock()
+
+
+def get_semantic_index():
+    """Process-wide semantic index over static and generated challenges, built on first use"""
+    global _semantic_index
+    with _semantic_index_lock:
+        if _semantic_index is None:
+            index = SemanticIndex()
+            index.add(ALL_CHALLENGES)
+            rows = GeneratedChallenge.objects.values_list('challenge_id', 'title', 'description')
+            batch = []
+            for challenge_id, title, description in rows.iterator(chunk_size=2000):
+                batch.append({'id': challenge_id, 'title': title, 'description': description})
+                if len(batch) >= 2000:
+                    index.add(batch)
+                    batch = []
+            index.add(batch)
+            _semantic_index = index
+        return _semantic_index
+
+
+def similar_challenges(challenge_ids, k=5, exclude_ids=None):
+    """
+    Up to k challenges most similar to the given ones (e.g. those a couple
+    liked or completed), excluding them and `exclude_ids`. Each challenge
+    comes with its cosine similarity as 'similarity'.
+    """
+    matches = get_semantic_index().similar(challenge_ids, k, exclude=exclude_ids)
+    results = []
+    for challenge_id, score in matches:
+        challenge = CATALOG.resolve(challenge_id)
+        if challenge:
+            challenge['similarity'] = round(score, 4)
+            results.append(challenge)
+    return results
@@ -0,0 +1,192 @@
+"""
+Common per-page user context.
+Loads everything the shared page context needs (profile, progress, badges,
+current challenge, recent completions and viewed content) in a fixed number
+of queries and returns it as an immutable object.
+"""
+
+import datetime
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from django.db.models import CharField, F, Value
+
+from core.models import (
+    User, UserProgress, CompletedChallenge, UserBadge,
+    ViewedArticle, ViewedProduct, CurrentChallenge
+)
+
+# Number of completions shown in the "Recent Activity" list
+RECENT_COMPLETIONS_LIMIT = 5
+
+
+@dataclass(frozen=True)
+class ProfileContext:
+    """Profile fields shown on every page"""
+    partner1_name: str
+    partner2_name: str
+    relationship_status: str
+    relationship_duration: str
+    challenge_frequency: str
+    preferred_categories: Tuple[str, ...]
+    excluded_categories: Tuple[str, ...]
+    initialized: bool = True
+
+
+@dataclass(frozen=True)
+class ProgressContext:
+    """Progress summary and earned badges"""
+    streak: int = 0
+    spark_level: float = 10
+    total_completed: int = 0
+    badges: Tuple[str, ...] = ()
+    last_completed: Optional[datetime.datetime] = None
+
+
+@dataclass(frozen=True)
+class CompletionRow:
+    """A completed challenge as listed in recent activity"""
+    challenge_id: str
+    category: str
+    completed_at: datetime.datetime
+
+
+@dataclass(frozen=True)
+class CurrentChallengeRef:
+    """Pointer to the user's current challenge"""
+    challenge_id: str
+    category: str
+    generated_at: datetime.datetime
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """Everything the shared page context needs for one user"""
+    user_id: int
+    profile: ProfileContext
+    progress: ProgressContext
+    current_challenge: Optional[CurrentChallengeRef]
+    recent_completions: Tuple[CompletionRow, ...]
+    viewed_articles: Tuple[str, ...]
+    viewed_products: Tuple[str, ...]
+
+    def as_template_context(self) -> Dict[str, Any]:
+        """Convert to the keys the templates expect"""
+        return {
+            'user_profile': self.profile,
+            'user_progress': self.progress,
+            'completed_challenges': self.recent_completions,
+            'viewed_articles': self.viewed_articles,
+            'viewed_products': self.viewed_products,
+        }
+
+
+def get_user_with_related(user_id):
+    """
+    Fetch a user together with its progress and current challenge in one query.
+    Returns None if the user doesn't exist.
+    """
+    return (
+        User.objects
+        .select_related('progress', 'current_challenge')
+        .filter(id=user_id)
+        .first()
+    )
+
+
+def _rows(queryset, kind, ref, category, at):
+    """Project a per-user table onto the shared (kind, ref, category, at) shape"""
+    return queryset.annotate(
+        kind=Value(kind, output_field=CharField()),
+        ref=F(ref),
+        cat=category,
+        at=F(at),
+    ).values_list('kind', 'ref', 'cat', 'at')
+
+
+def _activity_query(user_id):
+    """
+    Build one UNION ALL query returning recent completions, badges and
+    viewed articles/products for a user.
+    """
+    no_category = Value('', output_field=CharField())
+    recent_ids = (
+        CompletedChallenge.objects
+        .filter(user_id=user_id)
+        .order_by('-completed_at')
+        .values('id')[:RECENT_COMPLETIONS_LIMIT]
+    )
+
+    completions = _rows(
+        CompletedChallenge.objects.filter(id__in=recent_ids),
+        'completed', 'challenge_id', F('category'), 'completed_at'
+    )
+    return completions.union(
+        _rows(UserBadge.objects.filter(user_id=user_id),
+              'badge', 'badge_name', no_category, 'earned_at'),
+        _rows(ViewedArticle.objects.filter(user_id=user_id),
+              'article', 'article_id', no_category, 'viewed_at'),
+        _rows(ViewedProduct.objects.filter(user_id=user_id),
+              'product', 'product_id', no_category, 'viewed_at'),
+        all=True,
+    )
+
+
+def load_user_context(user):
+    """
+    Load the shared page context for a user.
+
+    Expects `user` to come from get_user_with_related() so progress and the
+    current challenge are already joined; the remaining per-user lists are
+    read with a single UNION ALL query.
+    """
+    completions, badges, articles, products = [], [], [], []
+    buckets = {
+        'completed': completions,
+        'badge': badges,
+        'article': articles,
+        'product': products,
+    }
+    for kind, ref, category, at in _activity_query(user.id):
+        if kind == 'completed':
+            completions.append(CompletionRow(ref, category, at))
+        else:
+            buckets[kind].append((at, ref))
+
+    completions.sort(key=lambda row: row.completed_at, reverse=True)
+
+    try:
+        progress = user.progress
+    except UserProgress.DoesNotExist:
+        # Create progress if it doesn't exist
+        progress = UserProgress.objects.create(user=user)
+
+    try:
+        current = user.current_challenge
+        current_ref = CurrentChallengeRef(current.challenge_id, current.category, current.generated_at)
+    except CurrentChallenge.DoesNotExist:
+        current_ref = None
+
+    return UserContext(
+        user_id=user.id,
+        profile=ProfileContext(
+            partner1_name=user.partner1_name,
+            partner2_name=user.partner2_name,
+            relationship_status=user.relationship_status,
+            relationship_duration=user.relationship_duration,
+            challenge_frequency=user.challenge_frequency,
+            preferred_categories=tuple(user.preferred_categories or ()),
+            excluded_categories=tuple(user.excluded_categories or ()),
+        ),
+        progress=ProgressContext(
+            streak=progress.streak,
+            spark_level=progress.spark_level,
+            total_completed=progress.total_completed,
+            badges=tuple(name for _, name in sorted(badges)),
+            last_completed=progress.last_completed,
+        ),
+        current_challenge=current_ref,
+        recent_completions=tuple(completions),
+        viewed_articles=tuple(ref for _, ref in sorted(articles)),
+        viewed_products=tuple(ref for _, ref in sorted(products)),
+    )
@@ -1,5 +1,7 @@
 from django import forms
+from core.activity import recompute_streaks
 from core.models import User
+from data.streaks import is_known_zone
 
 class UserProfileForm(forms.ModelForm):
     RELATIONSHIP_STATUS_CHOICES = [
@@ -60,6 +62,12 @@ class UserProfileForm(forms.ModelForm):
         widget=forms.Select(attrs={'class': 'form-control'})
     )
     
+    timezone = forms.CharField(
+        max_length=64,
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g. Europe/Paris'})
+    )
+    
     preferred_categories = forms.MultipleChoiceField(
         choices=CATEGORY_CHOICES,
         widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
@@ -76,6 +84,27 @@ class UserProfileForm(forms.ModelForm):
         model = User
         fields = [
             'partner1_name', 'partner2_name', 'relationship_status',
-            'relationship_duration', 'challenge_frequency',
+            'relationship_duration', 'challenge_frequency', 'timezone',
             'preferred_categories', 'excluded_categories'
-        ]
\ No newline at end of file
+        ]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Compared on save: the instance is updated while the form is validated
+        self.previous_timezone = self.instance.timezone if self.instance.pk else None
+    
+    def clean_timezone(self):
+        name = self.cleaned_data.get('timezone', '').strip()
+        if not name:
+            # Left blank: keep the current timezone (UTC for a new profile)
+            return self.instance.timezone
+        if not is_known_zone(name):
+            raise forms.ValidationError("Unknown timezone")
+        return name
+    
+    def save(self, commit=True):
+        user = super().save(commit)
+        if commit and self.previous_timezone is not None and user.timezone != self.previous_timezone:
+            # Days are counted in the couple's timezone, so recount them
+            recompute_streaks([user], rebuild=True)
+        return user
\ No newline at end of file
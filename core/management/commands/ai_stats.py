@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils import ai_metrics
+
+
+class Command(BaseCommand):
+    help = ("Report AI generation usage: calls, tokens, estimated cost, latency, cache hit rate, "
+            "fallbacks and calls saved by coalescing")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24,
+                            help='Report on the last N hours')
+
+    def handle(self, *args, **options):
+        metrics = ai_metrics.get_metrics()
+        summary = metrics.summary(time.time() - options['hours'] * 3600)
+        by_event = summary['by_event']
+
+        self.stdout.write(f"AI usage over the last {options['hours']:g} hours")
+        self.stdout.write(
+            f"Model calls: {summary['calls']} ({summary['failures']} failed attempts), "
+            f"avg latency {summary['avg_latency_ms']:.0f} ms"
+        )
+        self.stdout.write(
+            f"Tokens: {summary['prompt_tokens']} prompt, {summary['response_tokens']} response, "
+            f"estimated cost ${summary['cost']:.4f}"
+        )
+        for operation, count in sorted(by_event[ai_metrics.CALL].items()):
+            self.stdout.write(f"  {operation}: {count} calls")
+        for reason, count in sorted(by_event[ai_metrics.FAILURE].items()):
+            self.stdout.write(f"  failed ({reason}): {count}")
+
+        self.stdout.write(f"Cache hit rate: {summary['cache_hit_rate']:.0%}")
+        categories = set(by_event[ai_metrics.CACHE_HIT]) | set(by_event[ai_metrics.CACHE_MISS])
+        for category in sorted(categories):
+            hits = by_event[ai_metrics.CACHE_HIT].get(category, 0)
+            misses = by_event[ai_metrics.CACHE_MISS].get(category, 0)
+            self.stdout.write(f"  {category}: {hits} hits, {misses} misses ({hits / (hits + misses):.0%})")
+
+        flights = by_event[ai_metrics.FLIGHT]
+        if flights:
+            self.stdout.write(
+                f"Coalesced generations: {flights.get('executions', 0)} executions, "
+                f"{summary['calls_saved']} calls saved ({flights.get('shared_in_process', 0)} in process, "
+                f"{flights.get('shared_across_processes', 0)} across processes)"
+            )
+
+        self.stdout.write(f"Fallback challenges served: {summary['fallbacks']}")
+        for reason, count in sorted(by_event[ai_metrics.FALLBACK].items()):
+            self.stdout.write(f"  {reason}: {count}")
+
+        if by_event[ai_metrics.POLICY]:
+            decisions = ", ".join(f"{count} {reason}" for reason, count in sorted(by_event[ai_metrics.POLICY].items()))
+            self.stdout.write(f"Policy decisions: {decisions}")
+
+        if by_event[ai_metrics.BATCH_ITEMS]:
+            outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(by_event[ai_metrics.BATCH_ITEMS].items()))
+            self.stdout.write(f"Batch items: {outcomes}")
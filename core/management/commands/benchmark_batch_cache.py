@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from utils import ai_generator, ai_metrics
+from utils.challenge_cache import ChallengeCache, MemoryTier
+from utils.challenge_pool import bucket_profile
+from utils.gemini_client import AsyncGenerationClient, FakeModel
+from utils.llm_backends import TemplateModel
+
+
+def fake_batch_response(count, categories):
+    """A batch response spreading `count` challenges over the categories"""
+    return json.dumps([
+        {
+            "id": f"bench_{i}",
+            "title": f"Benchmark challenge {i}",
+            "description": f"Benchmark challenge {i} for {{partner1}} and {{partner2}}",
+            "category": categories[i % len(categories)],
+            "difficulty": "easy",
+        }
+        for i in range(count)
+    ])
+
+
+class Command(BaseCommand):
+    help = "Measure the challenge cache hit rate before and after one batch generation (no network calls)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20,
+                            help='Challenges in the batch')
+        parser.add_argument('--lookups', type=int, default=100,
+                            help='Cache lookups per measurement')
+        parser.add_argument('--local', action='store_true',
+                            help='Compose challenges with the local template backend instead of canned ones')
+
+    def measure(self, cache, profile, lookups):
+        """Look up every bucket of the profile round-robin and return the hit rate"""
+        keys = [ai_generator.get_cache_key(profile, category)
+                for category in ai_generator.CATEGORIES + [None]]
+        before = cache.stats()
+        for i in range(lookups):
+            cache.get(keys[i % len(keys)])
+        after = cache.stats()
+        hits = lookups - (after['misses'] - before['misses'])
+        return hits / lookups if lookups else 0.0
+
+    def handle(self, *args, **options):
+        profile = bucket_profile('Dating', '1-2 years')
+        cache = ChallengeCache(MemoryTier())
+        if options['local']:
+            model = TemplateModel()
+        else:
+            model = FakeModel([fake_batch_response(options['count'], ai_generator.CATEGORIES)])
+        client = AsyncGenerationClient(lambda: model, retries=0)
+
+        # Isolated memory cache, fake model and unstored metrics, so nothing real is touched
+        cold = self.measure(cache, profile, options['lookups'])
+        _, stats = ai_generator.run_batch_pipeline(profile, options['count'], cache=cache, client=client,
+                                                   metrics=ai_metrics.AIMetrics(None))
+        warm = self.measure(cache, profile, options['lookups'])
+
+        self.stdout.write(
+            f"Batch: {stats['parsed']} parsed, {stats['accepted']} accepted, "
+            f"{stats['invalid']} invalid, {stats['duplicates']} duplicates, "
+            f"{sum(stats['stored'].values())} stored in {len(stats['stored'])} buckets"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Hit rate before batch: {cold:.0%}, after batch: {warm:.0%}"
+        ))
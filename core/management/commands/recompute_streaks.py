@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.activity import recompute_streaks
+from core.models import User
+from utils.batching import chunked
+
+
+class Command(BaseCommand):
+    help = "Recompute every couple's current and longest streak from their daily activity"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users recomputed per batch')
+        parser.add_argument('--rebuild-rollups', action='store_true',
+                            help='Rebuild the daily rollups from the completion log first')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        users = User.objects.order_by('id').only('id', 'timezone')
+
+        started = time.monotonic()
+        checked = changed = 0
+        for chunk in chunked(users.iterator(chunk_size=chunk_size), chunk_size):
+            changed += recompute_streaks(chunk, rebuild=options['rebuild_rollups'])
+            checked += len(chunk)
+
+        elapsed = time.monotonic() - started
+        rate = checked / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} users, repaired {changed} streaks in {elapsed:.2f}s, {rate:.0f} users/s"
+        ))
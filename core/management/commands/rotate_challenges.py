@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.assignment import assign_challenges, due_users
+from utils.batching import chunked
+
+
+class Command(BaseCommand):
+    help = "Give every couple whose challenge frequency is due a new current challenge"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users loaded and assigned per batch')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed, for reproducible runs')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the users who are due')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # Only the fields the assigner reads, streamed in id order
+        users = (
+            due_users()
+            .order_by('id')
+            .only('id', 'preferred_categories', 'excluded_categories')
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"{users.count()} users due for a new challenge")
+            return
+
+        rng = np.random.default_rng(options['seed'])
+        started = time.monotonic()
+        assigned = created = updated = 0
+        for chunk in chunked(users.iterator(chunk_size=chunk_size), chunk_size):
+            result = assign_challenges(chunk, rng)
+            assigned += len(chunk)
+            created += result.created
+            updated += result.updated
+
+        elapsed = time.monotonic() - started
+        rate = assigned / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Rotated {assigned} users ({created} new, {updated} replaced) "
+            f"in {elapsed:.2f}s, {rate:.0f} users/s"
+        ))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from core.forms import UserProfileForm
+from utils.challenge_pool import (
+    BATCH_SIZE, POOL_LOW_WATER, POOL_TARGET, bucket_size, iter_buckets, warm_pool
+)
+
+
+def choice_values(choices):
+    """Non-empty values from a form's choice list"""
+    return [value for value, _ in choices if value]
+
+
+class Command(BaseCommand):
+    help = "Pre-generate AI challenges for every profile bucket that is below the low-water mark"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', type=int, default=POOL_TARGET,
+                            help='Challenges to keep per bucket')
+        parser.add_argument('--low-water', type=int, default=POOL_LOW_WATER,
+                            help='Refill buckets holding fewer challenges than this')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Challenges requested per model call')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report bucket sizes')
+
+    def handle(self, *args, **options):
+        buckets = list(iter_buckets(
+            choice_values(UserProfileForm.RELATIONSHIP_STATUS_CHOICES),
+            choice_values(UserProfileForm.RELATIONSHIP_DURATION_CHOICES),
+        ))
+
+        if options['dry_run']:
+            low = 0
+            for profile, category in buckets:
+                size = bucket_size(profile, category)
+                if size < options['low_water']:
+                    low += 1
+                    self.stdout.write(
+                        f"{profile['relationship_status']} / {profile['relationship_duration']} / "
+                        f"{category or 'any'}: {size}"
+                    )
+            self.stdout.write(f"{low} of {len(buckets)} buckets below the low-water mark")
+            return
+
+        stats = warm_pool(buckets, options['target'], options['low_water'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {stats['buckets']} buckets, refilled {stats['refilled']}, "
+            f"added {stats['added']} challenges"
+        ))
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedChallenge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('challenge_id', models.CharField(max_length=50, unique=True)),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField()),
+                ('category', models.CharField(max_length=100)),
+                ('difficulty', models.CharField(default='medium', max_length=20)),
+                ('extra', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copy of core.activity.CATEGORY_ORDER as of this migration
+CATEGORY_ORDER = [
+    "Communication Boosters",
+    "Physical Touch & Affection",
+    "Creative Date Night Ideas",
+    "Sexual Exploration",
+    "Emotional Connection",
+]
+
+
+def backfill_activity(apps, schema_editor):
+    """Seed the event log and daily rollups from existing completions"""
+    CompletedChallenge = apps.get_model('core', 'CompletedChallenge')
+    CompletionEvent = apps.get_model('core', 'CompletionEvent')
+    DailyActivity = apps.get_model('core', 'DailyActivity')
+    bits = {category: 1 << i for i, category in enumerate(CATEGORY_ORDER)}
+
+    events = []
+    days = {}
+    rows = CompletedChallenge.objects.order_by('id').values_list('user_id', 'challenge_id', 'category', 'completed_at')
+    for user_id, challenge_id, category, completed_at in rows.iterator(chunk_size=5000):
+        events.append(CompletionEvent(user_id=user_id, challenge_id=challenge_id, category=category,
+                                      occurred_at=completed_at))
+        key = (user_id, timezone.localtime(completed_at).date())
+        count, mask = days.get(key, (0, 0))
+        days[key] = (count + 1, mask | bits.get(category, 0))
+        if len(events) >= 5000:
+            CompletionEvent.objects.bulk_create(events)
+            events = []
+    CompletionEvent.objects.bulk_create(events)
+    DailyActivity.objects.bulk_create([
+        DailyActivity(user_id=user_id, day=day, count=count, categories=mask)
+        for (user_id, day), (count, mask) in days.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_generatedchallenge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('challenge_id', models.CharField(max_length=50)),
+                ('category', models.CharField(max_length=100)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completion_events', to='core.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'occurred_at'], name='core_comple_user_id_40c00b_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('categories', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activity', to='core.user')),
+            ],
+            options={
+                'unique_together': {('user', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:15
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def seed_longest_streak(apps, schema_editor):
+    # At least the current streak; `manage.py recompute_streaks` fills in the history
+    UserProgress = apps.get_model('core', 'UserProgress')
+    UserProgress.objects.update(longest_streak=F('streak'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_completion_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='timezone',
+            field=models.CharField(default='UTC', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='userprogress',
+            name='longest_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(seed_longest_streak, migrations.RunPython.noop),
+    ]
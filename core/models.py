@@ -9,6 +9,7 @@ class User(models.Model):
     relationship_status = models.CharField(max_length=50)
     relationship_duration = models.CharField(max_length=50)
     challenge_frequency = models.CharField(max_length=20, default="daily")
+    timezone = models.CharField(max_length=64, default="UTC")  # IANA name; days and streaks are counted in it
     preferred_categories = models.JSONField(default=list)
     excluded_categories = models.JSONField(default=list)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -21,6 +22,7 @@ class UserProgress(models.Model):
     """User progress tracking"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='progress')
     streak = models.IntegerField(default=0)
+    longest_streak = models.IntegerField(default=0)
     last_completed = models.DateTimeField(null=True, blank=True)
     spark_level = models.FloatField(default=10.0)
     total_completed = models.IntegerField(default=0)
@@ -41,6 +43,32 @@ class CompletedChallenge(models.Model):
     def __str__(self):
         return f"{self.user} - {self.challenge_id}"
 
+class CompletionEvent(models.Model):
+    """Append-only log of challenge completions; rows are only deleted when the user's progress is reset"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='completion_events')
+    challenge_id = models.CharField(max_length=50)
+    category = models.CharField(max_length=100)
+    occurred_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [models.Index(fields=['user', 'occurred_at'])]
+    
+    def __str__(self):
+        return f"{self.user} - {self.challenge_id} at {self.occurred_at}"
+
+class DailyActivity(models.Model):
+    """Per-user, per-day rollup of completion events, maintained on write (see core.activity)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_activity')
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    categories = models.IntegerField(default=0)  # Bitmask of categories completed, see core.activity.CATEGORY_BITS
+    
+    class Meta:
+        unique_together = ['user', 'day']
+    
+    def __str__(self):
+        return f"{self.user} - {self.day}: {self.count}"
+
 class UserBadge(models.Model):
     """Badges earned by users"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='badges')
@@ -85,4 +113,30 @@ class CurrentChallenge(models.Model):
     generated_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"{self.user} - {self.challenge_id}"
\ No newline at end of file
+        return f"{self.user} - {self.challenge_id}"
+
+class GeneratedChallenge(models.Model):
+    """AI-generated challenge, kept so it can be looked up by ID like static ones"""
+    challenge_id = models.CharField(max_length=50, unique=True)  # Content-derived, see utils.challenge_index
+    fingerprint = models.CharField(max_length=40, unique=True)
+    title = models.CharField(max_length=200)
+    description = models.TextField()
+    category = models.CharField(max_length=100)
+    difficulty = models.CharField(max_length=20, default="medium")
+    extra = models.JSONField(default=dict)  # Optional fields such as estimated_time and benefits
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.challenge_id} - {self.title}"
+    
+    def as_challenge(self):
+        """The challenge as a dict, in the same shape as the static data"""
+        challenge = dict(self.extra)
+        challenge.update({
+            'id': self.challenge_id,
+            'title': self.title,
+            'description': self.description,
+            'category': self.category,
+            'difficulty': self.difficulty,
+        })
+        return challenge
@@ -0,0 +1,109 @@
+"""
+Write-side services for user progress.
+Keeps the multi-table updates behind a challenge completion in one place so
+the HTML views and the REST API share the same transactional logic.
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from core.activity import record_completion
+from core.models import CompletedChallenge, UserBadge, UserProgress
+from core.user_state import invalidate_user_state
+from data.badges import crossed_badges, progress_metrics
+from data.streaks import advance_streak, get_zone, local_day
+
+# Spark level gained per completion, and its cap
+SPARK_PER_COMPLETION = 5
+MAX_SPARK_LEVEL = 100
+
+
+@dataclass(frozen=True)
+class CompletionResult:
+    """Outcome of completing a challenge"""
+    created: bool
+    progress: Optional[UserProgress] = None
+    badges: List[str] = field(default_factory=list)
+
+
+def award_badges(user, before, after):
+    """
+    Award every badge crossed by a progress change in one bulk insert.
+    `before` and `after` are progress_metrics() snapshots.
+    """
+    names = crossed_badges(before, after)
+    if not names:
+        return []
+
+    UserBadge.objects.bulk_create(
+        [UserBadge(user=user, badge_name=name) for name in names],
+        ignore_conflicts=True
+    )
+    # bulk_create doesn't send post_save, so invalidate explicitly
+    invalidate_user_state(user.id)
+    return names
+
+
+def next_streak(progress, now, zone):
+    """Compute the streak after a completion at `now`, counting days in the couple's timezone"""
+    last_day = local_day(progress.last_completed, zone) if progress.last_completed else None
+    return advance_streak(progress.streak, last_day, local_day(now, zone))
+
+
+def complete_challenge(user, challenge_id, category,
+                       on_commit: Optional[Callable[[], None]] = None) -> CompletionResult:
+    """
+    Mark a challenge as completed and update progress in one transaction.
+
+    The progress row is locked with select_for_update, the unique constraint on
+    (user, challenge_id) makes double submits a no-op instead of a pre-check
+    query, and counters are bumped with F() expressions. `on_commit` (e.g.
+    queuing the next challenge) only runs once the transaction commits.
+    """
+    with transaction.atomic():
+        progress, _ = UserProgress.objects.select_for_update().get_or_create(user=user)
+
+        try:
+            # Savepoint so a duplicate doesn't break the outer transaction
+            with transaction.atomic():
+                CompletedChallenge.objects.create(
+                    user=user,
+                    challenge_id=challenge_id,
+                    category=category
+                )
+        except IntegrityError:
+            return CompletionResult(created=False, progress=progress)
+
+        now = timezone.now()
+        zone = get_zone(user.timezone)
+        record_completion(user, challenge_id, category, now, zone)
+        before = progress_metrics(progress.total_completed, progress.streak)
+        streak = next_streak(progress, now, zone)
+
+        UserProgress.objects.filter(pk=progress.pk).update(
+            total_completed=F('total_completed') + 1,
+            spark_level=Least(F('spark_level') + SPARK_PER_COMPLETION, Value(float(MAX_SPARK_LEVEL))),
+            streak=streak,
+            longest_streak=Greatest(F('longest_streak'), Value(streak)),
+            last_completed=now,
+        )
+        # update() doesn't send post_save, so invalidate explicitly
+        invalidate_user_state(user.id)
+
+        # The row is locked, so these are the values that were just written
+        after = progress_metrics(progress.total_completed + 1, streak)
+        badges = award_badges(user, before, after)
+
+        # Return the progress that was just written; the caller's user
+        # instance may be cached state, so it isn't touched
+        progress.refresh_from_db()
+
+        if on_commit:
+            transaction.on_commit(on_commit)
+
+    return CompletionResult(created=True, progress=progress, badges=badges)
@@ -0,0 +1,34 @@
+"""
+Signal handlers that keep the user state cache consistent.
+Any save or delete on a per-user table invalidates that user's cached state.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import (
+    User, UserProgress, CompletedChallenge, UserBadge,
+    ViewedArticle, ViewedProduct, CurrentChallenge, CompletionEvent, DailyActivity
+)
+from core.user_state import invalidate_user_state
+
+USER_OWNED_MODELS = (
+    UserProgress, CompletedChallenge, UserBadge,
+    ViewedArticle, ViewedProduct, CurrentChallenge, CompletionEvent, DailyActivity
+)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_on_user_change(sender, instance, **kwargs):
+    """Invalidate cached state when a user profile changes"""
+    invalidate_user_state(instance.id)
+
+
+def invalidate_on_related_change(sender, instance, **kwargs):
+    """Invalidate cached state when one of a user's rows changes"""
+    invalidate_user_state(instance.user_id)
+
+
+for model in USER_OWNED_MODELS:
+    post_save.connect(invalidate_on_related_change, sender=model)
+    post_delete.connect(invalidate_on_related_change, sender=model)
@@ -1,3 +1,1595 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import (
+    User, UserProgress, CompletedChallenge, UserBadge,
+    ViewedArticle, ViewedProduct, CurrentChallenge, GeneratedChallenge,
+    CompletionEvent, DailyActivity
+)
+from core.context import get_user_with_related, load_user_context
+from core.user_state import get_cache, load_user_state
+from core import services
+from core import challenge_store
+from api.serializers import UserSerializer
+from core.activity import categories_in, rebuild_daily_activity, recompute_streaks, record_completion
+from core.assignment import assign_challenges, category_weights, due_users, sample_rows
+from core.challenge_store import GENERATED_CHALLENGES, save_generated_challenge, similar_challenges
+from core.services import award_badges
+from core.views import decorate_current_challenge, generate_challenge_for_user, get_calendar_data, get_category_stats
+from data.badges import crossed_badges, earned_badges, progress_metrics
+from data.challenges import CATALOG, ChallengeCatalog, get_challenge_by_id
+from data.streaks import Streaks, advance_streak, compute_streaks, get_zone, local_day
+from utils import ai_generator, ai_metrics, challenge_pool
+from utils.challenge_pool import bucket_profile, iter_buckets
+from utils.challenge_cache import ChallengeCache, MemoryTier, SQLiteTier
+from utils.challenge_index import ChallengeIndex, challenge_id
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from utils.ai_policy import AIPolicy, Decision, PolicyConfig, TokenBuckets
+from utils.challenge_provider import request_ai_challenge, schedule_batch_generation
+from utils.gemini_client import AsyncGenerationClient, EventLoopThread, FakeModel, FakeResponse, GenerationError, usage_tokens
+from utils.job_queue import JobQueue
+from utils.json_stream import JSONObjectStream, iter_json_objects
+from utils.semantic_index import SemanticIndex
+from utils.llm_backends import Backend, LocalBackend, OpenAIModel, TemplateModel, get_backend
+from utils.single_flight import ProcessLocks, SingleFlight
+
+
+def create_user(**overrides):
+    """Create a user with progress, as the profile form does"""
+    data = {
+        'partner1_name': 'Alex',
+        'partner2_name': 'Sam',
+        'relationship_status': 'Dating',
+        'relationship_duration': '1-2 years',
+    }
+    data.update(overrides)
+    user = User.objects.create(**data)
+    UserProgress.objects.create(user=user)
+    return user
+
+
+def make_catalog(sizes):
+    """A catalog with `sizes[category]` challenges per category, IDs like 'a_0'"""
+    return ChallengeCatalog([
+        {"id": f"{category}_{i}", "category": category, "title": f"{category} {i}"}
+        for category, size in sizes.items() for i in range(size)
+    ])
+
+
+class ChallengeCatalogTests(SimpleTestCase):
+    def setUp(self):
+        self.catalog = make_catalog({'a': 3, 'b': 2})
+
+    def test_lookups(self):
+        self.assertEqual(len(self.catalog), 5)
+        self.assertIn('b_1', self.catalog)
+        self.assertEqual(self.catalog.get('a_1')['title'], 'a 1')
+        self.assertIsNone(self.catalog.get('missing'))
+        self.assertEqual(self.catalog.categories(), ['a', 'b'])
+        self.assertEqual((self.catalog.category_size('a'), self.catalog.category_size('b')), (3, 2))
+        self.assertEqual(self.catalog.category_size('missing'), 0)
+
+    def test_by_category_keeps_order_and_excludes(self):
+        self.assertEqual([c['id'] for c in self.catalog.by_category('a')], ['a_0', 'a_1', 'a_2'])
+        self.assertEqual([c['id'] for c in self.catalog.by_category('a', ['a_1', 'b_0'])], ['a_0', 'a_2'])
+        self.assertEqual(self.catalog.by_category('missing'), [])
+
+    def test_exclusion_set_normalizes_iterables(self):
+        self.assertEqual(ChallengeCatalog.exclusion_set(None), frozenset())
+        self.assertEqual(ChallengeCatalog.exclusion_set([]), frozenset())
+        self.assertEqual(ChallengeCatalog.exclusion_set(['a_0', 'a_0', 'b_1']), frozenset({'a_0', 'b_1'}))
+        self.assertEqual(ChallengeCatalog.exclusion_set(iter(['a_0'])), frozenset({'a_0'}))
+        excluded = frozenset({'a_0'})
+        self.assertIs(ChallengeCatalog.exclusion_set(excluded), excluded)
+
+    def test_callers_get_copies(self):
+        self.catalog.get('a_0')['title'] = 'changed'
+        self.catalog.by_category('a')[1]['title'] = 'changed'
+        self.catalog.sample(['b'])['title'] = 'changed'
+        self.assertEqual(self.catalog.get('a_0')['title'], 'a 0')
+        self.assertEqual(self.catalog.get('a_1')['title'], 'a 1')
+        self.assertEqual([c['title'] for c in self.catalog.by_category('b')], ['b 0', 'b 1'])
+
+    def test_resolve_falls_back_to_sources(self):
+        generated = {'ai_1': {'id': 'ai_1', 'category': 'a', 'title': 'Generated'}}
+        self.catalog.add_source(generated.get)
+        self.catalog.add_source(generated.get)
+        self.assertEqual(self.catalog._sources, [generated.get])
+        self.assertEqual(self.catalog.resolve('a_0')['title'], 'a 0')
+        self.catalog.resolve('ai_1')['title'] = 'changed'
+        self.assertEqual(self.catalog.resolve('ai_1')['title'], 'Generated')
+        self.assertIsNone(self.catalog.resolve('missing'))
+
+    def test_sample_draws_only_candidates(self):
+        rng = random.Random(20261019)
+        catalog = make_catalog({'a': 7, 'b': 1, 'c': 12, 'd': 4})
+        ids = [c['id'] for category in catalog.categories() for c in catalog.by_category(category)]
+        for _ in range(500):
+            categories = rng.sample(catalog.categories() + ['missing'], rng.randint(1, 5))
+            if rng.random() < 0.2:
+                categories = None
+            excluded = set(rng.sample(ids, rng.randint(0, len(ids)))) | {'not_in_catalog'}
+            candidates = {
+                i for i in ids
+                if i not in excluded and (categories is None or i.split('_')[0] in categories)
+            }
+            with self.subTest(categories=categories, excluded=sorted(excluded)):
+                challenge = catalog.sample(categories, excluded, rng)
+                if candidates:
+                    self.assertIn(challenge['id'], candidates)
+                else:
+                    self.assertIsNone(challenge)
+
+    def test_sample_maps_every_rank_to_a_distinct_candidate(self):
+        class Rank:
+            def __init__(self, value):
+                self.value = value
+
+            def randrange(self, total):
+                assert 0 <= self.value < total
+                return self.value
+
+        catalog = make_catalog({'a': 5, 'b': 3})
+        excluded = {'a_0', 'a_2', 'a_3', 'b_2'}
+        drawn = [catalog.sample(['a', 'b'], excluded, Rank(rank))['id'] for rank in range(4)]
+        self.assertEqual(drawn, ['a_1', 'a_4', 'b_0', 'b_1'])
+
+    def test_sample_returns_none_without_candidates(self):
+        everything = [c['id'] for c in self.catalog.by_category('a') + self.catalog.by_category('b')]
+        self.assertIsNone(self.catalog.sample(None, everything))
+        self.assertIsNone(self.catalog.sample(['a'], ['a_0', 'a_1', 'a_2']))
+        self.assertIsNone(self.catalog.sample(['missing']))
+        self.assertIsNone(self.catalog.sample([]))
+        self.assertEqual(self.catalog.sample(['a', 'b'], ['a_0', 'a_1', 'a_2', 'b_0'])['id'], 'b_1')
+
+    def test_static_catalog_is_indexed(self):
+        self.assertEqual(len(CATALOG), sum(CATALOG.category_size(c) for c in CATALOG.categories()))
+        for category in CATALOG.categories():
+            for challenge in CATALOG.by_category(category):
+                self.assertEqual(CATALOG.get(challenge['id']), challenge)
+                self.assertEqual(challenge['category'], category)
+
+
+class GenerateChallengeAPITests(TestCase):
+    def setUp(self):
+        # The API only allows reads anonymously
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('api', password='x'))
+
+    def draw(self, user, times=30):
+        categories = set()
+        for _ in range(times):
+            response = self.client.post(reverse('generate-challenge'), {'user_id': user.id})
+            self.assertEqual(response.status_code, 200)
+            categories.add(response.json()['category'])
+        return categories
+
+    def test_respects_preferred_and_excluded_categories(self):
+        user = create_user(preferred_categories=['Emotional Connection', 'Sexual Exploration'],
+                           excluded_categories=['Sexual Exploration'])
+        self.assertEqual(self.draw(user), {'Emotional Connection'})
+
+        user = create_user(excluded_categories=['Emotional Connection', 'Communication Boosters'])
+        categories = self.draw(user)
+        self.assertFalse(categories & {'Emotional Connection', 'Communication Boosters'})
+
+    def test_skips_completed_and_reports_when_none_are_left(self):
+        user = create_user(preferred_categories=['Emotional Connection'])
+        remaining = CATALOG.by_category('Emotional Connection')
+        for challenge in remaining[:-1]:
+            CompletedChallenge.objects.create(user=user, challenge_id=challenge['id'], category=challenge['category'])
+        response = self.client.post(reverse('generate-challenge'), {'user_id': user.id})
+        self.assertEqual(response.json()['id'], remaining[-1]['id'])
+        self.assertEqual(CurrentChallenge.objects.get(user=user).challenge_id, remaining[-1]['id'])
+
+        CompletedChallenge.objects.create(user=user, challenge_id=remaining[-1]['id'], category='Emotional Connection')
+        response = self.client.post(reverse('generate-challenge'), {'user_id': user.id})
+        self.assertEqual(response.status_code, 404)
+
+
+class UserContextTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = create_user()
+        CurrentChallenge.objects.create(user=self.user, challenge_id='comm_1', category='Communication Boosters')
+
+    def add_activity(self, count):
+        for i in range(count):
+            CompletedChallenge.objects.create(user=self.user, challenge_id=f'test_{i}', category='Emotional Connection')
+            UserBadge.objects.create(user=self.user, badge_name=f'Badge {i}')
+            ViewedArticle.objects.create(user=self.user, article_id=f'article_{i}')
+            ViewedProduct.objects.create(user=self.user, product_id=f'product_{i}')
+
+    def login(self):
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+
+    def test_load_user_context(self):
+        self.add_activity(8)
+        with self.assertNumQueries(2):
+            context = load_user_context(get_user_with_related(self.user.id))
+
+        self.assertEqual(context.profile.partner1_name, 'Alex')
+        self.assertEqual(len(context.recent_completions), 5)
+        self.assertEqual(context.recent_completions[0].challenge_id, 'test_7')
+        self.assertEqual(len(context.progress.badges), 8)
+        self.assertEqual(len(context.viewed_articles), 8)
+        self.assertEqual(len(context.viewed_products), 8)
+        self.assertEqual(context.current_challenge.challenge_id, 'comm_1')
+
+    def test_context_is_immutable(self):
+        context = load_user_context(get_user_with_related(self.user.id))
+        with self.assertRaises(AttributeError):
+            context.progress.streak = 5
+
+    def test_page_query_count_is_constant(self):
+        # Session, user with progress/current challenge, activity union
+        self.login()
+        self.add_activity(12)
+        for name in ['home', 'education', 'products', 'settings']:
+            with self.subTest(page=name):
+                get_cache().clear()
+                with self.assertNumQueries(3):
+                    response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+
+
+class UserStateCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = create_user()
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+
+    def test_read_only_pages_served_from_cache(self):
+        self.client.get(reverse('home'))
+        for name in ['education', 'products']:
+            with self.subTest(page=name):
+                # Only the session lookup hits the database
+                with self.assertNumQueries(1):
+                    response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+
+    def test_writes_invalidate_cached_state(self):
+        self.assertEqual(load_user_state(self.user.id).context.viewed_articles, ())
+
+        ViewedArticle.objects.create(user=self.user, article_id='article_1')
+        self.assertEqual(load_user_state(self.user.id).context.viewed_articles, ('article_1',))
+
+        self.user.partner1_name = 'Jordan'
+        self.user.save()
+        self.assertEqual(load_user_state(self.user.id).user.partner1_name, 'Jordan')
+
+    def test_writes_use_a_fresh_row(self):
+        self.client.get(reverse('home'))
+        # Changed without signals, so the cached user is now stale
+        User.objects.filter(pk=self.user.pk).update(timezone='Europe/Paris')
+
+        response = self.client.post(reverse('update_profile'), {
+            'partner1_name': 'Jordan', 'partner2_name': 'Sam', 'relationship_status': 'Dating',
+            'relationship_duration': '1-2 years', 'challenge_frequency': 'weekly',
+        })
+        self.assertEqual(response.status_code, 302)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.partner1_name, user.timezone), ('Jordan', 'Europe/Paris'))
+
+
+class CategoryStatsTests(TestCase):
+    def test_counts_use_one_query_and_catalog_totals(self):
+        user = create_user()
+        CompletedChallenge.objects.create(user=user, challenge_id='comm_1', category='Communication Boosters')
+        CompletedChallenge.objects.create(user=user, challenge_id='comm_2', category='Communication Boosters')
+        CompletedChallenge.objects.create(user=user, challenge_id='emo_1', category='Emotional Connection')
+
+        with self.assertNumQueries(1):
+            stats = {row['name']: row for row in get_category_stats(user)}
+
+        communication = stats['Communication Boosters']
+        self.assertEqual(communication['count'], 2)
+        self.assertEqual(communication['total'], CATALOG.category_size('Communication Boosters'))
+        self.assertEqual(communication['percent'], round(2 / communication['total'] * 100))
+        self.assertEqual(stats['Sexual Exploration']['count'], 0)
+
+
+class GeneratedChallengeStoreTests(TestCase):
+    def setUp(self):
+        GENERATED_CHALLENGES.clear()
+        self.challenge = {
+            'id': 'unique_id_1', 'title': 'Memory lane', 'category': 'Emotional Connection',
+            'description': '{partner1}, tell {partner2} about your favourite day together.',
+            'difficulty': 'easy', 'benefits': ['Closeness'],
+        }
+
+    def test_saved_challenge_resolves_by_id(self):
+        saved = save_generated_challenge(self.challenge)
+        self.assertTrue(saved['id'].startswith('ai_emotional_'))
+        GENERATED_CHALLENGES.clear()
+
+        # One query to load it, then served from the LRU
+        with self.assertNumQueries(1):
+            self.assertEqual(get_challenge_by_id(saved['id'])['benefits'], ['Closeness'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_challenge_by_id(saved['id'])['title'], 'Memory lane')
+
+    def test_static_ids_skip_the_table(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_challenge_by_id('comm_1')['id'], 'comm_1')
+        self.assertEqual(save_generated_challenge(get_challenge_by_id('comm_1'))['id'], 'comm_1')
+        self.assertFalse(GeneratedChallenge.objects.exists())
+
+    def test_saving_twice_keeps_one_row(self):
+        save_generated_challenge(self.challenge)
+        save_generated_challenge(dict(self.challenge, id='unique_id_2'))
+        self.assertEqual(GeneratedChallenge.objects.count(), 1)
+
+    def test_same_content_in_another_category_returns_the_stored_id(self):
+        first = save_generated_challenge(self.challenge)
+        second = save_generated_challenge(dict(self.challenge, category='Communication Boosters'))
+        self.assertEqual(second['id'], first['id'])
+        self.assertEqual(GeneratedChallenge.objects.count(), 1)
+        # Resolvable without this process's LRU, e.g. in another worker
+        GENERATED_CHALLENGES.clear()
+        self.assertEqual(get_challenge_by_id(second['id'])['category'], 'Emotional Connection')
+
+    def test_current_ai_challenge_renders(self):
+        user = create_user()
+        with mock.patch('utils.challenge_provider.get_hybrid_challenge', return_value=self.challenge), \
+                mock.patch('utils.challenge_provider.schedule_batch_generation'):
+            challenge = generate_challenge_for_user(user, 'Emotional Connection')
+
+        current = CurrentChallenge.objects.get(user=user)
+        self.assertEqual(current.challenge_id, challenge['id'])
+        GENERATED_CHALLENGES.clear()
+        rendered = decorate_current_challenge(current, user)
+        self.assertEqual(rendered['description'], 'Alex, tell Sam about your favourite day together.')
+
+    def test_saved_challenges_join_the_semantic_index(self):
+        with mock.patch.object(challenge_store, '_semantic_index', None):
+            saved = save_generated_challenge(dict(
+                self.challenge, title='Share a phone-free evening',
+                description='Spend an entire evening without phones or TV, just conversing with each other.'))
+            similar = similar_challenges(['comm_2'], 3)
+            self.assertEqual(similar[0]['id'], saved['id'])
+            self.assertGreater(similar[0]['similarity'], similar[1]['similarity'])
+
+            response = self.client.get(reverse('challenge-similar', args=['comm_2']), {'k': 2})
+            self.assertEqual([c['id'] for c in response.json()], [c['id'] for c in similar[:2]])
+            self.assertEqual(self.client.get(reverse('challenge-similar', args=['nope'])).status_code, 404)
+
+
+class BadgeEngineTests(SimpleTestCase):
+    def test_crossed_badges_only_returns_new_thresholds(self):
+        before = progress_metrics(total_completed=4, streak=2)
+        after = progress_metrics(total_completed=5, streak=3)
+        self.assertEqual(crossed_badges(before, after), ['Flame Starter', '3 Day Streak'])
+
+    def test_crossed_badges_skips_held_badges(self):
+        before = progress_metrics(total_completed=0, streak=0)
+        after = progress_metrics(total_completed=1, streak=1)
+        self.assertEqual(crossed_badges(before, after, existing=['First Spark']), [])
+
+    def test_earned_badges_catches_up(self):
+        metrics = progress_metrics(total_completed=12, streak=7)
+        self.assertEqual(
+            earned_badges(metrics, existing=['First Spark']),
+            ['Flame Starter', 'Burning Bright', '3 Day Streak', '1 Week Connection']
+        )
+
+    def test_sqlalchemy_front_end_awards_in_one_commit(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from database import crud
+        from database.connection import Base
+
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        user = crud.create_user(db, 'Alex', 'Sam', 'Dating', '1-2 years', 'daily', [])
+        progress = crud.get_user_progress(db, user.id)
+        progress.total_completed = 4
+        progress.streak = 2
+        progress.last_completed = datetime.datetime.now() - datetime.timedelta(days=1)
+        db.commit()
+
+        crud.complete_challenge(db, user.id, 'comm_1', 'Communication Boosters')
+        self.assertEqual(crud.get_badge_names(db, user.id), {'Flame Starter', '3 Day Streak'})
+        db.close()
+
+
+class AwardBadgesTests(TestCase):
+    def test_awards_all_crossed_badges_in_one_insert(self):
+        user = create_user()
+        before = progress_metrics(total_completed=0, streak=2)
+        after = progress_metrics(total_completed=1, streak=3)
+
+        with self.assertNumQueries(1):
+            award_badges(user, before, after)
+        # Re-awarding is a no-op thanks to the unique constraint
+        award_badges(user, before, after)
+
+        self.assertEqual(
+            sorted(user.badges.values_list('badge_name', flat=True)),
+            ['3 Day Streak', 'First Spark']
+        )
+
+
+class CompleteChallengeServiceTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+
+    def test_completion_updates_progress_and_badges(self):
+        result = services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+
+        self.assertTrue(result.created)
+        self.assertEqual(result.progress.total_completed, 1)
+        self.assertEqual(result.progress.streak, 1)
+        self.assertEqual(result.progress.spark_level, 15)
+        self.assertEqual(result.badges, ['First Spark'])
+
+    def test_double_submit_is_idempotent(self):
+        services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+        result = services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+
+        self.assertFalse(result.created)
+        self.assertEqual(CompletedChallenge.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UserProgress.objects.get(user=self.user).total_completed, 1)
+
+    def test_spark_level_is_capped(self):
+        UserProgress.objects.filter(user=self.user).update(spark_level=98)
+        result = services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+        self.assertEqual(result.progress.spark_level, 100)
+
+    def test_follow_up_runs_after_commit(self):
+        calls = []
+        with self.captureOnCommitCallbacks(execute=True):
+            services.complete_challenge(
+                self.user, 'comm_1', 'Communication Boosters',
+                on_commit=lambda: calls.append('next')
+            )
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, ['next'])
+
+    def test_view_queues_the_next_challenge(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        queue = JobQueue(os.path.join(directory.name, 'jobs.db'), workers=0)
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+
+        with mock.patch('core.views.get_queue', return_value=queue), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('complete_challenge'),
+                                        {'challenge_id': 'comm_1', 'category': 'Communication Boosters'})
+        self.assertEqual(response.status_code, 302)
+        # Nothing generated during the request
+        self.assertFalse(CurrentChallenge.objects.filter(user=self.user).exists())
+        self.assertEqual(queue.stats(), {'pending': 1})
+
+        self.assertTrue(queue.run_next())
+        self.assertEqual(queue.stats(), {'done': 1})
+        self.assertNotEqual(CurrentChallenge.objects.get(user=self.user).challenge_id, 'comm_1')
+
+
+class CompletionActivityTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+
+    def test_completions_roll_up_per_day(self):
+        services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+        services.complete_challenge(self.user, 'emo_1', 'Emotional Connection')
+        services.complete_challenge(self.user, 'emo_1', 'Emotional Connection')
+
+        # The double submit isn't logged
+        self.assertEqual(CompletionEvent.objects.filter(user=self.user).count(), 2)
+        rollup = DailyActivity.objects.get(user=self.user)
+        self.assertEqual(rollup.day, timezone.localdate())
+        self.assertEqual(rollup.count, 2)
+        self.assertEqual(categories_in(rollup.categories), ['Communication Boosters', 'Emotional Connection'])
+
+    def test_calendar_reads_the_rollup(self):
+        services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+        with self.assertNumQueries(1):
+            days = get_calendar_data(self.user)['calendar_days']
+        self.assertEqual([d['number'] for d in days if d['active']], [timezone.localdate().day])
+
+    def test_rebuild_matches_maintained_rollups(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        record_completion(self.user, 'comm_1', 'Communication Boosters', yesterday)
+        record_completion(self.user, 'touch_1', 'Physical Touch & Affection', yesterday)
+        record_completion(self.user, 'ai_x', 'Relationship Challenge')
+        maintained = list(DailyActivity.objects.order_by('day').values_list('day', 'count', 'categories'))
+
+        DailyActivity.objects.all().delete()
+        self.assertEqual(rebuild_daily_activity([self.user.id]), 2)
+        rebuilt = list(DailyActivity.objects.order_by('day').values_list('day', 'count', 'categories'))
+        self.assertEqual(rebuilt, maintained)
+        # Categories outside the catalog count but set no bit
+        self.assertEqual(maintained[1][1:], (1, 0))
+
+    def test_reset_clears_the_activity(self):
+        services.complete_challenge(self.user, 'comm_1', 'Communication Boosters')
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+
+        response = self.client.post(reverse('reset_progress'))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(CompletionEvent.objects.filter(user=self.user).exists())
+        self.assertFalse(DailyActivity.objects.filter(user=self.user).exists())
+        self.user.refresh_from_db()
+        self.assertFalse(any(d['active'] for d in get_calendar_data(self.user)['calendar_days']))
+        # Recomputing finds nothing to bring back, even from the event log
+        self.assertEqual(recompute_streaks([self.user]), 0)
+        self.assertEqual(recompute_streaks([self.user], rebuild=True), 0)
+        progress = UserProgress.objects.get(user=self.user)
+        self.assertEqual((progress.streak, progress.longest_streak), (0, 0))
+
+
+class JobQueueTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # No worker threads: jobs are run explicitly with run_next()
+        self.queue = JobQueue(os.path.join(directory.name, 'jobs.db'), workers=0)
+
+    def test_dedupes_active_jobs(self):
+        ran = []
+        self.queue.register('echo', lambda payload: ran.append(payload['n']))
+
+        self.assertTrue(self.queue.submit('echo', {'n': 1}, dedupe_key='same'))
+        self.assertFalse(self.queue.submit('echo', {'n': 2}, dedupe_key='same'))
+        self.assertTrue(self.queue.run_next())
+        self.assertFalse(self.queue.run_next())
+        self.assertEqual(ran, [1])
+
+        # Once finished, the same key can be queued again
+        self.assertTrue(self.queue.submit('echo', {'n': 3}, dedupe_key='same'))
+
+    def test_failed_jobs_back_off_then_are_marked_failed(self):
+        def fail(payload):
+            raise RuntimeError('model unavailable')
+        self.queue.register('fail', fail)
+        self.queue.submit('fail', {})
+
+        now = time.time()
+        self.assertTrue(self.queue.run_next())
+        # Not retried until the backoff has passed, then after twice as long
+        for delay, retried in [(0, False), (31, True), (61, False), (121, True)]:
+            with mock.patch('utils.job_queue.time.time', return_value=now + delay):
+                self.assertEqual(self.queue.run_next(), retried)
+        self.assertEqual(self.queue.stats(), {'failed': 1})
+
+    def test_only_claims_kinds_with_a_handler(self):
+        self.queue.submit('elsewhere', {})
+        self.assertFalse(self.queue.run_next())
+        self.assertEqual(self.queue.stats(), {'pending': 1})
+
+    def test_finished_jobs_are_purged_after_retention(self):
+        self.queue.register('echo', lambda payload: None)
+        self.queue.submit('echo', {})
+        self.queue.run_next()
+        self.assertEqual(self.queue.purge(), 0)
+
+        with mock.patch('utils.job_queue.time.time', return_value=time.time() + self.queue.retention + 1):
+            self.assertEqual(self.queue.purge(), 1)
+        self.assertEqual(self.queue.stats(), {})
+
+
+class ChallengeCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.db')
+
+    def make_cache(self, **kwargs):
+        return ChallengeCache(MemoryTier(max_keys=2), SQLiteTier(self.path), **kwargs)
+
+    def test_persistent_tier_survives_restart(self):
+        self.make_cache().set('key', [{'id': 'ai_1'}])
+
+        cache = self.make_cache()
+        self.assertEqual(cache.get('key'), [{'id': 'ai_1'}])
+        self.assertEqual(cache.get('key'), [{'id': 'ai_1'}])
+        self.assertEqual(cache.get('missing'), [])
+        stats = cache.stats()
+        self.assertEqual((stats['persistent_hits'], stats['memory_hits'], stats['misses']), (1, 1, 1))
+
+    def test_per_key_capacity_keeps_newest(self):
+        cache = self.make_cache(max_per_key=3)
+        cache.extend('key', [{'id': f'ai_{i}'} for i in range(5)])
+        self.assertEqual([c['id'] for c in cache.get('key')], ['ai_2', 'ai_3', 'ai_4'])
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        memory = MemoryTier(max_keys=2)
+        memory.set('a', [1])
+        memory.set('b', [2])
+        memory.get('a')
+        memory.set('c', [3])
+        self.assertIsNone(memory.get('b'))
+        self.assertEqual(memory.get('a'), [1])
+
+
+class AsyncGenerationClientTests(SimpleTestCase):
+    def make_client(self, model, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return AsyncGenerationClient(lambda: model, loop_thread=EventLoopThread(), **kwargs)
+
+    def test_model_handle_is_reused(self):
+        created = []
+        client = AsyncGenerationClient(lambda: created.append(1) or FakeModel(), backoff=0)
+        client.generate_sync('one')
+        client.generate_sync('two')
+        self.assertEqual(len(created), 1)
+
+    def test_retries_failures(self):
+        model = FakeModel(responses=['ok'], failures=2)
+        client = self.make_client(model, retries=2)
+        self.assertEqual(client.generate_sync('prompt'), 'ok')
+        self.assertEqual(model.calls, 3)
+
+    def test_gives_up_after_deadline(self):
+        client = self.make_client(FakeModel(latency=0.2), timeout=0.01, retries=1)
+        with self.assertRaises(GenerationError):
+            client.generate_sync('prompt')
+
+    def test_concurrency_is_limited(self):
+        model = FakeModel(responses=['ok'], latency=0.02)
+        client = self.make_client(model, concurrency=2)
+        results = client.generate_many_sync(['prompt'] * 6)
+        self.assertEqual(results, ['ok'] * 6)
+        self.assertLessEqual(model.max_active, 2)
+
+    def test_timed_out_calls_still_hold_a_thread(self):
+        # Each attempt times out but its blocking call keeps running
+        model = FakeModel(responses=['ok'], latency=0.1)
+        client = self.make_client(model, concurrency=2, timeout=0.01, retries=2)
+        results = client.generate_many_sync(['prompt'] * 4)
+        self.assertTrue(all(isinstance(result, GenerationError) for result in results))
+        client.executor.shutdown(wait=True)
+        self.assertLessEqual(model.max_active, 2)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_execution(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def generate():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'challenge'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', generate)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', generate))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        # Give followers a moment to join the in-flight call
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(results, ['challenge'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()['calls_saved'], 4)
+
+    def test_waits_for_other_process_holding_the_lock(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        locks = ProcessLocks(os.path.join(directory.name, 'locks.db'))
+        flight = SingleFlight(locks, poll_interval=0.01)
+
+        # Another process is generating this key and fills the cache on the second poll
+        self.assertTrue(locks.acquire('key'))
+        polls = []
+        def check():
+            polls.append(1)
+            return 'from other process' if len(polls) > 1 else None
+
+        self.assertEqual(flight.do('key', lambda: 'generated here', check=check), 'from other process')
+        self.assertEqual(flight.stats()['shared_across_processes'], 1)
+
+    def test_leader_renews_its_lock_while_generating(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        locks = ProcessLocks(os.path.join(directory.name, 'locks.db'), ttl=0.15)
+        flight = SingleFlight(locks)
+        held = []
+
+        def generate():
+            # Runs for several TTLs; another process must still see the lock
+            for _ in range(5):
+                time.sleep(0.1)
+                held.append(locks.is_held('key'))
+            return 'challenge'
+
+        self.assertEqual(flight.do('key', generate, check=lambda: None), 'challenge')
+        self.assertEqual(held, [True] * 5)
+        self.assertFalse(locks.is_held('key'))
+
+    def test_counts_are_recorded_in_the_metrics(self):
+        metrics = ai_metrics.AIMetrics(None)
+        flight = SingleFlight(recorder=metrics)
+        flight.do('key', lambda: 'challenge')
+        flight.do('key', lambda: 'challenge')
+        self.assertEqual(
+            {key[1:]: totals[0] for key, totals in metrics._pending.items()},
+            {(ai_metrics.FLIGHT, 'executions'): 2}
+        )
+
+
+class AIStoreTestMixin:
+    """
+    Starts each test with an empty AI challenge cache and content index.
+    The test runner keeps the cache's SQLite file in a temporary directory.
+    """
+
+    def setUp(self):
+        super().setUp()
+        ai_generator.CHALLENGE_CACHE.clear()
+        ai_generator.GENERATED_INDEX.clear()
+
+
+class BatchClient:
+    """Stands in for the generation client, answering batch prompts with unique challenges"""
+
+    def __init__(self, category='Communication Boosters'):
+        self.category = category
+        self.calls = 0
+
+    def generate_sync(self, prompt):
+        self.calls += 1
+        count = int(prompt.split()[1])
+        return json.dumps([
+            {'id': f'ai_{self.calls}_{i}', 'title': f'Challenge {self.calls}.{i}',
+             'description': 'Do something nice', 'category': self.category, 'difficulty': 'easy'}
+            for i in range(count)
+        ])
+
+    def stream_sync(self, prompt):
+        text = self.generate_sync(prompt)
+        return (text[i:i + 50] for i in range(0, len(text), 50))
+
+
+class ChallengePoolTests(AIStoreTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = BatchClient('Emotional Connection')
+        patcher = mock.patch.object(ai_generator, 'get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enumerates_every_bucket(self):
+        buckets = list(iter_buckets(['Dating', 'Married'], ['1-2 years']))
+        # Every category plus the "any category" bucket
+        self.assertEqual(len(buckets), 2 * (len(challenge_pool.CATEGORIES) + 1))
+
+    def test_only_refills_buckets_below_low_water(self):
+        full = bucket_profile('Dating', '1-2 years')
+        empty = bucket_profile('Married', '1-2 years')
+        ai_generator.CHALLENGE_CACHE.set(challenge_pool.get_cache_key(full, 'Emotional Connection'), [{'id': 'x'}] * 5)
+
+        stats = challenge_pool.warm_pool(
+            [(full, 'Emotional Connection'), (empty, 'Emotional Connection')],
+            target=6, low_water=3, batch_size=4
+        )
+        self.assertEqual(stats, {'buckets': 2, 'refilled': 1, 'added': 6})
+        self.assertEqual(challenge_pool.bucket_size(empty, 'Emotional Connection'), 6)
+        self.assertEqual(self.client.calls, 2)
+
+
+class BatchPipelineTests(AIStoreTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = bucket_profile('Dating', '1-2 years')
+
+    def test_benchmark_command_leaves_the_shared_stores_alone(self):
+        out = io.StringIO()
+        with mock.patch.object(ai_generator, 'get_client') as get_client:
+            call_command('benchmark_batch_cache', count=12, lookups=24, stdout=out)
+        self.assertIn('Hit rate before batch: 0%, after batch: 100%', out.getvalue())
+        get_client.assert_not_called()
+        self.assertEqual(ai_generator.CHALLENGE_CACHE.peek(ai_generator.get_cache_key(self.profile)), [])
+
+    def run_with_response(self, items):
+        return self.run_with_text('```json\n' + json.dumps(items) + '\n```', len(items))
+
+    def run_with_text(self, text, count=5):
+        model = FakeModel([text], chunk_size=7)
+        client = AsyncGenerationClient(lambda: model, retries=0)
+        with mock.patch.object(ai_generator, 'get_client', return_value=client):
+            return ai_generator.run_batch_pipeline(self.profile, count)
+
+    def challenge(self, title, category='Emotional Connection', **overrides):
+        item = {'id': title, 'title': title, 'description': 'Hold hands', 'category': category,
+                'difficulty': 'easy'}
+        item.update(overrides)
+        return item
+
+    def test_successful_batch_populates_cache(self):
+        accepted, stats = self.run_with_response([
+            self.challenge('One'), self.challenge('Two', category='Communication Boosters'),
+        ])
+        self.assertEqual(len(accepted), 2)
+        self.assertEqual(len(ai_generator.check_cache(ai_generator.get_cache_key(self.profile, 'Emotional Connection'))), 1)
+        self.assertEqual(len(ai_generator.check_cache(ai_generator.get_cache_key(self.profile))), 2)
+        self.assertEqual(stats['accepted'], 2)
+
+    def test_rejects_invalid_and_duplicate_items(self):
+        accepted, stats = self.run_with_response([
+            self.challenge('One'),
+            self.challenge('  one ', id='other'),  # Same content after normalization
+            self.challenge('Two', category='Unknown'),
+            self.challenge('Three', difficulty='HARD'),
+            {'title': 'Missing fields'},
+        ])
+        self.assertEqual([c['title'] for c in accepted], ['One', 'Three'])
+        self.assertEqual(accepted[1]['difficulty'], 'hard')
+        self.assertEqual((stats['parsed'], stats['invalid'], stats['duplicates']), (5, 2, 1))
+
+    def test_dedupes_against_existing_cache(self):
+        self.run_with_response([self.challenge('One')])
+        _, stats = self.run_with_response([self.challenge('One'), self.challenge('Two')])
+        key = ai_generator.get_cache_key(self.profile, 'Emotional Connection')
+        self.assertEqual(stats['stored'][key], 1)
+        self.assertEqual(len(ai_generator.CHALLENGE_CACHE.peek(key)), 2)
+
+    def test_unparseable_response_stores_nothing(self):
+        accepted, stats = self.run_with_text('Sorry, I cannot help with that.')
+        self.assertEqual(accepted, [])
+        self.assertEqual(stats['stored'], {})
+
+    def test_salvages_valid_items_around_malformed_and_truncated_ones(self):
+        text = (
+            '[' + json.dumps(self.challenge('One')) + ',\n'
+            '{"id": "bad", "title": "Missing comma" "description": "x"},\n'
+            + json.dumps(self.challenge('Two {with braces} and \\"quotes\\"')) + ',\n'
+            '{"id": "cut", "title": "Cut off mid-'
+        )
+        accepted, stats = self.run_with_text(text)
+        self.assertEqual(len(accepted), 2)
+        self.assertEqual(stats['malformed'], 1)
+        self.assertTrue(stats['truncated'])
+
+    def test_large_batch_is_parsed_incrementally(self):
+        items = [self.challenge(f'Challenge {i}') for i in range(60)]
+        accepted, stats = self.run_with_response(items)
+        self.assertEqual(stats['accepted'], 60)
+
+    def test_known_challenges_keep_their_id(self):
+        first, _ = self.run_with_response([self.challenge('One', id='unique_id_1')])
+        second, stats = self.run_with_response([self.challenge('ONE!', id='unique_id_1')])
+        self.assertEqual(first[0]['id'], second[0]['id'])
+        self.assertTrue(first[0]['id'].startswith('ai_emotional_'))
+        self.assertEqual(stats['known'], 1)
+
+
+class ChallengeIndexTests(SimpleTestCase):
+    description = ('Sit facing each other and take turns describing the moment you first knew '
+                   'you wanted to spend more time together, then share what you feel today.')
+
+    def challenge(self, description, title='Looking back'):
+        return {'title': title, 'description': description, 'category': 'Emotional Connection'}
+
+    def test_ids_are_derived_from_content(self):
+        self.assertEqual(challenge_id(self.challenge(self.description)),
+                         challenge_id(self.challenge('  ' + self.description.upper())))
+        self.assertNotEqual(challenge_id(self.challenge(self.description)),
+                            challenge_id(self.challenge('Something else entirely')))
+
+    def test_detects_near_duplicates(self):
+        index = ChallengeIndex()
+        original, added = index.add(self.challenge(self.description))
+        self.assertTrue(added)
+
+        reworded = self.challenge(self.description.replace('share what you feel today', 'share what you feel now'))
+        canonical, added = index.add(reworded)
+        self.assertFalse(added)
+        self.assertEqual(canonical['id'], original['id'])
+
+        _, added = index.add(self.challenge('Cook a meal together using only five ingredients.', 'Chef night'))
+        self.assertTrue(added)
+        self.assertEqual(len(index), 2)
+
+    def test_index_is_bounded(self):
+        index = ChallengeIndex(max_size=3)
+        challenges = [self.challenge(f'Challenge number {i}: {word} together tonight', f'Title {i}')
+                      for i, word in enumerate(['cook', 'dance', 'walk', 'read', 'paint'])]
+        for challenge in challenges[:3]:
+            index.add(challenge)
+        # Matching the oldest keeps it; the next least recently used goes
+        self.assertIsNotNone(index.find_duplicate(challenges[0]))
+        index.add(challenges[0])
+        index.add(challenges[3])
+        index.add(challenges[4])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(len(index._signatures), 3)
+        self.assertEqual({fp for band in index._bands.values() for fp in band}, set(index._signatures))
+        self.assertIsNotNone(index.find_duplicate(challenges[0]))
+        self.assertIsNone(index.find_duplicate(challenges[1]))
+        self.assertIsNone(index.find_duplicate(challenges[2]))
+
+    def test_exact_only_index(self):
+        index = ChallengeIndex(near_duplicates=False)
+        index.add(self.challenge(self.description))
+        reworded = self.challenge(self.description.replace('today', 'now'))
+        self.assertIsNone(index.find_duplicate(reworded))
+
+
+class RequestAIChallengeTests(AIStoreTestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('utils.challenge_provider.get_job_queue')
+        self.queue = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.policy = AIPolicy(PolicyConfig(user_calls_per_day=1), TokenBuckets(None))
+        patcher = mock.patch('utils.challenge_provider.get_policy', return_value=self.policy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', None, failure_threshold=1)
+        patcher = mock.patch('utils.challenge_provider.AI_BREAKER', self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.profile = bucket_profile('Dating', '1-2 years')
+
+    def test_skips_completed_ai_challenges(self):
+        key = ai_generator.get_cache_key(self.profile, 'Emotional Connection')
+        ai_generator.CHALLENGE_CACHE.set(key, [{'id': 'ai_a'}, {'id': 'ai_b'}])
+
+        for _ in range(5):
+            self.assertEqual(request_ai_challenge(self.profile, 'Emotional Connection', ['ai_a'])['id'], 'ai_b')
+        self.assertIsNone(request_ai_challenge(self.profile, 'Emotional Connection', ['ai_a', 'ai_b']))
+        kind, payload = self.queue.submit.call_args[0]
+        self.assertEqual(kind, 'refill_challenge_pool')
+        self.assertEqual(payload['target'], 2 + challenge_pool.POOL_TARGET)
+
+    def test_requests_let_a_breaker_opened_elsewhere_recover(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'breaker.db')
+        # Opened by another process (or before a restart): no timer here
+        CircuitBreaker('test', path, failure_threshold=1).record_failure()
+        probed = threading.Event()
+        breaker = CircuitBreaker('test', path, failure_threshold=1, reset_timeout=0, probe=probed.set)
+        self.queue.submit.return_value = True
+
+        with mock.patch('utils.challenge_provider.AI_BREAKER', breaker):
+            self.assertIsNone(request_ai_challenge(self.profile, 'Emotional Connection', generate=True))
+            # The request started the probe instead of queuing a job
+            self.assertTrue(probed.wait(1))
+            self.queue.submit.assert_not_called()
+            for _ in range(100):
+                if breaker.state() == CLOSED:
+                    break
+                time.sleep(0.01)
+            request_ai_challenge(self.profile, 'Emotional Connection', generate=True)
+        self.assertEqual(self.queue.submit.call_count, 1)
+
+    def test_job_payloads_hold_no_names(self):
+        profile = {'partner1_name': 'Alex', 'partner2_name': 'Sam', 'user_id': 7,
+                   'relationship_status': 'Dating', 'relationship_duration': '1-2 years'}
+        self.queue.submit.return_value = True
+        request_ai_challenge(profile, 'Emotional Connection', generate=True)
+        with mock.patch('utils.challenge_provider.AI_ENABLED', True):
+            schedule_batch_generation(profile)
+
+        self.assertEqual(self.queue.submit.call_count, 2)
+        for call in self.queue.submit.call_args_list:
+            kind, payload = call[0]
+            with self.subTest(kind=kind):
+                self.assertEqual(payload['user_profile'], self.profile)
+                self.assertNotIn('Alex', json.dumps(payload))
+
+    def test_batch_prompt_asks_for_placeholders(self):
+        named = dict(self.profile, partner1_name='Alex', partner2_name='Sam', user_id=7)
+        prompt = ai_generator.build_batch_prompt(named, 3, ['Emotional Connection'])
+        self.assertNotIn('Alex', prompt)
+        self.assertIn('{partner1} and {partner2}', prompt)
+
+    def test_jobs_are_charged_to_the_user_budget(self):
+        profile = dict(self.profile, user_id=1)
+        self.queue.submit.return_value = True
+        request_ai_challenge(profile, 'Emotional Connection')
+        request_ai_challenge(profile, 'Emotional Connection')
+        # The user's one call a day was used by the first request
+        self.assertEqual(self.queue.submit.call_count, 1)
+
+        # Deduplicated jobs aren't charged
+        self.queue.submit.return_value = False
+        request_ai_challenge(self.profile, 'Emotional Connection')
+        request_ai_challenge(self.profile, 'Emotional Connection')
+        self.assertEqual(self.queue.submit.call_count, 3)
+
+    def test_no_jobs_while_breaker_is_open(self):
+        self.breaker.record_failure()
+        self.assertIsNone(request_ai_challenge(self.profile, 'Emotional Connection'))
+        self.queue.submit.assert_not_called()
+
+
+class JSONObjectStreamTests(SimpleTestCase):
+    def test_yields_objects_as_they_close(self):
+        stream = JSONObjectStream()
+        self.assertEqual(stream.feed('Here you go: [{"a": {"b": "}"}}, {"c"'), [{'a': {'b': '}'}}])
+        self.assertTrue(stream.truncated)
+        self.assertEqual(stream.feed(': [1]}]'), [{'c': [1]}])
+        self.assertFalse(stream.truncated)
+
+    def test_stream_sync_retries_before_first_chunk(self):
+        model = FakeModel(['{"a": 1}'], failures=1, chunk_size=3)
+        client = AsyncGenerationClient(lambda: model, retries=1, backoff=0)
+        self.assertEqual(list(iter_json_objects(client.stream_sync('prompt'))), [{'a': 1}])
+        self.assertEqual(model.calls, 2)
+
+
+class AIMetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.metrics = ai_metrics.AIMetrics(os.path.join(directory.name, 'metrics.db'), flush_interval=3600)
+
+    def test_aggregates_and_summarizes(self):
+        self.metrics.record_call('generate', 1000, 200, 0.5)
+        self.metrics.record_call('generate', 1000, 200, 1.5)
+        self.metrics.record_failure('timeout')
+        self.metrics.record(ai_metrics.CACHE_HIT, 'Emotional Connection', count=3)
+        self.metrics.record(ai_metrics.CACHE_MISS, 'Emotional Connection')
+        self.metrics.record(ai_metrics.FALLBACK, 'generation_failed')
+        self.metrics.record_flight('executions')
+        self.metrics.record_flight('shared_in_process')
+        self.metrics.record_flight('shared_across_processes')
+
+        summary = self.metrics.summary()
+        self.assertEqual((summary['calls'], summary['failures'], summary['fallbacks']), (2, 1, 1))
+        self.assertEqual(summary['calls_saved'], 2)
+        self.assertEqual((summary['prompt_tokens'], summary['response_tokens']), (2000, 400))
+        self.assertAlmostEqual(summary['avg_latency_ms'], 1000)
+        self.assertAlmostEqual(summary['cache_hit_rate'], 0.75)
+        self.assertAlmostEqual(summary['cost'], ai_metrics.estimate_cost(2000, 400))
+
+        # Counters for the same minute share one row
+        self.metrics.record_call('generate', 10, 10, 0.1)
+        self.metrics.flush()
+        with self.metrics._connect() as conn:
+            count, = conn.execute("SELECT count FROM ai_metrics WHERE event = 'call'").fetchone()
+        self.assertEqual(count, 3)
+
+    def test_stats_command_reports_calls_saved(self):
+        self.metrics.record_flight('executions')
+        self.metrics.record_flight('shared_in_process')
+        out = io.StringIO()
+        with mock.patch.object(ai_metrics, 'get_metrics', return_value=self.metrics):
+            call_command('ai_stats', stdout=out)
+        self.assertIn('Coalesced generations: 1 executions, 1 calls saved', out.getvalue())
+
+    def test_client_records_calls_and_failures(self):
+        model = FakeModel(['{"a": 1}'], failures=1)
+        client = AsyncGenerationClient(lambda: model, retries=1, backoff=0, recorder=self.metrics)
+        client.generate_sync('x' * 400)
+        self.assertEqual(list(iter_json_objects(client.stream_sync('prompt'))), [{'a': 1}])
+
+        summary = self.metrics.summary()
+        self.assertEqual(summary['by_event'][ai_metrics.CALL], {'generate': 1, 'stream': 1})
+        self.assertEqual(summary['by_event'][ai_metrics.FAILURE], {'RuntimeError': 1})
+        # No usage reported by the fake, so tokens are estimated from the text
+        self.assertEqual(summary['prompt_tokens'], 100 + ai_metrics.estimate_tokens('prompt'))
+
+    def test_reads_reported_usage(self):
+        response = FakeResponse('text')
+        self.assertIsNone(usage_tokens(response))
+        response.usage_metadata = mock.Mock(prompt_token_count=12, candidates_token_count=34)
+        self.assertEqual(usage_tokens(response), (12, 34))
+
+
+class AIPolicyTests(SimpleTestCase):
+    def setUp(self):
+        self.config = PolicyConfig(calls_per_minute=2, calls_per_day=100, user_calls_per_day=10)
+        self.policy = AIPolicy(self.config, TokenBuckets(None))
+        self.available = [f'emo_{i}' for i in range(10)]
+
+    def decide(self, completed=(), cached=0, needs_generation=True, **profile):
+        profile.setdefault('user_id', 1)
+        return self.policy.decide(profile, list(completed), self.available, 'Emotional Connection',
+                                  cached=cached, needs_generation=needs_generation)
+
+    def test_rules_and_cache_fill(self):
+        self.assertEqual(self.decide(self.available[:5]).reason, 'not_eligible')
+        # A cached AI challenge lowers the bar and needs no model call
+        decision = self.decide(self.available[:5], cached=3, needs_generation=False)
+        self.assertEqual((decision.use_ai, decision.generate), (True, False))
+        self.assertEqual(self.decide(self.available[:7]).reason, 'category_completion')
+        self.assertEqual(self.decide(streak=7).reason, 'streak_milestone')
+        self.assertEqual(self.decide(total_completed=20).reason, 'completion_milestone')
+
+    def test_degrades_to_static_when_budget_is_spent(self):
+        self.assertTrue(self.policy.spend(1))
+        self.assertTrue(self.policy.spend(2))
+        # Per-minute budget gone: static unless something is cached
+        self.assertEqual(self.decide(streak=7), Decision(False, False, 'budget_exhausted'))
+        self.assertEqual(self.decide(streak=7, cached=1), Decision(True, False, 'budget_exhausted'))
+
+    def test_token_buckets_refill(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        buckets = TokenBuckets(os.path.join(directory.name, 'budget.db'))
+        limits = [('minute', 2, 2 / 60), ('user', 5, 0)]
+        with mock.patch('utils.ai_policy.time.time', return_value=1000.0):
+            self.assertTrue(buckets.try_consume(limits))
+            self.assertTrue(buckets.try_consume(limits))
+            self.assertFalse(buckets.try_consume(limits))
+            # All-or-nothing: the user bucket wasn't charged for the refused call
+            self.assertEqual(buckets.levels(limits)['user'], 3)
+        with mock.patch('utils.ai_policy.time.time', return_value=1030.0):
+            self.assertTrue(buckets.try_consume(limits))
+            self.assertFalse(buckets.try_consume(limits))
+
+
+class CircuitBreakerTests(AIStoreTestMixin, SimpleTestCase):
+    def make_breaker(self, **kwargs):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return CircuitBreaker('gemini', os.path.join(directory.name, 'breaker.db'), **kwargs)
+
+    def test_opens_after_consecutive_failures(self):
+        for path in (None, 'sqlite'):
+            breaker = CircuitBreaker('gemini', None, failure_threshold=2) if path is None \
+                else self.make_breaker(failure_threshold=2)
+            breaker.record_failure()
+            breaker.record_success()
+            breaker.record_failure()
+            self.assertEqual(breaker.state(), CLOSED)
+            breaker.record_failure()
+            self.assertEqual(breaker.state(), OPEN)
+            self.assertFalse(breaker.allow())
+
+    def test_state_is_shared_between_instances(self):
+        breaker = self.make_breaker(failure_threshold=1)
+        other = CircuitBreaker('gemini', breaker.path, failure_threshold=1)
+        breaker.record_failure()
+        self.assertEqual(other.state(), OPEN)
+        other.reset()
+        self.assertTrue(breaker.allow())
+
+    def test_half_open_trial_call(self):
+        breaker = self.make_breaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch('utils.circuit_breaker.time.time', return_value=1000.0):
+            breaker.record_failure()
+        with mock.patch('utils.circuit_breaker.time.time', return_value=1031.0):
+            # Only one caller gets the trial call
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            self.assertEqual(breaker.state(), HALF_OPEN)
+            breaker.record_failure()
+            self.assertEqual(breaker.state(), OPEN)
+        with mock.patch('utils.circuit_breaker.time.time', return_value=1062.0):
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.snapshot()['failures'], 0)
+        self.assertEqual(breaker.state(), CLOSED)
+
+    def test_background_probe_closes_breaker(self):
+        probed = threading.Event()
+        breaker = CircuitBreaker('gemini', None, failure_threshold=1, reset_timeout=0, probe=probed.set)
+        breaker.record_failure()
+        # Callers keep failing fast while the probe runs
+        self.assertFalse(breaker.allow())
+        self.assertTrue(probed.wait(1))
+        for _ in range(100):
+            if breaker.state() == CLOSED:
+                break
+            time.sleep(0.01)
+        self.assertEqual(breaker.state(), CLOSED)
+
+    def wait_for_state(self, breaker, state):
+        for _ in range(200):
+            if breaker.state() == state:
+                break
+            time.sleep(0.01)
+        return breaker.state()
+
+    def test_opened_breaker_probes_on_its_own(self):
+        probes = []
+        breaker = self.make_breaker(failure_threshold=1, reset_timeout=0.05,
+                                    probe=lambda: probes.append(1))
+        breaker.record_failure()
+        self.assertEqual(breaker.state(), OPEN)
+        # No caller asks; the timer starts the probe after the reset timeout
+        self.assertEqual(self.wait_for_state(breaker, CLOSED), CLOSED)
+        self.assertEqual(probes, [1])
+
+    def test_failed_probe_is_retried_on_its_own(self):
+        outcomes = [RuntimeError('still down'), None]
+
+        def probe():
+            outcome = outcomes.pop(0)
+            if outcome:
+                raise outcome
+
+        breaker = CircuitBreaker('gemini', None, failure_threshold=1, reset_timeout=0.02, probe=probe)
+        breaker.record_failure()
+        self.assertEqual(self.wait_for_state(breaker, CLOSED), CLOSED)
+        self.assertEqual(outcomes, [])
+
+    def test_healthy_without_a_probe_lets_the_job_make_the_trial_call(self):
+        breaker = self.make_breaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch('utils.circuit_breaker.time.time', return_value=1000.0):
+            breaker.record_failure()
+            self.assertFalse(breaker.healthy())
+        with mock.patch('utils.circuit_breaker.time.time', return_value=1031.0):
+            self.assertTrue(breaker.healthy())
+            self.assertEqual(breaker.state(), OPEN)
+            self.assertTrue(breaker.allow())
+
+    def test_client_fails_fast_while_open(self):
+        model = FakeModel(failures=10)
+        breaker = CircuitBreaker('gemini', None, failure_threshold=1)
+        client = AsyncGenerationClient(lambda: model, loop_thread=EventLoopThread(), retries=2,
+                                       backoff=0, breaker=breaker)
+        with self.assertRaises(GenerationError):
+            client.generate_sync('prompt')
+        # One failed call (after its retries) trips the breaker
+        self.assertEqual(model.calls, 3)
+        with self.assertRaises(CircuitOpenError):
+            client.generate_sync('prompt')
+        self.assertEqual(model.calls, 3)
+
+    def test_generator_serves_fallback_while_open(self):
+        breaker = CircuitBreaker('gemini', None, failure_threshold=1)
+        breaker.record_failure()
+        model = FakeModel()
+        client = AsyncGenerationClient(lambda: model, loop_thread=EventLoopThread(), breaker=breaker)
+        metrics = ai_metrics.AIMetrics(None)
+        with mock.patch.object(ai_generator, 'AI_METRICS', metrics), \
+                mock.patch.object(ai_generator, 'get_client', return_value=client):
+            challenge = ai_generator.generate_ai_challenge(bucket_profile('Dating', '1-2 years'))
+        self.assertEqual(challenge['title'], 'Connection Exercise')
+        self.assertEqual(model.calls, 0)
+        self.assertIn((ai_metrics.FALLBACK, 'circuit_open'), [key[1:] for key in metrics._pending])
+
+    def test_health_endpoint(self):
+        breaker = CircuitBreaker('gemini', None, failure_threshold=1)
+        with mock.patch('api.views.AI_BREAKER', breaker), mock.patch('api.views.AI_AVAILABLE', True), \
+                mock.patch('api.views.get_policy', return_value=AIPolicy(buckets=TokenBuckets(None))):
+            response = self.client.get(reverse('ai-health'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['breaker']['state'], CLOSED)
+            self.assertIn('global:minute', response.json()['budget'])
+            self.assertIn('calls_saved', response.json()['single_flight']['process'])
+            self.assertIn('calls_saved', response.json()['single_flight']['last_hour'])
+
+            breaker.record_failure()
+            response = self.client.get(reverse('ai-health'))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['breaker']['state'], OPEN)
+
+
+class LLMBackendTests(AIStoreTestMixin, SimpleTestCase):
+    def test_first_available_backend_is_used(self):
+        with mock.patch('utils.llm_backends.GOOGLE_API_KEY', None), \
+                mock.patch('utils.llm_backends.OPENAI_API_KEY', None):
+            self.assertEqual(get_backend('openai, gemini, local').name, 'local')
+            with self.settings(AI_BACKEND='openai,local'):
+                self.assertEqual(get_backend().name, 'local')
+            # Nothing available: the first backend, reported as unavailable
+            backend = get_backend('gemini,openai')
+            self.assertEqual(backend.name, 'gemini')
+            self.assertFalse(backend.available())
+
+    def test_backends_must_implement_the_interface(self):
+        class Incomplete(Backend):
+            name = 'incomplete'
+
+            def available(self):
+                return True
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_template_model_feeds_the_batch_pipeline(self):
+        client = AsyncGenerationClient(LocalBackend().create_model, loop_thread=EventLoopThread())
+        profile = bucket_profile('Dating', '1-2 years')
+        with mock.patch.object(ai_generator, 'get_client', return_value=client):
+            accepted, stats = ai_generator.run_batch_pipeline(profile, 6, ['Emotional Connection', 'Sexual Exploration'])
+            single = ai_generator.generate_ai_challenge(profile, 'Communication Boosters')
+        self.assertEqual(stats['parsed'], 6)
+        self.assertEqual({c['category'] for c in accepted}, {'Emotional Connection', 'Sexual Exploration'})
+        self.assertEqual(single['category'], 'Communication Boosters')
+        self.assertNotEqual(single['title'], 'Connection Exercise')
+
+    def test_template_model_is_deterministic(self):
+        prompt = ai_generator.build_batch_prompt(bucket_profile('Dating', '1-2 years'), 3, ['Emotional Connection'])
+        first, second = TemplateModel(), TemplateModel()
+        self.assertEqual(first.generate_content(prompt).text, second.generate_content(prompt).text)
+        streamed = first.generate_content(prompt, stream=True)
+        self.assertIsNotNone(usage_tokens(streamed[-1]))
+        self.assertEqual(len(ai_generator.parse_batch_response(''.join(c.text for c in streamed))), 3)
+
+    def test_openai_responses_look_like_gemini(self):
+        completion = mock.MagicMock()
+        completion.choices[0].message.content = '{"title": "T"}'
+        completion.usage.prompt_tokens, completion.usage.completion_tokens = 12, 5
+        openai_client = mock.Mock()
+        openai_client.chat.completions.create.return_value = completion
+        response = OpenAIModel(openai_client, 'gpt-test').generate_content('prompt')
+        self.assertEqual(response.text, '{"title": "T"}')
+        self.assertEqual(usage_tokens(response), (12, 5))
+        self.assertEqual(openai_client.chat.completions.create.call_args.kwargs['model'], 'gpt-test')
+
+
+class SemanticIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = SemanticIndex(dimensions=256, capacity=4)
+        self.index.add([
+            {'id': 'walk', 'title': 'Evening walk', 'description': 'Take a slow walk together after dinner'},
+            {'id': 'letter', 'title': 'Love letter', 'description': 'Write a handwritten letter to your partner'},
+            {'id': 'cook', 'title': 'Cook together', 'description': 'Cook a new recipe together for dinner'},
+        ])
+
+    def test_batched_top_k(self):
+        results = self.index.search(['write a letter', 'walk after dinner'], k=2)
+        self.assertEqual(results[0][0][0], 'letter')
+        self.assertEqual(results[1][0][0], 'walk')
+        self.assertEqual([len(r) for r in results], [2, 2])
+        self.assertGreaterEqual(results[1][0][1], results[1][1][1])
+
+    def test_incremental_insert_and_exclusion(self):
+        self.assertEqual(self.index.add([{'id': 'walk', 'title': 'Duplicate', 'description': ''}]), 0)
+        extra = [{'id': f'poem_{i}', 'title': 'Poem', 'description': f'Write a poem number {i}'} for i in range(10)]
+        self.assertEqual(self.index.add(extra), 10)
+        self.assertEqual(len(self.index), 13)
+        matches = self.index.search(['write a poem'], k=3, exclude=['poem_0'])[0]
+        self.assertTrue(all(i.startswith('poem_') and i != 'poem_0' for i, _ in matches))
+
+    def test_similar_and_nearest(self):
+        self.assertEqual(self.index.similar(['walk'], k=1), [('cook', mock.ANY)])
+        self.assertEqual(self.index.similar(['unknown']), [])
+        nearest = self.index.nearest({'title': 'Evening walk', 'description': 'Take a slow walk together after dinner'})
+        self.assertEqual(nearest[0], 'walk')
+        self.assertAlmostEqual(nearest[1], 1.0, places=4)
+
+
+class BatchAssignmentTests(TestCase):
+    def test_weights_favour_less_completed_categories(self):
+        rng = np.random.default_rng(0)
+        counts = np.array([[9, 1, 0], [0, 0, 0]])
+        allowed = np.array([[True, True, True], [True, False, True]])
+        weights = category_weights(counts, allowed, rng)
+        self.assertLess(weights[0, 0], weights[0, 1])
+        self.assertEqual(weights[1, 1], 0)
+        picks = sample_rows(np.repeat(weights[1:], 1000, axis=0), rng)
+        self.assertNotIn(1, picks)
+        self.assertEqual(set(picks), {0, 2})
+
+    def test_assigns_every_user_in_bulk(self):
+        veteran = create_user(preferred_categories=['Emotional Connection', 'Communication Boosters'],
+                              excluded_categories=['Communication Boosters'])
+        for challenge in CATALOG.by_category('Emotional Connection')[:-1]:
+            CompletedChallenge.objects.create(user=veteran, challenge_id=challenge['id'],
+                                              category=challenge['category'])
+        newcomer = create_user()
+        CurrentChallenge.objects.create(user=newcomer, challenge_id='comm_1', category='Communication Boosters')
+        users = list(User.objects.all())
+
+        # Completions, existing rows, one bulk update, one bulk insert (plus savepoints)
+        with self.assertNumQueries(6):
+            result = assign_challenges(users, np.random.default_rng(1))
+
+        self.assertEqual((result.created, result.updated), (1, 1))
+        # Only one Emotional Connection challenge is left for the veteran
+        self.assertEqual(result.assignments[veteran.id], CATALOG.by_category('Emotional Connection')[-1]['id'])
+        current = CurrentChallenge.objects.get(user=newcomer)
+        self.assertEqual(current.challenge_id, result.assignments[newcomer.id])
+        self.assertEqual(current.category, get_challenge_by_id(current.challenge_id)['category'])
+
+
+class RotateChallengesTests(TestCase):
+    def age_challenge(self, user, days):
+        current = CurrentChallenge.objects.create(user=user, challenge_id='comm_1', category='Communication Boosters')
+        CurrentChallenge.objects.filter(pk=current.pk).update(
+            generated_at=timezone.now() - datetime.timedelta(days=days))
+
+    def test_due_users_follow_challenge_frequency(self):
+        new = create_user()
+        daily = create_user()
+        self.age_challenge(daily, 1)
+        fresh = create_user()
+        self.age_challenge(fresh, 0)
+        weekly = create_user(challenge_frequency='weekly')
+        self.age_challenge(weekly, 3)
+        twice_weekly = create_user(challenge_frequency='biweekly')
+        self.age_challenge(twice_weekly, 3)
+        self.assertEqual(set(due_users()), {new, daily, twice_weekly})
+
+    def test_command_rotates_due_users_in_chunks(self):
+        users = [create_user() for _ in range(5)]
+        self.age_challenge(users[0], 2)
+        out = io.StringIO()
+        call_command('rotate_challenges', chunk_size=2, seed=3, stdout=out)
+        self.assertIn('Rotated 5 users (4 new, 1 replaced)', out.getvalue())
+        self.assertEqual(CurrentChallenge.objects.count(), 5)
+        self.assertFalse(due_users().exists())
+        self.assertNotEqual(CurrentChallenge.objects.get(user=users[0]).generated_at.date(),
+                            (timezone.now() - datetime.timedelta(days=2)).date())
+
+        out = io.StringIO()
+        call_command('rotate_challenges', dry_run=True, stdout=out)
+        self.assertIn('0 users due', out.getvalue())
+
+
+def reference_streaks(days, today):
+    """Brute-force streaks: walk back from every active day"""
+    active = {day for day in days if day <= today}
+    one = datetime.timedelta(days=1)
+
+    def run_ending(day):
+        length = 0
+        while day in active:
+            length += 1
+            day -= one
+        return length
+
+    current = max(run_ending(today), run_ending(today - one)) if active else 0
+    return Streaks(current, max((run_ending(day) for day in active), default=0))
+
+
+class StreakEngineTests(SimpleTestCase):
+    def random_days(self, rng, today):
+        # Clustered so long runs, gaps and repeats all occur
+        days = []
+        day = today - datetime.timedelta(days=rng.randint(0, 60))
+        for _ in range(rng.randint(0, 40)):
+            days.append(day)
+            day += datetime.timedelta(days=rng.choice([0, 1, 1, 1, 2, 5]))
+        return days
+
+    def test_matches_brute_force_on_random_histories(self):
+        rng = random.Random(20261018)
+        today = datetime.date(2026, 3, 1)
+        for _ in range(500):
+            days = self.random_days(rng, today)
+            with self.subTest(days=days):
+                streaks = compute_streaks(sorted(days), today)
+                self.assertEqual(streaks, reference_streaks(days, today))
+                self.assertLessEqual(streaks.current, streaks.longest)
+
+    def test_incremental_updates_agree_with_recompute(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            days = sorted(self.random_days(rng, datetime.date(2026, 3, 1)))
+            streak, last_day = 0, None
+            for day in days:
+                streak = advance_streak(streak, last_day, day)
+                last_day = day
+            if days:
+                self.assertEqual(streak, compute_streaks(days, days[-1]).current)
+
+    def test_streak_survives_until_a_day_is_missed(self):
+        days = [datetime.date(2026, 1, d) for d in (1, 2, 3)]
+        self.assertEqual(compute_streaks(days, datetime.date(2026, 1, 4)), Streaks(3, 3))
+        self.assertEqual(compute_streaks(days, datetime.date(2026, 1, 5)), Streaks(0, 3))
+
+    def test_days_are_local_to_the_couple(self):
+        late_evening = datetime.datetime(2026, 1, 1, 4, 30, tzinfo=datetime.timezone.utc)
+        self.assertEqual(local_day(late_evening, get_zone('America/New_York')), datetime.date(2025, 12, 31))
+        self.assertEqual(local_day(late_evening.replace(tzinfo=None), get_zone('Nowhere/Invalid')),
+                         datetime.date(2026, 1, 1))
+
+
+class StreakRecomputeTests(TestCase):
+    def complete_at(self, user, challenge_id, moment):
+        with mock.patch('django.utils.timezone.now', return_value=moment):
+            return services.complete_challenge(user, challenge_id, 'Communication Boosters')
+
+    def test_completions_use_the_couples_timezone(self):
+        user = create_user(timezone='America/New_York')
+        evening = datetime.datetime(2026, 1, 2, 3, 0, tzinfo=datetime.timezone.utc)  # 22:00 on Jan 1 in New York
+        self.complete_at(user, 'comm_1', evening)
+        result = self.complete_at(user, 'comm_2', evening + datetime.timedelta(hours=20))  # Jan 2, 18:00
+        self.assertEqual((result.progress.streak, result.progress.longest_streak), (2, 2))
+        self.assertEqual(list(DailyActivity.objects.order_by('day').values_list('day', flat=True)),
+                         [datetime.date(2026, 1, 1), datetime.date(2026, 1, 2)])
+
+    def test_command_repairs_streaks_from_the_rollup(self):
+        now = timezone.now()
+        broken = create_user()
+        for days_ago in (5, 4, 3, 1, 0):
+            record_completion(broken, f'c{days_ago}', 'Emotional Connection', now - datetime.timedelta(days=days_ago))
+        UserProgress.objects.filter(user=broken).update(streak=9, longest_streak=1)
+        fine = create_user()
+
+        out = io.StringIO()
+        call_command('recompute_streaks', chunk_size=1, stdout=out)
+        self.assertIn('Checked 2 users, repaired 1 streaks', out.getvalue())
+        progress = UserProgress.objects.get(user=broken)
+        self.assertEqual((progress.streak, progress.longest_streak), (2, 3))
+        self.assertEqual(recompute_streaks([fine, broken]), 0)
+
+    def test_command_keeps_a_reset_streak(self):
+        user = create_user()
+        now = timezone.now()
+        self.complete_at(user, 'comm_1', now - datetime.timedelta(days=1))
+        self.complete_at(user, 'comm_2', now)
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.client.post(reverse('reset_progress'))
+
+        out = io.StringIO()
+        call_command('recompute_streaks', rebuild_rollups=True, stdout=out)
+        self.assertIn('repaired 0 streaks', out.getvalue())
+        progress = UserProgress.objects.get(user=user)
+        self.assertEqual((progress.streak, progress.longest_streak), (0, 0))
+
+    def test_rebuild_recounts_days_in_the_new_timezone(self):
+        user = create_user()
+        midnight = timezone.now().replace(hour=0, minute=30, second=0, microsecond=0)
+        record_completion(user, 'a', 'Emotional Connection', midnight - datetime.timedelta(hours=1))
+        record_completion(user, 'b', 'Emotional Connection', midnight)
+        self.assertEqual(DailyActivity.objects.filter(user=user).count(), 2)
+        # 23:30 and 00:30 UTC are the same evening in New York
+        User.objects.filter(pk=user.pk).update(timezone='America/New_York')
+        user.refresh_from_db()
+        recompute_streaks([user], now=midnight, rebuild=True)
+        self.assertEqual(DailyActivity.objects.get(user=user).count, 2)
+
+    def late_evening_completions(self):
+        """A user with completions at 23:30 and 00:30 UTC: two days in UTC, one evening in New York"""
+        user = create_user()
+        midnight = timezone.now().replace(hour=0, minute=30, second=0, microsecond=0)
+        self.complete_at(user, 'comm_1', midnight - datetime.timedelta(hours=1))
+        self.complete_at(user, 'comm_2', midnight)
+        self.assertEqual(DailyActivity.objects.filter(user=user).count(), 2)
+        return user
+
+    def test_profile_form_timezone_change_rebuilds_the_rollups(self):
+        user = self.late_evening_completions()
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        profile = {
+            'partner1_name': 'Alex', 'partner2_name': 'Sam', 'relationship_status': 'Dating',
+            'relationship_duration': '1-2 years', 'challenge_frequency': 'weekly',
+        }
+
+        response = self.client.post(reverse('update_profile'), dict(profile, timezone='Mars/Olympus'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.get(pk=user.pk).timezone, 'UTC')
+
+        response = self.client.post(reverse('update_profile'), dict(profile, timezone='America/New_York'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(User.objects.get(pk=user.pk).timezone, 'America/New_York')
+        self.assertEqual(DailyActivity.objects.get(user=user).count, 2)
+        self.assertEqual(UserProgress.objects.get(user=user).longest_streak, 1)
+
+    def test_api_timezone_change_rebuilds_the_rollups(self):
+        user = self.late_evening_completions()
+        serializer = UserSerializer(user, data={'timezone': 'Nowhere/Special'}, partial=True)
+        self.assertFalse(serializer.is_valid())
+
+        serializer = UserSerializer(user, data={'timezone': 'America/New_York'}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+        self.assertEqual(DailyActivity.objects.get(user=user).count, 2)
+        self.assertEqual(UserProgress.objects.get(user=user).longest_streak, 1)
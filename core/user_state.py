@@ -0,0 +1,114 @@
+"""
+User state cache.
+Keeps each user's model instance (with progress and current challenge joined
+in) and their shared page context in the Django cache, so read-only pages
+don't have to touch the database. Entries are keyed by user ID and a per-user
+version number; any write to the core tables bumps the version (see
+core.signals), which makes older entries unreachable. Cached instances are
+read-only: code that writes fetches a fresh row.
+"""
+
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from core.context import UserContext, get_user_with_related, load_user_context
+
+# Which cache alias to use and how long entries live (seconds)
+USER_STATE_CACHE_ALIAS = getattr(settings, 'USER_STATE_CACHE_ALIAS', 'default')
+USER_STATE_CACHE_TIMEOUT = getattr(settings, 'USER_STATE_CACHE_TIMEOUT', 60 * 15)
+
+# Attribute used to memoize state on the current request
+REQUEST_ATTR = '_user_state'
+
+
+@dataclass(frozen=True)
+class UserState:
+    """A user and their shared page context"""
+    user: object
+    context: UserContext
+
+
+def get_cache():
+    """Get the cache backend used for user state"""
+    return caches[USER_STATE_CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f'user_state:{user_id}:version'
+
+
+def _state_key(user_id, version):
+    return f'user_state:{user_id}:v{version}'
+
+
+def get_version(user_id):
+    """Get the current cache version for a user, initializing it if needed"""
+    cache = get_cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from a time-based value so an evicted version key can never
+        # point back at entries written under an earlier version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(user_id):
+    cache = get_cache()
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Version key missing: nothing cached under it can be reached anyway
+        cache.add(key, time.time_ns(), None)
+
+
+def invalidate_user_state(user_id):
+    """
+    Invalidate the cached state for a user.
+    Bumps the version immediately, and again after the surrounding transaction
+    commits so a concurrent reader can't cache pre-commit data in between.
+    """
+    if user_id is None:
+        return
+    _bump_version(user_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump_version(user_id))
+
+
+def load_user_state(user_id):
+    """Load a user's state from the cache, falling back to the database"""
+    cache = get_cache()
+    key = _state_key(user_id, get_version(user_id))
+    state = cache.get(key)
+    if state is None:
+        user = get_user_with_related(user_id)
+        if user is None:
+            return None
+        state = UserState(user=user, context=load_user_context(user))
+        cache.set(key, state, USER_STATE_CACHE_TIMEOUT)
+    return state
+
+
+def get_user_state(request, user_id):
+    """
+    Get a user's state for the current request.
+    Memoized on the request, so repeated calls during one request share a
+    single cache lookup.
+    """
+    memo = getattr(request, REQUEST_ATTR, None)
+    if memo is None or memo.user.id != user_id:
+        memo = load_user_state(user_id)
+        setattr(request, REQUEST_ATTR, memo)
+    return memo
+
+
+def forget_request_state(request):
+    """Drop request-scoped state before the user is modified in this request"""
+    if hasattr(request, REQUEST_ATTR):
+        delattr(request, REQUEST_ATTR)
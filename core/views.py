@@ -3,20 +3,29 @@ from django.contrib import messages
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_POST
 from django.utils import timezone
+from django.db import close_old_connections, transaction
 from django.db.models import Count
 import json
 import calendar
-import datetime
-import random
 
-from core.models import (
-    User, UserProgress, CompletedChallenge, UserBadge, 
-    ViewedArticle, ViewedProduct, CurrentChallenge
-)
+import numpy as np
+
+from core.models import UserProgress, ViewedArticle, ViewedProduct, CurrentChallenge
 from core.forms import UserProfileForm
-from data.challenges import get_challenge_by_id, get_challenge_by_category, get_challenges_by_category, get_random_challenge
+from core.context import get_user_with_related, load_user_context
+from core import services
+from core.activity import active_days, clear_activity, month_bounds
+from core.assignment import allowed_categories, category_weights, sample_rows
+from core.challenge_store import save_generated_challenge
+from core.user_state import forget_request_state, get_user_state
+from data.streaks import get_zone, local_day
+from data.challenges import CATALOG, get_challenge_by_id, get_challenge_by_category, get_challenges_by_category
 from data.education import get_all_articles, get_article_by_id, get_articles_by_category
 from data.products import get_all_products, get_product_by_id, get_products_by_category
+from utils.job_queue import get_queue
+
+# Job kind that generates a user's next challenge after a completion
+NEXT_CHALLENGE_JOB = "next_challenge"
 
 # Helper functions
 def create_user_progress(user):
@@ -31,61 +40,47 @@ def get_or_create_user_from_session(request):
     """Get the user from the session, or return None"""
     user_id = get_session_user_id(request)
     if user_id:
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            # Clear invalid session
-            if 'user_id' in request.session:
-                del request.session['user_id']
+        # Served from the user state cache; falls back to one joined query.
+        # Read-only: views that write use get_user_for_update()
+        state = get_user_state(request, user_id)
+        if state:
+            return state.user
+        # Clear invalid session
+        if 'user_id' in request.session:
+            del request.session['user_id']
     return None
 
-def check_for_badges(user):
-    """Check and award new badges based on progress"""
-    # Get existing badges
-    existing_badges = list(user.badges.values_list('badge_name', flat=True))
-    
-    # Get user progress
-    progress = user.progress
-    
-    # Get completed challenges count
-    completed_count = user.completed_challenges.count()
-    
-    # Challenge completion badges
-    if completed_count >= 1 and "First Spark" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="First Spark")
-    if completed_count >= 5 and "Flame Starter" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="Flame Starter")
-    if completed_count >= 10 and "Burning Bright" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="Burning Bright")
-    if completed_count >= 25 and "Inferno" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="Inferno")
-    
-    # Streak badges
-    if progress.streak >= 3 and "3 Day Streak" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="3 Day Streak")
-    if progress.streak >= 7 and "1 Week Connection" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="1 Week Connection")
-    if progress.streak >= 14 and "2 Week Devotion" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="2 Week Devotion")
-    if progress.streak >= 30 and "Monthly Passion" not in existing_badges:
-        UserBadge.objects.create(user=user, badge_name="Monthly Passion")
+def get_user_for_update(request):
+    """
+    Get the user from the session as a fresh row, for views that write.
+    The cached state is read-only; it's dropped from the request so anything
+    rendered afterwards is loaded again.
+    """
+    user_id = get_session_user_id(request)
+    if user_id:
+        forget_request_state(request)
+        user = get_user_with_related(user_id)
+        if user:
+            return user
+        # Clear invalid session
+        if 'user_id' in request.session:
+            del request.session['user_id']
+    return None
 
 def get_calendar_data(user):
     """Get calendar data for progress visualization"""
-    now = timezone.now()
-    current_month = now.month
-    current_year = now.year
+    # The couple's own month, matching the days their activity is recorded under
+    today = local_day(timezone.now(), get_zone(user.timezone))
+    current_month = today.month
+    current_year = today.year
     
     # Get the calendar for the current month
     cal = calendar.monthcalendar(current_year, current_month)
     
-    # Get completed challenges for this month
-    completed_days = user.completed_challenges.filter(
-        completed_at__year=current_year,
-        completed_at__month=current_month
-    ).values('completed_at__day').distinct()
-    
-    completed_day_numbers = [day['completed_at__day'] for day in completed_days]
+    # Days with completions this month, from the daily rollup
+    completed_day_numbers = {
+        day.day for day in active_days(user, *month_bounds(current_year, current_month))
+    }
     
     # Create calendar days data
     calendar_days = []
@@ -105,30 +100,35 @@ def get_calendar_data(user):
         "calendar_days": calendar_days
     }
 
-def get_category_stats(user):
+def category_completion_counts(user):
+    """Count completed challenges per category in a single GROUP BY query"""
+    rows = (
+        user.completed_challenges
+        .order_by()
+        .values('category')
+        .annotate(count=Count('id'))
+    )
+    return {row['category']: row['count'] for row in rows}
+
+def get_category_stats(user, completed_counts=None):
     """Get statistics on category completion percentages"""
-    categories = [
-        "Communication Boosters", "Physical Touch & Affection", 
-        "Creative Date Night Ideas", "Sexual Exploration", "Emotional Connection"
-    ]
-    
-    # Get completed challenges by category
-    completed_by_category = {}
-    for category in categories:
-        # We would need to determine total challenges per category
-        # For now, let's assume 20 challenges per category
-        total_per_category = 20
-        completed_count = user.completed_challenges.filter(category=category).count()
+    if completed_counts is None:
+        completed_counts = category_completion_counts(user)
+    
+    stats = []
+    for category in CATALOG.categories():
+        total_per_category = CATALOG.category_size(category)
+        completed_count = completed_counts.get(category, 0)
         percent = round((completed_count / total_per_category) * 100) if total_per_category > 0 else 0
         
-        completed_by_category[category] = {
+        stats.append({
             "name": category,
             "count": completed_count,
             "total": total_per_category,
-            "percent": percent
-        }
+            "percent": min(percent, 100)
+        })
     
-    return list(completed_by_category.values())
+    return stats
 
 def generate_challenge_for_user(user, category=None, challenge_id=None):
     """
@@ -142,6 +142,7 @@ def generate_challenge_for_user(user, category=None, challenge_id=None):
     
     # Prepare user profile data for the challenge generator
     user_profile = {
+        'user_id': user.id,
         'partner1_name': user.partner1_name,
         'partner2_name': user.partner2_name,
         'relationship_status': user.relationship_status,
@@ -152,67 +153,15 @@ def generate_challenge_for_user(user, category=None, challenge_id=None):
         'total_completed': getattr(user.progress, 'total_completed', 0)
     }
     
-    # Smart category selection if none specified
+    # Smart category selection if none specified: weighted towards the
+    # categories the user has completed least (see core.assignment)
     if not category and not challenge_id:
-        # Get user preferences
-        preferred_categories = user.preferred_categories
-        excluded_categories = user.excluded_categories
-        
-        # Default categories if none specified
-        all_categories = [
-            "Communication Boosters", "Physical Touch & Affection", 
-            "Creative Date Night Ideas", "Sexual Exploration", "Emotional Connection"
-        ]
-        
-        # Remove excluded categories
-        available_categories = [c for c in all_categories if c not in excluded_categories]
-        
-        # Filter to preferred categories if specified, otherwise use all available
-        if preferred_categories:
-            available_categories = [c for c in preferred_categories if c in available_categories]
-        
-        if not available_categories:
-            # Fallback if no categories are available
-            available_categories = all_categories
-            
-        # Calculate category weights based on completion history
-        category_weights = {}
-        
-        # Count completed challenges per category
-        completed_by_category = {}
-        for cat in available_categories:
-            count = user.completed_challenges.filter(category=cat).count()
-            completed_by_category[cat] = count
-        
-        # If there's completion history, use it to calculate weights
-        if sum(completed_by_category.values()) > 0:
-            # Invert counts to prioritize less-used categories
-            total_completions = sum(completed_by_category.values())
-            for cat in available_categories:
-                # Calculate inverse weight (less completed = higher weight)
-                inverse_weight = 1 - (completed_by_category.get(cat, 0) / total_completions) if total_completions > 0 else 1
-                # Add some randomness but keep the weighting
-                category_weights[cat] = inverse_weight + random.random() * 0.2
-        else:
-            # If no history, use equal weights with slight randomness
-            for cat in available_categories:
-                category_weights[cat] = 1 + random.random() * 0.2
-                
-        # Select category based on weights
-        cats = list(category_weights.keys())
-        weights = list(category_weights.values())
-        
-        if cats:
-            # Normalize weights
-            total_weight = sum(weights)
-            normalized_weights = [w/total_weight for w in weights]
-            
-            try:
-                # Use weighted random choice to select category
-                category = random.choices(cats, weights=normalized_weights, k=1)[0]
-            except ValueError:
-                # Fallback to simple random if weighting fails
-                category = random.choice(cats)
+        categories = allowed_categories(user, CATALOG.categories())
+        completed_counts = category_completion_counts(user)
+        counts = np.array([[completed_counts.get(cat, 0) for cat in categories]])
+        rng = np.random.default_rng()
+        weights = category_weights(counts, np.ones_like(counts, dtype=bool), rng)
+        category = categories[sample_rows(weights, rng)[0]]
     
     # Get a challenge using our hybrid generator
     challenge = get_hybrid_challenge(user_profile, completed_ids, category, challenge_id)
@@ -227,6 +176,9 @@ def generate_challenge_for_user(user, category=None, challenge_id=None):
     
     # Update or create current challenge
     if challenge:
+        # Keep AI challenges so the current one resolves by ID on later requests
+        challenge = save_generated_challenge(challenge)
+        
         try:
             current = CurrentChallenge.objects.get(user=user)
             current.challenge_id = challenge['id']
@@ -242,97 +194,84 @@ def generate_challenge_for_user(user, category=None, challenge_id=None):
     
     return challenge
 
+def run_next_challenge_job(payload):
+    """Job queue handler: generate the next challenge for a user"""
+    try:
+        user = get_user_with_related(payload['user_id'])
+        if user:
+            generate_challenge_for_user(user)
+    finally:
+        # Queue workers are long-lived threads outside the request cycle
+        close_old_connections()
+
+def queue_next_challenge(user):
+    """
+    Generate a user's next challenge on the background job queue, so a
+    completion doesn't wait on challenge generation. Jobs are deduplicated
+    per user; if the queue can't be used the challenge is generated inline.
+    """
+    try:
+        queue = get_queue()
+        queue.register(NEXT_CHALLENGE_JOB, run_next_challenge_job)
+        queue.submit(NEXT_CHALLENGE_JOB, {'user_id': user.id}, dedupe_key=f'{NEXT_CHALLENGE_JOB}:{user.id}')
+    except Exception as e:
+        # Log error but don't disrupt the user experience
+        print(f"Error queueing next challenge: {str(e)}")
+        generate_challenge_for_user(user)
+
+def decorate_current_challenge(current, user):
+    """Resolve the current challenge and add display fields for templates"""
+    challenge = get_challenge_by_id(current.challenge_id)
+    if not challenge:
+        return None
+    
+    # Add extra metadata for template display
+    challenge['generated_at'] = current.generated_at
+    
+    # Add personalized names to challenge description
+    description = challenge.get('description', '')
+    if '{partner1}' in description:
+        description = description.replace('{partner1}', user.partner1_name)
+    if '{partner2}' in description:
+        description = description.replace('{partner2}', user.partner2_name)
+    challenge['description'] = description
+    
+    # Add difficulty display
+    difficulty = challenge.get('difficulty', 'medium')
+    if difficulty.lower() == 'easy':
+        challenge['difficulty_display'] = 'Easy'
+        challenge['difficulty_class'] = 'text-success'
+    elif difficulty.lower() == 'medium':
+        challenge['difficulty_display'] = 'Medium'
+        challenge['difficulty_class'] = 'text-primary'
+    elif difficulty.lower() == 'hard':
+        challenge['difficulty_display'] = 'Challenging'
+        challenge['difficulty_class'] = 'text-danger'
+    else:
+        challenge['difficulty_display'] = 'Medium'
+        challenge['difficulty_class'] = 'text-primary'
+    
+    return challenge
+
 def prepare_context_for_user(request, user=None):
     """Prepare the common context for templates"""
     user = user or get_or_create_user_from_session(request)
-    context = {}
-    
-    if user:
-        # Get user profile data
-        context['user_profile'] = {
-            'initialized': True,
-            'partner1_name': user.partner1_name,
-            'partner2_name': user.partner2_name,
-            'relationship_status': user.relationship_status,
-            'relationship_duration': user.relationship_duration,
-            'challenge_frequency': user.challenge_frequency,
-            'preferred_categories': user.preferred_categories,
-            'excluded_categories': user.excluded_categories
-        }
-        
-        # Get user progress
-        try:
-            progress = user.progress
-            
-            # Prepare badges for display
-            badges = list(user.badges.values_list('badge_name', flat=True))
-            
-            # Prepare progress data
-            context['user_progress'] = {
-                'streak': progress.streak,
-                'spark_level': progress.spark_level,
-                'total_completed': progress.total_completed,
-                'badges': badges,
-                'last_completed': progress.last_completed
-            }
-        except UserProgress.DoesNotExist:
-            # Create progress if it doesn't exist
-            progress = create_user_progress(user)
-            context['user_progress'] = {
-                'streak': 0,
-                'spark_level': 10,
-                'total_completed': 0,
-                'badges': [],
-                'last_completed': None
-            }
-        
-        # Get current challenge
-        try:
-            current = CurrentChallenge.objects.get(user=user)
-            challenge = get_challenge_by_id(current.challenge_id)
-            
-            if challenge:
-                # Add extra metadata for template display
-                challenge['generated_at'] = current.generated_at
-                
-                # Add personalized names to challenge description
-                description = challenge.get('description', '')
-                if '{partner1}' in description:
-                    description = description.replace('{partner1}', user.partner1_name)
-                if '{partner2}' in description:
-                    description = description.replace('{partner2}', user.partner2_name)
-                challenge['description'] = description
-                
-                # Add difficulty display
-                difficulty = challenge.get('difficulty', 'medium')
-                if difficulty.lower() == 'easy':
-                    challenge['difficulty_display'] = 'Easy'
-                    challenge['difficulty_class'] = 'text-success'
-                elif difficulty.lower() == 'medium':
-                    challenge['difficulty_display'] = 'Medium'
-                    challenge['difficulty_class'] = 'text-primary'
-                elif difficulty.lower() == 'hard':
-                    challenge['difficulty_display'] = 'Challenging'
-                    challenge['difficulty_class'] = 'text-danger'
-                else:
-                    challenge['difficulty_display'] = 'Medium'
-                    challenge['difficulty_class'] = 'text-primary'
-            
-            context['current_challenge'] = challenge
-        except CurrentChallenge.DoesNotExist:
-            context['current_challenge'] = None
-        
-        # Get completed challenges
-        completed = user.completed_challenges.order_by('-completed_at')[:5]
-        context['completed_challenges'] = completed
-        
-        # Get viewed articles and products
-        context['viewed_articles'] = list(user.viewed_articles.values_list('article_id', flat=True))
-        context['viewed_products'] = list(user.viewed_products.values_list('product_id', flat=True))
-    else:
+    
+    if not user:
         # No user in session, show registration form
-        context['user_profile'] = {'initialized': False}
-        context['form'] = UserProfileForm()
+        return {
+            'user_profile': {'initialized': False},
+            'form': UserProfileForm()
+        }
+    
+    # Profile, progress, badges, recent completions and viewed content
+    state = get_user_state(request, user.id)
+    user_context = state.context if state else load_user_context(user)
+    context = user_context.as_template_context()
+    
+    # Get current challenge
+    current = user_context.current_challenge
+    context['current_challenge'] = decorate_current_challenge(current, user) if current else None
     
     return context
 
@@ -401,7 +340,7 @@ def setup_profile(request):
     return render(request, 'home.html', context)
 
 def update_profile(request):
-    user = get_or_create_user_from_session(request)
+    user = get_user_for_update(request)
     
     if not user:
         messages.error(request, 'No user profile found. Please create one first.')
@@ -479,44 +418,13 @@ def complete_challenge(request):
         messages.error(request, 'Invalid request. Challenge ID and category are required.')
         return redirect('challenges')
     
-    # Check if challenge already completed
-    if not CompletedChallenge.objects.filter(user=user, challenge_id=challenge_id).exists():
-        # Mark challenge as completed
-        CompletedChallenge.objects.create(
-            user=user,
-            challenge_id=challenge_id,
-            category=category
-        )
-        
-        # Update progress
-        progress = user.progress
-        progress.total_completed += 1
-        
-        # Update last completed date
-        today = timezone.now()
-        
-        # Update streak
-        if progress.last_completed:
-            yesterday = (today - datetime.timedelta(days=1)).date()
-            if progress.last_completed.date() == yesterday:
-                progress.streak += 1
-            elif progress.last_completed.date() != today.date():
-                progress.streak = 1
-        else:
-            progress.streak = 1
-            
-        progress.last_completed = today
-        
-        # Update spark level (max 100%)
-        progress.spark_level = min(progress.spark_level + 5, 100)
-        progress.save()
-        
-        # Check for badges
-        check_for_badges(user)
-        
-        # Generate new challenge
-        generate_challenge_for_user(user)
-        
+    # Record the completion; the next challenge is queued once it commits
+    result = services.complete_challenge(
+        user, challenge_id, category,
+        on_commit=lambda: queue_next_challenge(user)
+    )
+    
+    if result.created:
         messages.success(request, 'Challenge completed! Your progress has been updated.')
     else:
         messages.info(request, 'You have already completed this challenge.')
@@ -703,28 +611,34 @@ def settings_view(request):
 
 @require_POST
 def reset_progress(request):
-    user = get_or_create_user_from_session(request)
+    user = get_user_for_update(request)
     
     if not user:
         messages.error(request, 'No user profile found. Please create one first.')
         return redirect('home')
     
-    # Delete completed challenges
-    user.completed_challenges.all().delete()
-    
-    # Delete badges
-    user.badges.all().delete()
-    
-    # Delete current challenge
-    CurrentChallenge.objects.filter(user=user).delete()
-    
-    # Reset progress
-    progress = user.progress
-    progress.streak = 0
-    progress.last_completed = None
-    progress.spark_level = 10
-    progress.total_completed = 0
-    progress.save()
+    with transaction.atomic():
+        # Delete completed challenges
+        user.completed_challenges.all().delete()
+        
+        # Delete the activity log and daily rollups, so the calendar and
+        # recomputed streaks start over too
+        clear_activity(user)
+        
+        # Delete badges
+        user.badges.all().delete()
+        
+        # Delete current challenge
+        CurrentChallenge.objects.filter(user=user).delete()
+        
+        # Reset progress
+        progress = user.progress
+        progress.streak = 0
+        progress.longest_streak = 0
+        progress.last_completed = None
+        progress.spark_level = 10
+        progress.total_completed = 0
+        progress.save()
     
     # Generate new challenge
     generate_challenge_for_user(user)
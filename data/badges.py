@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+# A badge is awarded once `metric` reaches `threshold`
+BadgeRule = namedtuple("BadgeRule", ["name", "metric", "threshold"])
+
+# Badge database
+BADGE_RULES = (
+    # Challenge completion badges
+    BadgeRule("First Spark", "total_completed", 1),
+    BadgeRule("Flame Starter", "total_completed", 5),
+    BadgeRule("Burning Bright", "total_completed", 10),
+    BadgeRule("Inferno", "total_completed", 25),
+
+    # Streak badges
+    BadgeRule("3 Day Streak", "streak", 3),
+    BadgeRule("1 Week Connection", "streak", 7),
+    BadgeRule("2 Week Devotion", "streak", 14),
+    BadgeRule("Monthly Passion", "streak", 30),
+)
+
+def progress_metrics(total_completed=0, streak=0):
+    """Build the metrics snapshot that badge rules are evaluated against"""
+    return {"total_completed": total_completed or 0, "streak": streak or 0}
+
+def crossed_badges(before, after, existing=None):
+    """
+    Get the badges whose threshold was crossed going from `before` to `after`.
+    Only the rules touched by the delta are returned, so a single completion
+    never re-checks badges that were already reachable before it.
+    """
+    existing = set(existing or ())
+    return [
+        rule.name for rule in BADGE_RULES
+        if before.get(rule.metric, 0) < rule.threshold <= after.get(rule.metric, 0)
+        and rule.name not in existing
+    ]
+
+def earned_badges(metrics, existing=None):
+    """Get every badge the metrics qualify for that isn't already held"""
+    existing = set(existing or ())
+    return [
+        rule.name for rule in BADGE_RULES
+        if metrics.get(rule.metric, 0) >= rule.threshold and rule.name not in existing
+    ]
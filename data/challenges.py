@@ -188,45 +188,160 @@ ALL_CHALLENGES = [
     }
 ]
 
-def get_challenge_by_id(challenge_id):
-    """Retrieve a challenge by its ID"""
-    for challenge in ALL_CHALLENGES:
-        if challenge["id"] == challenge_id:
+class ChallengeCatalog:
+    """
+    Indexed, read-only view over a list of challenges.
+    Builds an id index and a per-category index once so lookups don't
+    have to scan the whole challenge list on every call.
+    """
+
+    def __init__(self, challenges):
+        self._challenges = tuple(challenges)
+        self._by_id = {c["id"]: c for c in self._challenges}
+
+        # Secondary lookups for IDs outside the static data (e.g. generated challenges)
+        self._sources = []
+
+        by_category = {}
+        for challenge in self._challenges:
+            by_category.setdefault(challenge["category"], []).append(challenge)
+        self._by_category = {cat: tuple(items) for cat, items in by_category.items()}
+
+        # Position of each challenge inside its category tuple, used by sample()
+        self._positions = {}
+        for cat, items in self._by_category.items():
+            for index, challenge in enumerate(items):
+                self._positions[challenge["id"]] = (cat, index)
+
+    def __len__(self):
+        return len(self._challenges)
+
+    def __contains__(self, challenge_id):
+        return challenge_id in self._by_id
+
+    @staticmethod
+    def exclusion_set(exclude_ids):
+        """Normalize any iterable of IDs (list, QuerySet, set) into a frozenset"""
+        if not exclude_ids:
+            return frozenset()
+        if isinstance(exclude_ids, frozenset):
+            return exclude_ids
+        return frozenset(exclude_ids)
+
+    def categories(self):
+        """Get the names of all categories in the catalog"""
+        return list(self._by_category)
+
+    def category_size(self, category):
+        """Get the number of challenges in a category"""
+        return len(self._by_category.get(category, ()))
+
+    def get(self, challenge_id):
+        """Retrieve a challenge by its ID in O(1)"""
+        challenge = self._by_id.get(challenge_id)
+        return dict(challenge) if challenge else None
+
+    def add_source(self, lookup):
+        """Register a function mapping an ID to a challenge dict (or None) for IDs not in the static data"""
+        if lookup not in self._sources:
+            self._sources.append(lookup)
+
+    def resolve(self, challenge_id):
+        """Retrieve a challenge by ID from the static index, then from each registered source"""
+        challenge = self.get(challenge_id)
+        if challenge is not None:
             return challenge
-    return None
+        for lookup in self._sources:
+            challenge = lookup(challenge_id)
+            if challenge:
+                return dict(challenge)
+        return None
+
+    def by_category(self, category, exclude_ids=None):
+        """Get all challenges in a category, optionally excluding certain IDs"""
+        excluded = self.exclusion_set(exclude_ids)
+        return [
+            dict(c) for c in self._by_category.get(category, ())
+            if c["id"] not in excluded
+        ]
+
+    def random(self, category=None, exclude_ids=None):
+        """Get a random challenge, optionally limited to a category and excluding IDs"""
+        return self.sample([category] if category else None, exclude_ids)
+
+    def sample(self, categories=None, exclude_ids=None, rng=None):
+        """
+        Draw uniformly from challenges whose category is in `categories` (all
+        categories if None) and whose ID is not excluded.
+
+        Never builds the candidate list: the number of remaining challenges per
+        category is its size minus the excluded IDs that fall inside it, so we
+        pick a category by remaining count, then map the rank of the draw past
+        the excluded positions. Cost is O(excluded + categories), independent
+        of the catalog size, and there is no rejection loop.
+        """
+        rng = rng or random
+        excluded = self.exclusion_set(exclude_ids)
+
+        if categories is None:
+            allowed = list(self._by_category)
+        else:
+            allowed = [c for c in dict.fromkeys(categories) if c in self._by_category]
+        if not allowed:
+            return None
+
+        # Excluded positions per allowed category
+        skipped = {cat: [] for cat in allowed}
+        for challenge_id in excluded:
+            position = self._positions.get(challenge_id)
+            if position and position[0] in skipped:
+                skipped[position[0]].append(position[1])
+
+        remaining = [(cat, len(self._by_category[cat]) - len(skipped[cat])) for cat in allowed]
+        total = sum(count for _, count in remaining)
+        if total <= 0:
+            return None
+
+        # Pick the category holding the draw, then the rank inside it
+        rank = rng.randrange(total)
+        for category, count in remaining:
+            if rank < count:
+                break
+            rank -= count
+
+        # Shift the rank past every excluded position at or before it
+        for position in sorted(skipped[category]):
+            if position <= rank:
+                rank += 1
+            else:
+                break
+
+        return dict(self._by_category[category][rank])
+
+# Built once at import time and shared by all callers
+CATALOG = ChallengeCatalog(ALL_CHALLENGES)
+
+def get_challenge_by_id(challenge_id):
+    """Retrieve a challenge by its ID (static or from a registered source)"""
+    return CATALOG.resolve(challenge_id)
 
 def get_challenge_by_category(category, exclude_ids=None, return_all=False):
     """
     Get a random challenge from a specific category, optionally excluding certain IDs.
     If return_all is True, returns all challenges in the category instead of a random one.
     """
-    if exclude_ids is None:
-        exclude_ids = []
-    
-    # Filter challenges by category and not in exclude list
-    available_challenges = [
-        c for c in ALL_CHALLENGES 
-        if c["category"] == category and c["id"] not in exclude_ids
-    ]
-    
-    # Return all challenges or a random one
     if return_all:
-        return available_challenges
-    elif available_challenges:
-        return random.choice(available_challenges)
-    return None
+        return CATALOG.by_category(category, exclude_ids)
+    return CATALOG.random(category, exclude_ids)
 
 def get_challenges_by_category(category):
     """Get all challenges in a specific category"""
-    return [c for c in ALL_CHALLENGES if c["category"] == category]
+    return CATALOG.by_category(category)
 
 def get_random_challenge(exclude_ids=None):
     """Get a completely random challenge, optionally excluding certain IDs"""
-    if exclude_ids is None:
-        exclude_ids = []
-    
-    available_challenges = [c for c in ALL_CHALLENGES if c["id"] not in exclude_ids]
-    
-    if available_challenges:
-        return random.choice(available_challenges)
-    return None
+    return CATALOG.random(exclude_ids=exclude_ids)
+
+def sample_challenge(categories=None, exclude_ids=None):
+    """Get a random challenge from the given categories that isn't excluded"""
+    return CATALOG.sample(categories, exclude_ids)
@@ -0,0 +1,73 @@
+"""
+Streak rules shared by the Django app, the SQLAlchemy CRUD layer and the
+Streamlit session.
+A streak counts consecutive calendar days with at least one completion, in
+the couple's own timezone. It stays alive until a whole day is missed: a
+run ending yesterday still counts as current today.
+"""
+
+import datetime
+from collections import namedtuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = "UTC"
+
+Streaks = namedtuple("Streaks", ["current", "longest"])
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def is_known_zone(name):
+    """Whether a timezone name is a known IANA zone"""
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def get_zone(name):
+    """ZoneInfo for a timezone name, falling back to UTC for unknown or empty names"""
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def local_day(moment, zone):
+    """Calendar day of a moment in a timezone; naive moments are taken as UTC"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(zone).date()
+
+
+def advance_streak(streak, last_day, today):
+    """Streak after completing something on `today`, given the previous completion day"""
+    if last_day is None:
+        return 1
+    if last_day >= today:
+        # Another completion the same day (or a clock/timezone change)
+        return max(streak, 1)
+    if last_day == today - ONE_DAY:
+        return streak + 1
+    return 1
+
+
+def compute_streaks(days, today):
+    """
+    Current and longest streak from the days with completions, in one pass.
+    `days` must be ascending; repeats and days after `today` are ignored.
+    """
+    longest = run = 0
+    previous = None
+    for day in days:
+        if day > today:
+            break
+        if day == previous:
+            continue
+        run = run + 1 if previous is not None and day - previous == ONE_DAY else 1
+        longest = max(longest, run)
+        previous = day
+
+    current = run if previous is not None and today - previous <= ONE_DAY else 0
+    return Streaks(current, longest)
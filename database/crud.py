@@ -1,9 +1,10 @@
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any, Union
 import json
 
 from . import models
+from data import badges, streaks
 
 def create_user(db: Session, partner1_name: str, partner2_name: str, 
                relationship_status: str, relationship_duration: str,
@@ -81,30 +82,31 @@ def complete_challenge(db: Session, user_id: int, challenge_id: str, category: s
         return existing
     
     # Add completed challenge
-    today = datetime.now()
+    now = datetime.now(timezone.utc)
     db_completed = models.CompletedChallenge(
         user_id=user_id,
         challenge_id=challenge_id,
         category=category,
-        completed_at=today
+        completed_at=now
     )
     db.add(db_completed)
     
     # Update progress
     db_progress = get_user_progress(db, user_id)
     if db_progress:
+        before = badges.progress_metrics(db_progress.total_completed, db_progress.streak)
+        
         # Update total completed
         db_progress_data = {}
         db_progress_data['total_completed'] = db_progress.total_completed + 1
         
-        # Update last completed date
-        db_progress_data['last_completed'] = today
+        # Update streak (calendar days in UTC; this schema has no per-couple timezone)
+        zone = streaks.get_zone(None)
+        last_day = streaks.local_day(db_progress.last_completed, zone) if db_progress.last_completed else None
+        db_progress_data['streak'] = streaks.advance_streak(db_progress.streak, last_day, streaks.local_day(now, zone))
         
-        # Update streak
-        if db_progress.last_completed and db_progress.last_completed.date() == (today - timedelta(days=1)).date():
-            db_progress_data['streak'] = db_progress.streak + 1
-        elif db_progress.last_completed and db_progress.last_completed.date() != today.date():
-            db_progress_data['streak'] = 1
+        # Update last completed date
+        db_progress_data['last_completed'] = now
             
         # Update spark level (max 100%)
         db_progress_data['spark_level'] = min(db_progress.spark_level + 5, 100)
@@ -112,55 +114,50 @@ def complete_challenge(db: Session, user_id: int, challenge_id: str, category: s
         # Apply all updates
         for key, value in db_progress_data.items():
             setattr(db_progress, key, value)
+        
+        after = badges.progress_metrics(db_progress.total_completed, db_progress.streak)
+        
+        # Award badges crossed by this completion in the same commit
+        crossed = badges.crossed_badges(before, after)
+        if crossed:
+            # Streak badges can be crossed again after a streak resets
+            held = get_badge_names(db, user_id)
+            award_badges(db, user_id, [name for name in crossed if name not in held])
     
     db.commit()
     db.refresh(db_completed)
     
-    # Check for badges
-    check_for_badges(db, user_id)
-    
     return db_completed
 
-def check_for_badges(db: Session, user_id: int) -> None:
-    """Check and award new badges based on progress"""
+def check_for_badges(db: Session, user_id: int) -> List[str]:
+    """Award any badges the user's current progress qualifies for"""
     progress = get_user_progress(db, user_id)
     if not progress:
-        return
-    
-    # Get existing badges
-    existing_badges = [badge.badge_name for badge in 
-                      db.query(models.UserBadge).filter(models.UserBadge.user_id == user_id).all()]
+        return []
     
-    # Challenge completion badges
-    if progress.total_completed >= 1 and "First Spark" not in existing_badges:
-        award_badge(db, user_id, "First Spark")
-    if progress.total_completed >= 5 and "Flame Starter" not in existing_badges:
-        award_badge(db, user_id, "Flame Starter")
-    if progress.total_completed >= 10 and "Burning Bright" not in existing_badges:
-        award_badge(db, user_id, "Burning Bright")
-    if progress.total_completed >= 25 and "Inferno" not in existing_badges:
-        award_badge(db, user_id, "Inferno")
-    
-    # Streak badges
-    if progress.streak >= 3 and "3 Day Streak" not in existing_badges:
-        award_badge(db, user_id, "3 Day Streak")
-    if progress.streak >= 7 and "1 Week Connection" not in existing_badges:
-        award_badge(db, user_id, "1 Week Connection")
-    if progress.streak >= 14 and "2 Week Devotion" not in existing_badges:
-        award_badge(db, user_id, "2 Week Devotion")
-    if progress.streak >= 30 and "Monthly Passion" not in existing_badges:
-        award_badge(db, user_id, "Monthly Passion")
+    metrics = badges.progress_metrics(progress.total_completed, progress.streak)
+    names = badges.earned_badges(metrics, get_badge_names(db, user_id))
+    award_badges(db, user_id, names)
+    db.commit()
+    return names
+
+def award_badges(db: Session, user_id: int, badge_names: List[str]) -> List[models.UserBadge]:
+    """Add several badges to the session; the caller commits them in one flush"""
+    new_badges = [models.UserBadge(user_id=user_id, badge_name=name) for name in badge_names]
+    db.add_all(new_badges)
+    return new_badges
 
 def award_badge(db: Session, user_id: int, badge_name: str) -> models.UserBadge:
     """Award a badge to a user"""
-    new_badge = models.UserBadge(
-        user_id=user_id,
-        badge_name=badge_name
-    )
-    db.add(new_badge)
+    new_badge = award_badges(db, user_id, [badge_name])[0]
     db.commit()
     return new_badge
 
+def get_badge_names(db: Session, user_id: int) -> set:
+    """Get the names of all badges a user holds"""
+    rows = db.query(models.UserBadge.badge_name).filter(models.UserBadge.user_id == user_id).all()
+    return {row[0] for row in rows}
+
 def get_user_badges(db: Session, user_id: int) -> List[models.UserBadge]:
     """Get all badges for a user"""
     return db.query(models.UserBadge).filter(models.UserBadge.user_id == user_id).all()
@@ -114,6 +114,37 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; point this at Redis/Memcached to share the
+# user state cache across worker processes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'playlove-spark',
+    }
+}
+
+# Cache alias and timeout (seconds) used by core.user_state
+USER_STATE_CACHE_ALIAS = 'default'
+USER_STATE_CACHE_TIMEOUT = 60 * 15
+
+# AI generation backends in order of preference (see utils.llm_backends)
+AI_BACKEND = os.environ.get('AI_BACKEND', 'gemini')
+
+# SQLite files shared by the worker processes on a host (see utils.sqlite_store).
+# Anchored at BASE_DIR; a relative path from the environment is taken from there too
+CHALLENGE_CACHE_PATH = BASE_DIR / os.environ.get('CHALLENGE_CACHE_PATH', 'challenge_cache.db')
+JOB_QUEUE_PATH = BASE_DIR / os.environ.get('JOB_QUEUE_PATH', 'job_queue.db')
+AI_METRICS_PATH = BASE_DIR / os.environ.get('AI_METRICS_PATH', 'ai_metrics.db')
+AI_BUDGET_PATH = BASE_DIR / os.environ.get('AI_BUDGET_PATH', 'ai_budget.db')
+AI_BREAKER_PATH = BASE_DIR / os.environ.get('AI_BREAKER_PATH', 'ai_breaker.db')
+
+# Keeps those files in a temporary directory during test runs
+TEST_RUNNER = 'playlove_spark.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,28 @@
+"""
+Test runner that keeps the SQLite stores used by utils/ (AI challenge cache,
+job queue, metrics and the like) out of the project directory: for the test
+run their settings point into a temporary directory.
+"""
+
+import atexit
+import os
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Settings naming the SQLite stores (see utils.sqlite_store)
+STORE_SETTINGS = ['CHALLENGE_CACHE_PATH', 'JOB_QUEUE_PATH', 'AI_METRICS_PATH', 'AI_BUDGET_PATH',
+                  'AI_BREAKER_PATH']
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        store_dir = tempfile.TemporaryDirectory()
+        # Kept until exit: metrics are flushed by an atexit handler registered
+        # later, and atexit runs handlers in reverse order
+        atexit.register(store_dir.cleanup)
+        override_settings(**{
+            setting: os.path.join(store_dir.name, f'{setting.lower()}.db') for setting in STORE_SETTINGS
+        }).enable()
@@ -1,47 +1,77 @@
 """
 AI-powered challenge generator utility.
-Uses Google's Gemini API for generating relationship challenges
-with cost optimization strategies built in.
+Generates relationship challenges with the configured LLM backend
+(Google's Gemini by default) with cost optimization strategies built in.
 """
 
-import os
 import json
 import random
 import hashlib
-import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 
-import google.generativeai as genai
+from utils import ai_metrics
+from utils.ai_policy import get_policy
+from utils.challenge_cache import ChallengeCache, create_challenge_cache
+from utils.challenge_index import ChallengeIndex, challenge_id, fingerprint
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.gemini_client import AsyncGenerationClient
+from utils.llm_backends import get_backend
+from utils.json_stream import JSONObjectStream, iter_json_objects, parse_json_objects
+from utils.single_flight import ProcessLocks, SingleFlight
 
-# Configure the Google API with the key from environment
-API_KEY = os.environ.get("GOOGLE_API_KEY")
+# Backend picked by the AI_BACKEND setting (see utils.llm_backends)
+BACKEND = get_backend()
 
-# Helper function to handle different versions of the Google AI library
-def init_gemini():
-    """Initialize Google Gemini API based on available library version"""
-    if not API_KEY:
-        return False
-        
-    try:
-        # Try the newer syntax
-        genai.configure(api_key=API_KEY)
-        return True
-    except (AttributeError, TypeError):
-        try:
-            # Try older syntax or alternative approach
-            genai.api_key = API_KEY
-            return True
-        except Exception as e:
-            print(f"Failed to initialize Google AI: {str(e)}")
-            return False
+# Whether the backend can be used (API key set, library installed)
+AI_AVAILABLE = BACKEND.available()
+
+def create_model():
+    """Create a model handle for the selected backend"""
+    return BACKEND.create_model()
+
+# Usage, cost, cache and fallback metrics (see `manage.py ai_stats`)
+AI_METRICS = ai_metrics.get_metrics()
+
+# Minimal request used to check whether the provider has recovered
+PROBE_PROMPT = "Reply with the single word OK."
+
+def probe_provider() -> None:
+    """Circuit breaker probe; raises if the provider is still failing"""
+    get_client().generate_sync(PROBE_PROMPT, use_breaker=False)
+
+# Shared across workers: while open, calls fail fast and fallbacks are
+# served; a background probe closes it again once the provider recovers
+AI_BREAKER = CircuitBreaker(BACKEND.name, probe=probe_provider)
+
+# Single client (and model handle) shared by every generation call
+_client = None
 
-# Initialize the API
-AI_AVAILABLE = init_gemini()
+def get_client() -> AsyncGenerationClient:
+    """Get the shared generation client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = AsyncGenerationClient(create_model, recorder=AI_METRICS, breaker=AI_BREAKER)
+    return _client
 
-# Cache for storing generated challenges to reduce API calls
-# Structure: {cache_key: {"timestamp": datetime, "challenges": [list_of_challenges]}}
-CHALLENGE_CACHE = {}
-CACHE_LIFETIME = datetime.timedelta(days=30)  # Cache lifetime - 30 days
+def set_client(client: Optional[AsyncGenerationClient]) -> None:
+    """Replace the shared client, e.g. with one wrapping FakeModel in tests"""
+    global _client
+    _client = client
+
+# Cache for storing generated challenges to reduce API calls.
+# Memory LRU in front of a persistent SQLite tier shared by all workers
+CHALLENGE_CACHE = create_challenge_cache()
+
+# Coalesces concurrent cache misses for the same key into one model call;
+# with the persistent cache, workers in other processes wait on it too
+GENERATION_FLIGHT = SingleFlight(
+    ProcessLocks(CHALLENGE_CACHE.persistent.location) if CHALLENGE_CACHE.persistent else None,
+    recorder=AI_METRICS
+)
+
+# Fingerprint index of every challenge generated in this process; gives
+# each one a stable content-derived id and catches (near) duplicates
+GENERATED_INDEX = ChallengeIndex()
 
 # Categories
 CATEGORIES = [
@@ -55,6 +85,12 @@ CATEGORIES = [
 # Difficulty levels
 DIFFICULTY_LEVELS = ["easy", "medium", "hard"]
 
+# Expected type of each challenge field (required, then optional)
+CHALLENGE_SCHEMA = {
+    "required": {"id": str, "title": str, "description": str, "category": str, "difficulty": str},
+    "optional": {"estimated_time": str, "benefits": list},
+}
+
 def get_cache_key(user_profile: Dict[str, Any], category: Optional[str] = None) -> str:
     """
     Create a deterministic cache key based on relevant user profile data
@@ -70,50 +106,27 @@ def get_cache_key(user_profile: Dict[str, Any], category: Optional[str] = None)
     cache_str = json.dumps(cache_data, sort_keys=True)
     return hashlib.md5(cache_str.encode()).hexdigest()
 
-def check_cache(cache_key: str) -> List[Dict[str, Any]]:
+def check_cache(cache_key: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
     """Check if we have valid cached challenges for this profile/category."""
-    if cache_key in CHALLENGE_CACHE:
-        cache_entry = CHALLENGE_CACHE[cache_key]
-        cache_time = cache_entry.get("timestamp")
-        now = datetime.datetime.now()
-        
-        # If cache is still valid and has challenges
-        if (now - cache_time < CACHE_LIFETIME) and cache_entry.get("challenges"):
-            return cache_entry.get("challenges", [])
-    
-    return []
+    challenges = CHALLENGE_CACHE.get(cache_key)
+    AI_METRICS.record(ai_metrics.CACHE_HIT if challenges else ai_metrics.CACHE_MISS, category or "any")
+    return challenges
+
+def peek_cache(cache_key: str) -> List[Dict[str, Any]]:
+    """Cached challenges for a key, without counting a cache lookup."""
+    return CHALLENGE_CACHE.peek(cache_key)
 
 def store_in_cache(cache_key: str, challenges: List[Dict[str, Any]]) -> None:
     """Store generated challenges in the cache."""
-    CHALLENGE_CACHE[cache_key] = {
-        "timestamp": datetime.datetime.now(),
-        "challenges": challenges
-    }
+    CHALLENGE_CACHE.set(cache_key, challenges)
 
 def should_use_ai(user_profile: Dict[str, Any], completed_challenges: List[str], 
                  available_challenges: List[str], category: Optional[str] = None) -> bool:
     """
-    Determine if we should use AI to generate a challenge based on various factors
-    to optimize API usage and costs.
+    Determine if the user qualifies for an AI challenge under the configured
+    rules. Budgets and cache fill are applied by AIPolicy.decide().
     """
-    # If user has completed most available challenges in this category
-    if category and len(available_challenges) > 0:
-        completion_ratio = len(completed_challenges) / len(available_challenges)
-        if completion_ratio > 0.7:  # If user has completed 70% of available challenges
-            return True
-    
-    # Generate special AI challenges on milestone days
-    streak = user_profile.get("streak", 0)
-    if streak in [7, 14, 30, 50, 100]:  # Milestones
-        return True
-    
-    # If user has completed many challenges total
-    total_completed = user_profile.get("total_completed", 0)
-    if total_completed > 0 and total_completed % 10 == 0:  # Every 10 challenges
-        return True
-    
-    # Otherwise, stick with pre-defined challenges
-    return False
+    return get_policy().eligibility(user_profile, completed_challenges, available_challenges, category) is not None
 
 def generate_challenge_prompt(user_profile: Dict[str, Any], category: Optional[str] = None) -> str:
     """Generate an appropriate prompt for the AI based on user profile and category."""
@@ -173,35 +186,35 @@ Keep in mind:
 def extract_challenge_from_response(response_text: str) -> Dict[str, Any]:
     """Extract and parse the JSON challenge from the AI response."""
     try:
-        # Look for JSON between triple backticks
-        if "```json" in response_text and "```" in response_text.split("```json")[1]:
-            json_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            # Try to find any code block
-            json_text = response_text.split("```")[1].split("```")[0].strip()
-        else:
-            # Just try to parse the whole thing
-            json_text = response_text.strip()
-        
-        challenge = json.loads(json_text)
-        
-        # Validate required fields
-        required_fields = ["id", "title", "description", "category", "difficulty"]
-        for field in required_fields:
-            if field not in challenge:
-                raise ValueError(f"Missing required field: {field}")
-        
-        return challenge
+        # First valid challenge object anywhere in the reply (code fence or not)
+        for item in parse_json_objects(response_text):
+            challenge = validate_challenge(item)
+            if challenge is not None:
+                return challenge
+        raise ValueError("No valid challenge in response")
     
-    except (json.JSONDecodeError, ValueError, IndexError) as e:
+    except ValueError:
         # Fallback: create a structured challenge from unstructured response
-        return {
-            "id": f"ai_fallback_{random.randint(1000, 9999)}",
+        AI_METRICS.record(ai_metrics.FALLBACK, "unparseable")
+        challenge = {
             "title": "AI-Generated Challenge",
             "description": response_text.replace("```", "").strip(),
             "category": "Relationship Challenge",
             "difficulty": "medium"
         }
+        return dict(challenge, id=challenge_id(challenge))
+
+def fallback_challenge(user_profile: Dict[str, Any], category: Optional[str] = None,
+                       reason: str = "error") -> Dict[str, Any]:
+    """Challenge returned when generation fails, with a content-derived id"""
+    AI_METRICS.record(ai_metrics.FALLBACK, reason)
+    challenge = {
+        "title": "Connection Exercise",
+        "description": f"Take 15 minutes today to share three things you appreciate about each other. Start with '{user_profile.get('partner1_name', 'Partner 1')}, one thing I really appreciate about you is...'",
+        "category": category or "Communication Boosters",
+        "difficulty": "easy"
+    }
+    return dict(challenge, id=challenge_id(challenge))
 
 def generate_ai_challenge(user_profile: Dict[str, Any], category: Optional[str] = None) -> Dict[str, Any]:
     """
@@ -210,117 +223,65 @@ def generate_ai_challenge(user_profile: Dict[str, Any], category: Optional[str]
     """
     # Check cache first
     cache_key = get_cache_key(user_profile, category)
-    cached_challenges = check_cache(cache_key)
+    cached_challenges = check_cache(cache_key, category)
     
     if cached_challenges:
         # Return a random challenge from cache
         return random.choice(cached_challenges)
     
     try:
-        # Create the AI model - using Gemini Pro for structured content generation
-        def create_model():
-            """Helper function to create the AI model with version compatibility"""
-            try:
-                # Try different approaches based on API version
-                try:
-                    return genai.GenerativeModel('gemini-1.5-pro')
-                except AttributeError:
-                    try:
-                        return genai.get_model('gemini-1.5-pro')
-                    except AttributeError:
-                        return genai.models.get_model('gemini-1.5-pro')
-            except Exception as e:
-                print(f"Error creating model: {str(e)}")
-                return None
-                
-        model = create_model()
-        
         # Generate the prompt
         prompt = generate_challenge_prompt(user_profile, category)
         
-        # Only proceed if we have a valid model
-        if model:
-            try:
-                # Get the response from Gemini - handle different API versions
-                try:
-                    response = model.generate_content(prompt)
-                    response_text = response.text if hasattr(response, 'text') else str(response)
-                except AttributeError:
-                    # Alternative API formats
-                    try:
-                        response = model.predict(prompt)
-                        response_text = response
-                    except:
-                        # One more attempt with different method naming
-                        response = model.generate(prompt)
-                        response_text = response.result if hasattr(response, 'result') else str(response)
-                
-                # Process the response
-                challenge = extract_challenge_from_response(response_text)
-                
-                # Store in cache for future use
-                store_in_cache(cache_key, [challenge])
-                
-                return challenge
-            except Exception as e:
-                print(f"Error generating AI content: {str(e)}")
-                # Will fall through to the fallback return
+        def generate():
+            # Shared client: one model handle, bounded concurrency, deadline and retries
+            response_text = get_client().generate_sync(prompt)
+            
+            # Process the response; the index gives it a stable id (or returns
+            # the challenge it duplicates)
+            challenge, _ = GENERATED_INDEX.add(extract_challenge_from_response(response_text))
+            
+            # Store in cache for future use
+            store_in_cache(cache_key, [challenge])
+            
+            return challenge
+        
+        def generated_elsewhere():
+            # Filled in by a leader in another process
+            cached = CHALLENGE_CACHE.peek(cache_key)
+            return random.choice(cached) if cached else None
+        
+        try:
+            # Concurrent misses on this key share a single generation
+            challenge = GENERATION_FLIGHT.do(cache_key, generate, check=generated_elsewhere)
+            return dict(challenge)
+        except CircuitOpenError:
+            # Provider is unhealthy; don't wait on it
+            return fallback_challenge(user_profile, category, "circuit_open")
+        except Exception as e:
+            print(f"Error generating AI content: {str(e)}")
+            # Will fall through to the fallback return
         
         # Fallback if model is invalid or response failed
-        return {
-            "id": f"ai_fallback_{random.randint(1000, 9999)}",
-            "title": "Connection Exercise",
-            "description": f"Take 15 minutes today to share three things you appreciate about each other. Start with '{user_profile.get('partner1_name', 'Partner 1')}, one thing I really appreciate about you is...'",
-            "category": category or "Communication Boosters",
-            "difficulty": "easy"
-        }
+        return fallback_challenge(user_profile, category, "generation_failed")
             
     except Exception as e:
         # Log the error (in production, use proper logging)
         print(f"Error generating AI challenge: {str(e)}")
         
         # Return a fallback challenge
-        return {
-            "id": f"ai_error_{random.randint(1000, 9999)}",
-            "title": "Connection Exercise",
-            "description": f"Take 15 minutes today to share three things you appreciate about each other. Start with '{user_profile.get('partner1_name', 'Partner 1')}, one thing I really appreciate about you is...'",
-            "category": category or "Communication Boosters",
-            "difficulty": "easy"
-        }
+        return fallback_challenge(user_profile, category)
 
-def batch_generate_challenges(user_profile: Dict[str, Any], count: int = 5, 
-                             categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+def build_batch_prompt(user_profile: Dict[str, Any], count: int, categories: List[str]) -> str:
     """
-    Generate multiple challenges in batch to reduce API calls.
-    This is meant for background generation during off-peak hours.
+    Generate the prompt asking for a batch of challenges.
+    Batches are cached per profile bucket and served to every couple in it,
+    so the prompt never contains names and asks for placeholders instead.
     """
-    categories = categories or CATEGORIES
-    challenges = []
-    
-    try:
-        # Create the AI model
-        def create_model():
-            """Helper function to create the AI model with version compatibility"""
-            try:
-                # Try different approaches based on API version
-                try:
-                    return genai.GenerativeModel('gemini-1.5-pro')
-                except AttributeError:
-                    try:
-                        return genai.get_model('gemini-1.5-pro')
-                    except AttributeError:
-                        return genai.models.get_model('gemini-1.5-pro')
-            except Exception as e:
-                print(f"Error creating model: {str(e)}")
-                return None
-                
-        model = create_model()
-        
-        # Generate a batch prompt
-        prompt = f"""Generate {count} unique relationship challenges for a couple.
+    prompt = f"""Generate {count} unique relationship challenges for a couple.
         
 Relationship Context:
-- Partner names: {user_profile.get('partner1_name', 'Partner 1')} and {user_profile.get('partner2_name', 'Partner 2')}
+- Partner names: not given; always write {{partner1}} and {{partner2}} instead
 - Relationship status: {user_profile.get('relationship_status', 'dating')}
 - Relationship duration: {user_profile.get('relationship_duration', '')}
 
@@ -340,67 +301,130 @@ Provide the response as a JSON array of challenges, each with this structure:
 ]
 ```
 
-Ensure each challenge is unique, actionable, appropriate for their relationship, and respectful.
+Keep in mind:
+1. Refer to the partners only as {{partner1}} and {{partner2}}, never by any other name
+2. Ensure each challenge is unique, actionable, appropriate for their relationship, and respectful
 """
-        
-        # Only proceed if we have a valid model
-        if model:
-            try:
-                # Get the response using appropriate method based on API version
-                try:
-                    response = model.generate_content(prompt)
-                    response_text = response.text if hasattr(response, 'text') else str(response)
-                except AttributeError:
-                    try:
-                        response = model.predict(prompt)
-                        response_text = response
-                    except:
-                        response = model.generate(prompt)
-                        response_text = response.result if hasattr(response, 'result') else str(response)
-                
-                # Try to extract the JSON array
-                if "```json" in response_text and "```" in response_text.split("```json")[1]:
-                    json_text = response_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_text:
-                    json_text = response_text.split("```")[1].split("```")[0].strip()
-                else:
-                    json_text = response_text.strip()
-                    
-                # Parse challenges
-                try:
-                    parsed_challenges = json.loads(json_text)
-                    if isinstance(parsed_challenges, list):
-                        challenges = parsed_challenges
-                except json.JSONDecodeError:
-                    # If we can't parse as JSON, create a fallback challenge
-                    fallback_challenge = {
-                        "id": f"ai_batch_fallback_{random.randint(1000, 9999)}",
-                        "title": "Connection Time",
-                        "description": "Take turns sharing three things you appreciate about each other.",
-                        "category": categories[0] if categories else "Communication Boosters",
-                        "difficulty": "easy"
-                    }
-                    challenges = [fallback_challenge]
-            except Exception as e:
-                print(f"Error in batch challenge generation: {str(e)}")
-                
-                # Store challenges by category in cache
-                for challenge in challenges:
-                    category = challenge.get("category")
-                    if category:
-                        cache_key = get_cache_key(user_profile, category)
-                        existing = check_cache(cache_key)
-                        if existing:
-                            # Append to existing cache
-                            existing.append(challenge)
-                            store_in_cache(cache_key, existing)
-                        else:
-                            # Create new cache entry
-                            store_in_cache(cache_key, [challenge])
+    return prompt
+
+def parse_batch_response(response_text: str) -> List[Dict[str, Any]]:
+    """Every complete JSON object in a batch response; malformed ones are skipped"""
+    return parse_json_objects(response_text)
+
+def validate_challenge(item: Any, categories: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Check a generated item against CHALLENGE_SCHEMA, a known category and a
+    valid difficulty. Returns a normalized copy, or None if it's unusable.
+    """
+    if not isinstance(item, dict):
+        return None
     
+    for field, field_type in CHALLENGE_SCHEMA["required"].items():
+        value = item.get(field)
+        if not isinstance(value, field_type) or (field_type is str and not value.strip()):
+            return None
+    if categories and item["category"] not in categories:
+        return None
+    
+    # Drop optional fields of the wrong type rather than the whole challenge
+    challenge = {
+        field: value for field, value in item.items()
+        if field not in CHALLENGE_SCHEMA["optional"] or isinstance(value, CHALLENGE_SCHEMA["optional"][field])
+    }
+    challenge["difficulty"] = challenge["difficulty"].strip().lower()
+    if challenge["difficulty"] not in DIFFICULTY_LEVELS:
+        challenge["difficulty"] = "medium"
+    return challenge
+
+def distribute_to_cache(user_profile: Dict[str, Any], challenges: List[Dict[str, Any]],
+                        cache: Optional[ChallengeCache] = None) -> Dict[str, int]:
+    """
+    Store challenges in their category bucket and in the any-category bucket,
+    skipping ones whose content is already cached there.
+    Returns the number of challenges added per cache key.
+    """
+    cache = cache or CHALLENGE_CACHE
+    buckets: Dict[str, List[Dict[str, Any]]] = {}
+    for challenge in challenges:
+        for category in (challenge["category"], None):
+            buckets.setdefault(get_cache_key(user_profile, category), []).append(challenge)
+    
+    stored = {}
+    for cache_key, new_challenges in buckets.items():
+        existing = cache.peek(cache_key)
+        seen = {fingerprint(c) for c in existing}
+        added = []
+        for challenge in new_challenges:
+            digest = fingerprint(challenge)
+            if digest not in seen:
+                seen.add(digest)
+                added.append(challenge)
+        if added:
+            # One write per bucket
+            cache.set(cache_key, existing + added)
+        stored[cache_key] = len(added)
+    return stored
+
+def run_batch_pipeline(user_profile: Dict[str, Any], count: int = 5, categories: Optional[List[str]] = None,
+                       cache: Optional[ChallengeCache] = None, client: Optional[AsyncGenerationClient] = None,
+                       metrics: Optional[ai_metrics.AIMetrics] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Generate a batch of challenges and feed them into the cache:
+    generate -> parse/validate -> dedupe against the content index -> distribute per category.
+    The reply is streamed and parsed incrementally, so one malformed element
+    or a truncated response only loses the affected challenges.
+    The cache, client and metrics default to the shared ones.
+    Returns the accepted challenges and pipeline stats.
+    """
+    categories = categories or CATEGORIES
+    client = client or get_client()
+    metrics = metrics or AI_METRICS
+    stats: Dict[str, Any] = {"requested": count, "parsed": 0, "invalid": 0, "duplicates": 0,
+                             "known": 0, "accepted": 0, "malformed": 0, "truncated": False, "error": None,
+                             "stored": {}}
+    
+    accepted = []
+    seen = set()
+    parser = JSONObjectStream()
+    try:
+        # Stream the reply and validate each challenge as soon as it closes
+        chunks = client.stream_sync(build_batch_prompt(user_profile, count, categories))
+        for item in iter_json_objects(chunks, parser):
+            stats["parsed"] += 1
+            challenge = validate_challenge(item, categories)
+            if challenge is None:
+                stats["invalid"] += 1
+                continue
+            # Near duplicates of known challenges map onto the existing one
+            challenge, is_new = GENERATED_INDEX.add(challenge)
+            if challenge["id"] in seen:
+                stats["duplicates"] += 1
+                continue
+            if not is_new:
+                stats["known"] += 1
+            seen.add(challenge["id"])
+            accepted.append(challenge)
     except Exception as e:
-        # Log error (use proper logging in production)
+        # Keep whatever arrived before the failure
         print(f"Error batch generating challenges: {str(e)}")
-        # We'll return whatever challenges we managed to generate
+        stats["error"] = str(e)
+    
+    stats["malformed"] = parser.malformed
+    stats["truncated"] = parser.truncated
+    stats["accepted"] = len(accepted)
+    stats["stored"] = distribute_to_cache(user_profile, accepted, cache)
     
-    return challenges
\ No newline at end of file
+    for outcome in ("accepted", "invalid", "duplicates", "known", "malformed"):
+        if stats[outcome]:
+            metrics.record(ai_metrics.BATCH_ITEMS, outcome, count=stats[outcome])
+    return accepted, stats
+
+def batch_generate_challenges(user_profile: Dict[str, Any], count: int = 5, 
+                             categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Generate multiple challenges in batch to reduce API calls.
+    This is meant for background generation during off-peak hours.
+    Accepted challenges are stored in the cache by category.
+    """
+    challenges, _ = run_batch_pipeline(user_profile, count, categories)
+    return challenges
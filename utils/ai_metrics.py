@@ -0,0 +1,185 @@
+"""
+Usage and cost metrics for AI generation.
+Model calls (tokens, latency), failures, cache hits/misses, fallbacks,
+batch outcomes and coalesced generations are aggregated per minute in
+memory and periodically flushed into a SQLite table shared by every worker
+process, so spend and hit rates can be queried (see `manage.py ai_stats`)
+and should_use_ai tuned on data.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple, Union
+
+from utils.sqlite_store import SQLiteStore, StorePath
+
+# Settings (overridable from the environment; the path from Django settings)
+METRICS_PATH = StorePath("AI_METRICS_PATH", "ai_metrics.db")
+FLUSH_INTERVAL = 10.0  # Seconds between writes to the metrics table
+RETENTION = 90 * 24 * 60 * 60  # Rows are kept for 90 days
+
+# Price per 1,000 tokens in USD, used for cost estimates (Gemini 1.5 Pro list price)
+PROMPT_COST_PER_1K = float(os.environ.get("AI_PROMPT_COST_PER_1K", "0.00125"))
+RESPONSE_COST_PER_1K = float(os.environ.get("AI_RESPONSE_COST_PER_1K", "0.005"))
+
+# Event names
+CALL = "call"  # Successful model call; detail is the operation
+FAILURE = "failure"  # Failed attempt; detail is the reason
+CACHE_HIT = "cache_hit"  # Detail is the category ("any" for none)
+CACHE_MISS = "cache_miss"
+FALLBACK = "fallback"  # Fallback challenge served; detail is the reason
+BATCH_ITEMS = "batch_items"  # Batch pipeline outcome; detail is accepted/invalid/...
+POLICY = "policy"  # AI vs static decision; detail is the reason (see utils.ai_policy)
+FLIGHT = "single_flight"  # Generation coalescing; detail is executions/shared_in_process/shared_across_processes
+
+# FLIGHT details that are calls saved by coalescing (see utils.single_flight)
+SHARED_FLIGHTS = ("shared_in_process", "shared_across_processes")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ai_metrics (
+    minute INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    response_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (minute, event, detail)
+);
+"""
+
+Key = Tuple[int, str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for when the API doesn't report usage (~4 characters per token)"""
+    return (len(text or "") + 3) // 4
+
+
+def estimate_cost(prompt_tokens: int, response_tokens: int) -> float:
+    return prompt_tokens / 1000 * PROMPT_COST_PER_1K + response_tokens / 1000 * RESPONSE_COST_PER_1K
+
+
+class AIMetrics(SQLiteStore):
+    """Per-minute counters, buffered in memory and flushed to SQLite (None: not stored)"""
+
+    schema = SCHEMA
+    memory_fallback = True
+    unavailable_message = "AI metrics table unavailable, metrics will not be stored"
+
+    def __init__(self, path: Union[str, StorePath, None] = METRICS_PATH, flush_interval: float = FLUSH_INTERVAL,
+                 retention: float = RETENTION):
+        super().__init__(path)
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._pending: Dict[Key, List[float]] = {}
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, event: str, detail: str = "", count: int = 1, prompt_tokens: int = 0,
+               response_tokens: int = 0, latency_ms: float = 0.0) -> None:
+        """Add to the counters for this minute; flushes if the interval has passed"""
+        key = (int(time.time() // 60), event, detail or "")
+        with self._lock:
+            totals = self._pending.setdefault(key, [0, 0, 0, 0.0])
+            totals[0] += count
+            totals[1] += prompt_tokens
+            totals[2] += response_tokens
+            totals[3] += latency_ms
+            due = time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def record_call(self, operation: str, prompt_tokens: int, response_tokens: int, latency: float) -> None:
+        """A successful model call; latency in seconds"""
+        self.record(CALL, operation, 1, prompt_tokens, response_tokens, latency * 1000)
+
+    def record_failure(self, reason: str) -> None:
+        self.record(FAILURE, reason)
+
+    def record_flight(self, outcome: str) -> None:
+        """A generation that ran, or was shared with a caller instead of running again"""
+        self.record(FLIGHT, outcome)
+
+    def flush(self) -> None:
+        """Write buffered counters to the metrics table"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending or self.path is None:
+            return
+
+        try:
+            with self._connect() as conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO ai_metrics (minute, event, detail, count, prompt_tokens, response_tokens, latency_ms) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (minute, event, detail) DO UPDATE SET "
+                    "count = count + excluded.count, "
+                    "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                    "response_tokens = response_tokens + excluded.response_tokens, "
+                    "latency_ms = latency_ms + excluded.latency_ms",
+                    [key + tuple(totals) for key, totals in pending.items()]
+                )
+                conn.execute("DELETE FROM ai_metrics WHERE minute < ?", (int((time.time() - self.retention) // 60),))
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Error writing AI metrics: {str(e)}")
+
+    def rows(self, since: float = 0.0) -> List[Tuple[str, str, int, int, int, float]]:
+        """Totals per (event, detail) since a timestamp: (event, detail, count, prompt, response, latency_ms)"""
+        self.flush()
+        if self.path is None:
+            return []
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT event, detail, SUM(count), SUM(prompt_tokens), SUM(response_tokens), SUM(latency_ms) "
+                "FROM ai_metrics WHERE minute >= ? GROUP BY event, detail ORDER BY event, detail",
+                (int(since // 60),)
+            ).fetchall()
+
+    def summary(self, since: float = 0.0) -> Dict[str, Any]:
+        """Headline numbers since a timestamp"""
+        totals = {event: {} for event in (CALL, FAILURE, CACHE_HIT, CACHE_MISS, FALLBACK, BATCH_ITEMS, POLICY, FLIGHT)}
+        calls = prompt_tokens = response_tokens = 0
+        latency_ms = 0.0
+        for event, detail, count, prompt, response, latency in self.rows(since):
+            totals.setdefault(event, {})[detail] = count
+            if event == CALL:
+                calls += count
+                prompt_tokens += prompt
+                response_tokens += response
+                latency_ms += latency
+
+        hits = sum(totals[CACHE_HIT].values())
+        lookups = hits + sum(totals[CACHE_MISS].values())
+        return {
+            "calls": calls,
+            "failures": sum(totals[FAILURE].values()),
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "cost": estimate_cost(prompt_tokens, response_tokens),
+            "avg_latency_ms": latency_ms / calls if calls else 0.0,
+            "cache_hit_rate": hits / lookups if lookups else 0.0,
+            "fallbacks": sum(totals[FALLBACK].values()),
+            "calls_saved": sum(totals[FLIGHT].get(detail, 0) for detail in SHARED_FLIGHTS),
+            "by_event": totals,
+        }
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> AIMetrics:
+    """Get the process-wide metrics recorder, creating it on first use"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = AIMetrics()
+            atexit.register(_metrics.flush)
+        return _metrics
@@ -0,0 +1,227 @@
+"""
+Policy for choosing between AI-generated and static challenges.
+The rules that make a user eligible for AI challenges are configurable, and
+every model call has to fit in token-bucket budgets: a global per-minute
+rate (absorbs load spikes), a global daily allowance and a daily allowance
+per user. Budgets live in a SQLite table shared by all worker processes.
+Serving an already cached AI challenge costs nothing, so the bar for it is
+lower; when budgets run out, requests fall back to the static catalog
+instead of queuing more model calls.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from utils.sqlite_store import SQLiteStore, StorePath
+
+# Settings (overridable from the environment; the path from Django settings)
+BUDGET_PATH = StorePath("AI_BUDGET_PATH", "ai_budget.db")
+CALLS_PER_MINUTE = float(os.environ.get("AI_CALLS_PER_MINUTE", "30"))
+CALLS_PER_DAY = float(os.environ.get("AI_CALLS_PER_DAY", "2000"))
+USER_CALLS_PER_DAY = float(os.environ.get("AI_USER_CALLS_PER_DAY", "5"))
+
+MINUTE = 60.0
+DAY = 24 * 60 * 60.0
+
+# (bucket name, capacity, tokens added per second)
+Limit = Tuple[str, float, float]
+
+
+@dataclass(frozen=True)
+class PolicyConfig:
+    completion_ratio: float = 0.7  # Share of a category completed before AI challenges are generated
+    cached_completion_ratio: float = 0.4  # Lower bar when a cached AI challenge can be served for free
+    milestones: Tuple[int, ...] = (7, 14, 30, 50, 100)  # Streak days that get an AI challenge
+    every_n_completed: int = 10  # Every Nth completed challenge gets an AI challenge
+    calls_per_minute: float = CALLS_PER_MINUTE
+    calls_per_day: float = CALLS_PER_DAY
+    user_calls_per_day: float = USER_CALLS_PER_DAY
+
+
+@dataclass(frozen=True)
+class Decision:
+    use_ai: bool  # Try to serve an AI challenge
+    generate: bool  # A model call may be queued (cache miss or refill)
+    reason: str
+
+
+class TokenBuckets(SQLiteStore):
+    """
+    Named token buckets, refilled continuously up to their capacity.
+    Stored in SQLite when a path is given (shared by all processes, opened
+    on first use), otherwise in memory.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS ai_budget (
+        name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ai_budget_updated_at ON ai_budget (updated_at);
+    """
+    memory_fallback = True
+    unavailable_message = "AI budget table unavailable, using per-process budgets"
+
+    def __init__(self, path: Union[str, StorePath, None] = BUDGET_PATH):
+        super().__init__(path)
+        self._memory: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _refill(state: Optional[Tuple[float, float]], capacity: float, rate: float, now: float) -> float:
+        if state is None:
+            return capacity
+        tokens, updated_at = state
+        return min(capacity, tokens + (now - updated_at) * rate)
+
+    def _levels(self, limits: Iterable[Limit], states: Dict[str, Tuple[float, float]], now: float) -> Dict[str, float]:
+        return {name: self._refill(states.get(name), capacity, rate, now) for name, capacity, rate in limits}
+
+    def try_consume(self, limits: List[Limit], cost: float = 1.0) -> bool:
+        """Take `cost` tokens from every bucket, or from none if any is short"""
+        now = time.time()
+        if self.path is None:
+            with self._lock:
+                levels = self._levels(limits, self._memory, now)
+                if any(level < cost for level in levels.values()):
+                    return False
+                for name, level in levels.items():
+                    self._memory[name] = (level - cost, now)
+                return True
+
+        names = [name for name, _, _ in limits]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT name, tokens, updated_at FROM ai_budget WHERE name IN ({','.join('?' * len(names))})",
+                    names
+                ).fetchall()
+                levels = self._levels(limits, {name: (tokens, updated) for name, tokens, updated in rows}, now)
+                allowed = all(level >= cost for level in levels.values())
+                if allowed:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO ai_budget (name, tokens, updated_at) VALUES (?, ?, ?)",
+                        [(name, level - cost, now) for name, level in levels.items()]
+                    )
+                    # Buckets untouched for two days are full again; drop them
+                    conn.execute("DELETE FROM ai_budget WHERE updated_at < ?", (now - 2 * DAY,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed
+
+    def levels(self, limits: List[Limit]) -> Dict[str, float]:
+        """Current tokens in each bucket, without consuming any"""
+        now = time.time()
+        if self.path is None:
+            with self._lock:
+                return self._levels(limits, self._memory, now)
+        names = [name for name, _, _ in limits]
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT name, tokens, updated_at FROM ai_budget WHERE name IN ({','.join('?' * len(names))})",
+                names
+            ).fetchall()
+        return self._levels(limits, {name: (tokens, updated) for name, tokens, updated in rows}, now)
+
+
+class AIPolicy:
+    """Decides AI vs static per request, within the call budgets"""
+
+    def __init__(self, config: Optional[PolicyConfig] = None, buckets: Optional[TokenBuckets] = None):
+        self.config = config or PolicyConfig()
+        self.buckets = buckets if buckets is not None else TokenBuckets()
+
+    def global_limits(self) -> List[Limit]:
+        config = self.config
+        return [
+            ("global:minute", config.calls_per_minute, config.calls_per_minute / MINUTE),
+            ("global:day", config.calls_per_day, config.calls_per_day / DAY),
+        ]
+
+    def user_limits(self, user_id: Any) -> List[Limit]:
+        if user_id is None:
+            return []
+        return [(f"user:{user_id}:day", self.config.user_calls_per_day, self.config.user_calls_per_day / DAY)]
+
+    def eligibility(self, user_profile: Dict[str, Any], completed_challenges: List[str],
+                    available_challenges: List[str], category: Optional[str] = None,
+                    cached: int = 0) -> Optional[str]:
+        """Why this request qualifies for an AI challenge, or None if it doesn't"""
+        config = self.config
+
+        # Share of the category's static challenges the user has done
+        if category and available_challenges:
+            done = len(set(completed_challenges) & set(available_challenges))
+            ratio = done / len(available_challenges)
+            threshold = config.cached_completion_ratio if cached else config.completion_ratio
+            if ratio >= threshold:
+                return "category_completion"
+
+        if user_profile.get("streak", 0) in config.milestones:
+            return "streak_milestone"
+
+        total_completed = user_profile.get("total_completed", 0)
+        if config.every_n_completed and total_completed > 0 and total_completed % config.every_n_completed == 0:
+            return "completion_milestone"
+
+        return None
+
+    def has_headroom(self, user_id: Any = None) -> bool:
+        """Whether the global (and user's) budget has room for one more model call"""
+        try:
+            return all(level >= 1 for level in self.headroom(user_id).values())
+        except sqlite3.Error as e:
+            print(f"Error checking AI budget: {str(e)}")
+            return False
+
+    def spend(self, user_id: Any = None) -> bool:
+        """Take one model call from the global (and user's) budget"""
+        try:
+            return self.buckets.try_consume(self.global_limits() + self.user_limits(user_id))
+        except sqlite3.Error as e:
+            print(f"Error updating AI budget: {str(e)}")
+            return False
+
+    def decide(self, user_profile: Dict[str, Any], completed_challenges: List[str],
+               available_challenges: List[str], category: Optional[str] = None,
+               cached: int = 0, needs_generation: bool = True) -> Decision:
+        """
+        Decide for one request. `cached` is the number of AI challenges the
+        user could be served from the cache right now; `needs_generation`
+        says whether serving would queue a model call (miss or low bucket).
+        The budget is only charged (spend) once a call is actually queued.
+        """
+        reason = self.eligibility(user_profile, completed_challenges, available_challenges, category, cached)
+        if reason is None:
+            return Decision(False, False, "not_eligible")
+        if not needs_generation:
+            return Decision(True, False, reason)
+        if self.has_headroom(user_profile.get("user_id")):
+            return Decision(True, True, reason)
+        if cached:
+            # Serve what's cached, but don't queue more calls
+            return Decision(True, False, "budget_exhausted")
+        return Decision(False, False, "budget_exhausted")
+
+    def headroom(self, user_id: Any = None) -> Dict[str, float]:
+        """Tokens left in the global (and user's) buckets"""
+        return self.buckets.levels(self.global_limits() + self.user_limits(user_id))
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_policy() -> AIPolicy:
+    """Get the process-wide policy, creating it on first use"""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = AIPolicy()
+        return _policy
@@ -0,0 +1,20 @@
+"""
+Helpers for processing large querysets and streams in fixed-size batches,
+e.g. management commands that iterate every user.
+"""
+
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Lists of up to `size` consecutive items"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,209 @@
+"""
+Two-tier cache for AI-generated challenges.
+A small in-process LRU tier sits in front of a persistent SQLite tier that
+survives restarts and is shared by every worker process on the host, so
+generated challenges aren't paid for again after each deploy.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from utils.sqlite_store import SQLiteStore, StorePath
+
+# Settings (overridable from the environment; the path from Django settings)
+CACHE_PATH = StorePath("CHALLENGE_CACHE_PATH", "challenge_cache.db")
+CACHE_BACKEND = os.environ.get("CHALLENGE_CACHE_BACKEND", "sqlite")  # "sqlite" or "memory"
+CACHE_TTL = 30 * 24 * 60 * 60  # Entries live 30 days
+MEMORY_TTL = 5 * 60  # Memory entries are re-read from disk after 5 minutes
+MEMORY_MAX_KEYS = 512
+PERSISTENT_MAX_KEYS = 10000
+MAX_PER_KEY = 50  # Challenges kept per cache key
+
+Challenges = List[Dict[str, Any]]
+
+
+class MemoryTier:
+    """Thread-safe LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_keys: int = MEMORY_MAX_KEYS, ttl: float = MEMORY_TTL):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Challenges]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, challenges = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(challenges)
+
+    def set(self, key: str, challenges: Challenges) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), list(challenges))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteTier(SQLiteStore):
+    """Persistent cache table in a SQLite file shared by all processes, opened on first use"""
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS challenge_cache (
+        cache_key TEXT PRIMARY KEY, challenges TEXT NOT NULL, stored_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS challenge_cache_stored_at ON challenge_cache (stored_at);
+    """
+
+    def __init__(self, path: Union[str, StorePath] = CACHE_PATH, ttl: float = CACHE_TTL,
+                 max_keys: int = PERSISTENT_MAX_KEYS):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_keys = max_keys
+
+    def get(self, key: str) -> Optional[Challenges]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT challenges FROM challenge_cache WHERE cache_key = ? AND stored_at > ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, challenges: Challenges) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO challenge_cache (cache_key, challenges, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(challenges), now)
+            )
+            # Evict expired entries, then the oldest ones beyond the size limit
+            conn.execute("DELETE FROM challenge_cache WHERE stored_at <= ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM challenge_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM challenge_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_keys,)
+            )
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM challenge_cache WHERE cache_key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM challenge_cache")
+
+
+class ChallengeCache:
+    """
+    Read-through cache over a memory tier and an optional persistent tier.
+    Keeps at most `max_per_key` challenges per key and counts hits and misses.
+    """
+
+    def __init__(self, memory: MemoryTier, persistent: Optional[SQLiteTier] = None,
+                 max_per_key: int = MAX_PER_KEY):
+        self.memory = memory
+        self.persistent = persistent
+        self.max_per_key = max_per_key
+        self._lock = threading.Lock()
+        self.metrics = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "writes": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.metrics[name] += 1
+
+    def _lookup(self, key: str):
+        """Find a key in the tiers; returns (challenges, tier name)"""
+        challenges = self.memory.get(key)
+        if challenges:
+            return challenges, "memory"
+
+        if self.persistent is not None:
+            try:
+                challenges = self.persistent.get(key)
+            except sqlite3.Error as e:
+                print(f"Challenge cache read error: {str(e)}")
+                challenges = None
+            if challenges:
+                self.memory.set(key, challenges)
+                return challenges, "persistent"
+
+        return [], None
+
+    def get(self, key: str) -> Challenges:
+        """Get the cached challenges for a key (empty list on a miss)"""
+        challenges, tier = self._lookup(key)
+        self._count(f"{tier}_hits" if tier else "misses")
+        return challenges
+
+    def peek(self, key: str) -> Challenges:
+        """Like get(), but without counting towards the hit/miss metrics"""
+        return self._lookup(key)[0]
+
+    def set(self, key: str, challenges: Challenges) -> None:
+        """Replace the challenges for a key, keeping only the newest max_per_key"""
+        challenges = list(challenges)[-self.max_per_key:]
+        self._count("writes")
+        self.memory.set(key, challenges)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, challenges)
+            except sqlite3.Error as e:
+                print(f"Challenge cache write error: {str(e)}")
+
+    def extend(self, key: str, challenges: Challenges) -> None:
+        """Add challenges to a key"""
+        self.set(key, self.peek(key) + list(challenges))
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.persistent is not None:
+            try:
+                self.persistent.delete(key)
+            except sqlite3.Error as e:
+                print(f"Challenge cache write error: {str(e)}")
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.persistent is not None:
+            try:
+                self.persistent.clear()
+            except sqlite3.Error as e:
+                print(f"Challenge cache write error: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and the overall hit rate"""
+        with self._lock:
+            stats = dict(self.metrics)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+
+def create_challenge_cache(backend: str = CACHE_BACKEND) -> ChallengeCache:
+    """
+    Build the cache for the configured backend ("sqlite" or "memory").
+    The SQLite file is only opened on first use; while it can't be, the
+    cache runs on the memory tier alone.
+    """
+    if backend == "memory":
+        return ChallengeCache(MemoryTier())
+    return ChallengeCache(MemoryTier(), SQLiteTier())
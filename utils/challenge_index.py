@@ -0,0 +1,159 @@
+"""
+Content index for AI-generated challenges.
+Every challenge gets a fingerprint of its normalized title and description
+and a stable id derived from it, so the same text always has the same id
+(and completed-challenge filtering works for AI challenges). Exact
+duplicates are found with one dict lookup; near duplicates with MinHash
+signatures over word shingles, bucketed by LSH bands. The index is per
+process and keeps the most recently used challenges up to a size limit.
+"""
+
+import os
+import re
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Settings (overridable from the environment)
+INDEX_SIZE = int(os.environ.get("AI_INDEX_SIZE", "5000"))  # Challenges kept per process
+
+SHINGLE_SIZE = 3  # Words per shingle
+NUM_PERMUTATIONS = 32  # MinHash signature length
+BANDS = 8  # LSH bands (NUM_PERMUTATIONS / BANDS rows each)
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Estimated Jaccard similarity to count as a duplicate
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240501)  # Fixed seed keeps signatures comparable across processes
+_A = _rng.randint(1, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+
+
+def normalize_text(text: Any) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w{}\s]", " ", str(text or "").lower()).split())
+
+
+def fingerprint(challenge: Dict[str, Any]) -> str:
+    """Hash of the normalized title and description"""
+    text = normalize_text(challenge.get("title")) + "|" + normalize_text(challenge.get("description"))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def challenge_id(challenge: Dict[str, Any]) -> str:
+    """Stable id derived from the category and content, e.g. ai_emotional_3f2a9c1b7d04"""
+    words = normalize_text(challenge.get("category")).split()
+    prefix = words[0] if words else "challenge"
+    return f"ai_{prefix}_{fingerprint(challenge)[:12]}"
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    words = normalize_text(text).split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(challenge: Dict[str, Any]) -> np.ndarray:
+    """MinHash signature of the challenge's word shingles"""
+    found = shingles(f"{challenge.get('title', '')} {challenge.get('description', '')}")
+    if not found:
+        return np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    hashes = np.array([zlib.crc32(s.encode()) for s in found], dtype=np.uint64)
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(a == b))
+
+
+class ChallengeIndex:
+    """
+    Thread-safe fingerprint (and optional near-duplicate) index of generated
+    challenges, bounded like an LRU: past `max_size` the least recently
+    matched or added challenge is dropped
+    """
+
+    def __init__(self, near_duplicates: bool = True, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 max_size: int = INDEX_SIZE):
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.max_size = max_size
+        self._by_fingerprint: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._signatures: Dict[str, np.ndarray] = {}  # fingerprint -> signature
+        self._bands: Dict[Tuple[int, bytes], List[str]] = {}  # band -> fingerprints
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_fingerprint)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        rows = NUM_PERMUTATIONS // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+    def _find(self, digest: str, signature: Optional[np.ndarray]) -> Optional[Dict[str, Any]]:
+        if digest in self._by_fingerprint:
+            self._by_fingerprint.move_to_end(digest)
+            return self._by_fingerprint[digest]
+        if signature is None:
+            return None
+        # Only challenges sharing an LSH band are compared
+        candidates = {fp for key in self._band_keys(signature) for fp in self._bands.get(key, ())}
+        for candidate in candidates:
+            if similarity(signature, self._signatures[candidate]) >= self.threshold:
+                self._by_fingerprint.move_to_end(candidate)
+                return self._by_fingerprint[candidate]
+        return None
+
+    def _evict(self) -> None:
+        """Drop least recently used challenges past the size limit, with their signatures and bands"""
+        while len(self._by_fingerprint) > self.max_size:
+            digest, _ = self._by_fingerprint.popitem(last=False)
+            signature = self._signatures.pop(digest, None)
+            if signature is None:
+                continue
+            for key in self._band_keys(signature):
+                band = self._bands.get(key)
+                if band is None:
+                    continue
+                band.remove(digest)
+                if not band:
+                    del self._bands[key]
+
+    def find_duplicate(self, challenge: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The indexed challenge this one duplicates, if any"""
+        signature = minhash(challenge) if self.near_duplicates else None
+        with self._lock:
+            return self._find(fingerprint(challenge), signature)
+
+    def add(self, challenge: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Index a challenge, giving it its stable id.
+        Returns (canonical challenge, whether it was new); for a duplicate the
+        canonical challenge is the one already indexed.
+        """
+        digest = fingerprint(challenge)
+        signature = minhash(challenge) if self.near_duplicates else None
+        with self._lock:
+            existing = self._find(digest, signature)
+            if existing is not None:
+                return existing, False
+
+            canonical = dict(challenge, id=challenge_id(challenge))
+            self._by_fingerprint[digest] = canonical
+            if signature is not None:
+                self._signatures[digest] = signature
+                for key in self._band_keys(signature):
+                    self._bands.setdefault(key, []).append(digest)
+            self._evict()
+            return canonical, True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_fingerprint.clear()
+            self._signatures.clear()
+            self._bands.clear()
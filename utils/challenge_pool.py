@@ -0,0 +1,87 @@
+"""
+Pre-warmed pool of AI challenges per profile bucket.
+Cache keys only depend on (relationship_status, relationship_duration,
+category), so the whole key space can be enumerated and filled ahead of
+time. Buckets are topped up to a target size whenever they drop below a
+low-water mark, so user requests almost never wait on a model call.
+"""
+
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils import ai_generator
+from utils.ai_generator import CATEGORIES, get_cache_key
+
+# Pool sizing defaults
+POOL_TARGET = 10  # Challenges to keep per bucket
+POOL_LOW_WATER = 3  # Refill once a bucket drops below this
+BATCH_SIZE = 10  # Challenges requested per model call
+MAX_REFILL_CALLS = 3  # Bound on model calls per refill, in case output is unusable
+
+Bucket = Tuple[Dict[str, Any], Optional[str]]
+
+
+def bucket_profile(relationship_status: str, relationship_duration: str) -> Dict[str, Any]:
+    """The anonymous profile used to generate challenges for a bucket"""
+    return {
+        "partner1_name": "{partner1}",
+        "partner2_name": "{partner2}",
+        "relationship_status": relationship_status,
+        "relationship_duration": relationship_duration,
+    }
+
+
+def iter_buckets(statuses: Iterable[str], durations: Iterable[str],
+                 categories: Optional[List[Optional[str]]] = None) -> Iterator[Bucket]:
+    """
+    Enumerate every (profile, category) bucket.
+    The None category covers requests that don't ask for a specific one.
+    """
+    if categories is None:
+        categories = list(CATEGORIES) + [None]
+    for status, duration, category in itertools.product(statuses, durations, categories):
+        yield bucket_profile(status, duration), category
+
+
+def bucket_size(profile: Dict[str, Any], category: Optional[str]) -> int:
+    """Number of challenges currently cached for a bucket"""
+    return len(ai_generator.CHALLENGE_CACHE.peek(get_cache_key(profile, category)))
+
+
+def needs_refill(profile: Dict[str, Any], category: Optional[str], low_water: int = POOL_LOW_WATER) -> bool:
+    return bucket_size(profile, category) < low_water
+
+
+def refill_bucket(profile: Dict[str, Any], category: Optional[str],
+                  target: int = POOL_TARGET, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Top a bucket up to `target` challenges with batched generation.
+    Returns the number of challenges added.
+    """
+    cache_key = get_cache_key(profile, category)
+    added = 0
+    for _ in range(MAX_REFILL_CALLS):
+        missing = target - bucket_size(profile, category)
+        if missing <= 0:
+            break
+
+        # The batch pipeline stores accepted challenges in their buckets itself
+        categories = [category] if category else None
+        _, stats = ai_generator.run_batch_pipeline(profile, min(missing, batch_size), categories)
+        stored = stats["stored"].get(cache_key, 0)
+        if not stored:
+            break
+        added += stored
+    return added
+
+
+def warm_pool(buckets: Iterable[Bucket], target: int = POOL_TARGET,
+              low_water: int = POOL_LOW_WATER, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Refill every bucket that is below the low-water mark"""
+    stats = {"buckets": 0, "refilled": 0, "added": 0}
+    for profile, category in buckets:
+        stats["buckets"] += 1
+        if needs_refill(profile, category, low_water):
+            stats["refilled"] += 1
+            stats["added"] += refill_bucket(profile, category, target, batch_size)
+    return stats
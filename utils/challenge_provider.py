@@ -3,37 +3,130 @@ Challenge provider utility that combines static challenges with AI-generated one
 Uses a hybrid approach to minimize AI API calls while providing varied challenges.
 """
 
-import os
 import random
 from typing import Dict, List, Optional, Any
 
 from data.challenges import get_challenge_by_id, get_challenge_by_category, get_random_challenge
-from utils.ai_generator import generate_ai_challenge, should_use_ai, batch_generate_challenges
+from utils import ai_metrics
+from utils.ai_generator import (
+    AI_BREAKER, AI_METRICS, generate_ai_challenge, batch_generate_challenges,
+    get_cache_key, check_cache, peek_cache
+)
+from utils.ai_policy import get_policy
+from utils.job_queue import get_queue
+from utils.challenge_pool import POOL_LOW_WATER, POOL_TARGET, bucket_profile, refill_bucket
 
 # Flag to enable/disable AI generation (for testing or if API key unavailable)
 from utils.ai_generator import AI_AVAILABLE
 AI_ENABLED = AI_AVAILABLE
 
+# Job kinds handled by the background queue
+GENERATE_JOB = "generate_ai_challenge"
+BATCH_JOB = "batch_generate_challenges"
+REFILL_JOB = "refill_challenge_pool"
+
+def _job_profile(user_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The anonymous bucket profile a job generates for. What a job generates
+    is cached per bucket and served to every couple in it, so names and the
+    user ID never go into the stored payload or the prompt.
+    """
+    return bucket_profile(user_profile.get("relationship_status", ""), user_profile.get("relationship_duration", ""))
+
+def _run_generate_job(payload: Dict[str, Any]) -> None:
+    """Generate one AI challenge; generate_ai_challenge stores it in the cache"""
+    generate_ai_challenge(_job_profile(payload["user_profile"]), payload.get("category"))
+
+def _run_batch_job(payload: Dict[str, Any]) -> None:
+    """Generate a batch of AI challenges into the cache"""
+    batch_generate_challenges(_job_profile(payload["user_profile"]), payload.get("count", 5))
+
+def _run_refill_job(payload: Dict[str, Any]) -> None:
+    """Top a pool bucket back up to its target size"""
+    refill_bucket(_job_profile(payload["user_profile"]), payload.get("category"), payload.get("target", POOL_TARGET))
+
+def get_job_queue():
+    """Get the job queue with the challenge generation handlers registered"""
+    queue = get_queue()
+    queue.register(GENERATE_JOB, _run_generate_job)
+    queue.register(BATCH_JOB, _run_batch_job)
+    queue.register(REFILL_JOB, _run_refill_job)
+    return queue
+
+def uncompleted_ai_challenges(cached: List[Dict[str, Any]], exclude_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Cached AI challenges the user hasn't completed"""
+    # AI challenge ids are derived from their content, so a completed
+    # challenge keeps its id wherever it is cached
+    excluded = set(exclude_ids or [])
+    return [c for c in cached if c.get("id") not in excluded]
+
+def request_ai_challenge(user_profile: Dict[str, Any], category: Optional[str] = None,
+                        exclude_ids: Optional[List[str]] = None,
+                        generate: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """
+    Get an AI challenge without blocking on the model.
+    Returns a cached challenge the user hasn't completed if there is one;
+    otherwise queues a generation job for this cache key (deduplicated) and
+    returns None so the caller can fall back to a static challenge.
+    `generate` says whether a model call may be queued; None asks the
+    policy for budget at the time one is needed.
+    """
+    cache_key = get_cache_key(user_profile, category)
+    cached = check_cache(cache_key, category)
+    available = uncompleted_ai_challenges(cached, exclude_ids)
+    
+    # Completed challenges stay cached, so size the pool target past them
+    target = len(cached) - len(available) + POOL_TARGET
+    if len(available) < POOL_LOW_WATER:
+        policy = get_policy()
+        user_id = user_profile.get("user_id")
+        if generate is None:
+            generate = policy.has_headroom(user_id)
+        # No point queuing calls while the breaker has the provider short-circuited;
+        # once its reset timeout has passed this starts the recovery probe
+        generate = generate and AI_BREAKER.healthy()
+        # Top up a low or exhausted bucket, or generate into an empty one;
+        # only jobs actually queued count against the budget
+        if generate and _submit(REFILL_JOB if cached else GENERATE_JOB, user_profile, category, cache_key, target):
+            policy.spend(user_id)
+    
+    return random.choice(available) if available else None
+
+def _submit(kind: str, user_profile: Dict[str, Any], category: Optional[str], cache_key: str,
+            target: int = POOL_TARGET) -> bool:
+    """Queue a generation job for a cache key, deduplicated per kind. Returns True if it was added."""
+    try:
+        return get_job_queue().submit(
+            kind,
+            {"user_profile": _job_profile(user_profile), "category": category, "target": target},
+            dedupe_key=f"{kind}:{cache_key}"
+        )
+    except Exception as e:
+        # Log the error but don't disrupt the application
+        print(f"Error queueing AI challenge generation: {str(e)}")
+        return False
+
 def get_hybrid_challenge(user_profile: Dict[str, Any], completed_challenges: List[str],
                         category: Optional[str] = None, challenge_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Get a challenge using the hybrid approach:
     1. If specific challenge ID requested, return that challenge
-    2. If AI should be used (based on criteria), generate AI challenge
+    2. If the AI policy allows it (rules, cache fill, budget), serve an AI challenge
     3. Otherwise, use pre-defined challenges
     
     This minimizes API calls while still providing personalized content.
     """
     # If a specific challenge ID was requested
     if challenge_id:
-        # Check if it's an AI challenge ID (starts with 'ai_')
+        # Static index first, then stored AI challenges
+        challenge = get_challenge_by_id(challenge_id)
+        if challenge:
+            return challenge
+        
+        # Unknown AI challenge ID: serve a cached AI challenge, or queue one and fall through
         if challenge_id.startswith('ai_') and AI_ENABLED:
-            # Force regenerate this AI challenge (passing category for consistency)
             cat = category or (challenge_id.split('_')[1] if len(challenge_id.split('_')) > 1 else None)
-            return generate_ai_challenge(user_profile, cat)
-        else:
-            # Get pre-defined challenge by ID
-            challenge = get_challenge_by_id(challenge_id)
+            challenge = request_ai_challenge(user_profile, cat)
             if challenge:
                 return challenge
     
@@ -44,20 +137,31 @@ def get_hybrid_challenge(user_profile: Dict[str, Any], completed_challenges: Lis
         all_category_challenges = get_challenge_by_category(category, None, return_all=True) or []
         available_challenges = [c.get('id', '') for c in all_category_challenges if isinstance(c, dict)]
     
-    # Determine if we should use AI
-    if AI_ENABLED and should_use_ai(user_profile, completed_challenges, available_challenges, category):
-        # Use AI to generate a challenge
-        return generate_ai_challenge(user_profile, category)
+    # Let the policy decide between AI and static. A cached AI challenge is
+    # free to serve; anything that needs a model call must fit the budget,
+    # and a cache miss is generated in the background while this request
+    # falls back to a pre-defined challenge
+    challenge = None
+    if AI_ENABLED:
+        cached = uncompleted_ai_challenges(peek_cache(get_cache_key(user_profile, category)), completed_challenges)
+        decision = get_policy().decide(
+            user_profile, completed_challenges, available_challenges, category,
+            cached=len(cached), needs_generation=len(cached) < POOL_LOW_WATER
+        )
+        AI_METRICS.record(ai_metrics.POLICY, decision.reason)
+        if decision.use_ai:
+            challenge = request_ai_challenge(user_profile, category, completed_challenges, decision.generate)
     
     # Otherwise, get a pre-defined challenge
-    if category:
-        challenge = get_challenge_by_category(category, completed_challenges)
-    else:
-        challenge = get_random_challenge(completed_challenges)
+    if not challenge:
+        if category:
+            challenge = get_challenge_by_category(category, completed_challenges)
+        else:
+            challenge = get_random_challenge(completed_challenges)
     
-    # If we couldn't get a pre-defined challenge and AI is enabled, use AI as fallback
+    # If we couldn't get a pre-defined challenge and AI is enabled, queue one (budget permitting)
     if not challenge and AI_ENABLED:
-        return generate_ai_challenge(user_profile, category)
+        challenge = request_ai_challenge(user_profile, category, completed_challenges)
     
     # Final fallback - ensure we always return a dictionary
     if not challenge:
@@ -75,14 +179,18 @@ def get_hybrid_challenge(user_profile: Dict[str, Any], completed_challenges: Lis
 def schedule_batch_generation(user_profile: Dict[str, Any], count: int = 5):
     """
     Schedule background generation of challenges to pre-fill the cache.
-    This should be called during app initialization or as a periodic task.
+    Returns immediately; jobs for the same profile bucket are deduplicated.
+    Skipped when the global AI budget is used up or the provider is unhealthy.
     """
-    if AI_ENABLED:
+    policy = get_policy()
+    if AI_ENABLED and AI_BREAKER.healthy() and policy.has_headroom():
         try:
-            # This would ideally be run as a background task
-            # For simplicity, we're running it directly, but in production
-            # this should be a celery task or similar async job
-            batch_generate_challenges(user_profile, count)
+            if get_job_queue().submit(
+                BATCH_JOB,
+                {"user_profile": _job_profile(user_profile), "count": count},
+                dedupe_key=f"{BATCH_JOB}:{get_cache_key(user_profile)}"
+            ):
+                policy.spend()
         except Exception as e:
             # Log the error but don't disrupt the application
-            print(f"Error scheduling batch challenge generation: {str(e)}")
\ No newline at end of file
+            print(f"Error scheduling batch challenge generation: {str(e)}")
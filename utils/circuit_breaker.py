@@ -0,0 +1,238 @@
+"""
+Circuit breaker for the AI provider.
+After repeated failures the breaker opens and callers fail fast (and serve
+static fallbacks) instead of waiting for timeouts. Once the reset timeout
+has passed, a single worker moves it to half-open and probes the provider
+in a background thread; success closes the breaker, failure re-opens it.
+The probe is started by the first caller after the timeout (healthy() lets
+code that only queues work start it too) and, in the process that opened
+the breaker, by a timer, so it recovers even without traffic.
+State lives in a SQLite table so every worker process sees the same state;
+the table is created on first use.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Optional, Union
+
+from utils.sqlite_store import SQLiteStore, StorePath
+
+# Settings (overridable from the environment; the path from Django settings)
+BREAKER_PATH = StorePath("AI_BREAKER_PATH", "ai_breaker.db")
+FAILURE_THRESHOLD = int(os.environ.get("AI_BREAKER_FAILURES", "5"))  # Consecutive failures before opening
+RESET_TIMEOUT = float(os.environ.get("AI_BREAKER_RESET", "30"))  # Seconds open before probing
+PROBE_TIMEOUT = 120.0  # Seconds before a half-open probe is considered abandoned
+
+# States
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the breaker is open"""
+
+
+class CircuitBreaker(SQLiteStore):
+    """Closed/open/half-open breaker shared through a SQLite table"""
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS circuit_breakers (
+        name TEXT PRIMARY KEY, state TEXT NOT NULL, failures INTEGER NOT NULL,
+        opened_at REAL NOT NULL, updated_at REAL NOT NULL
+    );
+    """
+    memory_fallback = True
+    unavailable_message = "Circuit breaker table unavailable, using per-process state"
+
+    def __init__(self, name: str, path: Union[str, StorePath, None] = BREAKER_PATH,
+                 failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT,
+                 probe: Optional[Callable[[], Any]] = None):
+        super().__init__(path)
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe  # Called in a background thread to test recovery
+        self._memory = {"state": CLOSED, "failures": 0, "opened_at": 0.0, "updated_at": 0.0}
+        self._lock = threading.Lock()
+        self._probe_scheduled = False
+
+    def prepare(self, conn: sqlite3.Connection) -> None:
+        super().prepare(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO circuit_breakers (name, state, failures, opened_at, updated_at) "
+            "VALUES (?, ?, 0, 0, ?)",
+            (self.name, CLOSED, time.time())
+        )
+
+    def _update(self, sql: str, params: tuple) -> int:
+        """Run an UPDATE on the breaker table; returns the number of rows changed"""
+        with self._connect() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state, failure count and timestamps"""
+        if self.path is None:
+            with self._lock:
+                return dict(self._memory)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT state, failures, opened_at, updated_at FROM circuit_breakers WHERE name = ?",
+                (self.name,)
+            ).fetchone()
+        state, failures, opened_at, updated_at = row or (CLOSED, 0, 0.0, 0.0)
+        return {"state": state, "failures": failures, "opened_at": opened_at, "updated_at": updated_at}
+
+    def state(self) -> str:
+        return self.snapshot()["state"]
+
+    def healthy(self) -> bool:
+        """
+        Whether to queue work for the provider now, for callers that don't
+        call it themselves (the queued job goes through allow()). While open,
+        the first check after the reset timeout starts the probe, so ordinary
+        traffic lets an open breaker recover; without a probe, a due breaker
+        counts as healthy so the queued job can make the trial call.
+        """
+        if self.probe is not None:
+            return self.allow()
+        try:
+            snapshot = self.snapshot()
+        except sqlite3.Error as e:
+            print(f"Circuit breaker error: {str(e)}")
+            return True
+        if snapshot["state"] == OPEN:
+            return snapshot["opened_at"] <= time.time() - self.reset_timeout
+        return snapshot["state"] == CLOSED
+
+    def _schedule_probe(self) -> None:
+        """Start the probe once the reset timeout has passed, even if nobody calls allow()"""
+        if self.probe is None:
+            return
+        with self._lock:
+            if self._probe_scheduled:
+                return
+            self._probe_scheduled = True
+        threading.Thread(target=self._probe_when_due, name=f"breaker-timer-{self.name}", daemon=True).start()
+
+    def _probe_when_due(self) -> None:
+        try:
+            while True:
+                snapshot = self.snapshot()
+                if snapshot["state"] != OPEN:
+                    break
+                wait = snapshot["opened_at"] + self.reset_timeout - time.time()
+                if wait <= 0:
+                    # Cleared first: a failed probe re-opens the breaker and schedules the next one
+                    with self._lock:
+                        self._probe_scheduled = False
+                    self.allow()
+                    return
+                time.sleep(wait)
+        except sqlite3.Error as e:
+            print(f"Circuit breaker error: {str(e)}")
+        with self._lock:
+            self._probe_scheduled = False
+
+    def _claim_probe(self, from_state: str, column: str, cutoff: float) -> bool:
+        """Atomically move to half-open if still in `from_state` with `column` <= cutoff; True if this caller did"""
+        now = time.time()
+        if self.path is None:
+            with self._lock:
+                if self._memory["state"] != from_state or self._memory[column] > cutoff:
+                    return False
+                self._memory.update(state=HALF_OPEN, updated_at=now)
+                return True
+        return self._update(
+            f"UPDATE circuit_breakers SET state = ?, updated_at = ? WHERE name = ? AND state = ? AND {column} <= ?",
+            (HALF_OPEN, now, self.name, from_state, cutoff)
+        ) == 1
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go to the provider now. While open, the first
+        caller after the reset timeout moves the breaker to half-open and
+        starts a background probe (or, without a probe, is let through as
+        the trial call); everyone else keeps failing fast.
+        """
+        now = time.time()
+        try:
+            snapshot = self.snapshot()
+            if snapshot["state"] == CLOSED:
+                return True
+            if snapshot["state"] == OPEN:
+                claimed = self._claim_probe(OPEN, "opened_at", now - self.reset_timeout)
+            else:
+                # Only taken over if the worker probing has died
+                claimed = self._claim_probe(HALF_OPEN, "updated_at", now - PROBE_TIMEOUT)
+        except sqlite3.Error as e:
+            # Don't let a broken state table block the provider
+            print(f"Circuit breaker error: {str(e)}")
+            return True
+
+        if not claimed:
+            return False
+        if self.probe is None:
+            return True
+        threading.Thread(target=self._run_probe, name=f"breaker-probe-{self.name}", daemon=True).start()
+        return False
+
+    def _run_probe(self) -> None:
+        try:
+            self.probe()
+        except Exception as e:
+            print(f"Circuit breaker probe failed: {str(e)}")
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def record_success(self) -> None:
+        """A call succeeded: close the breaker and clear the failure count"""
+        try:
+            if self.path is None:
+                with self._lock:
+                    self._memory.update(state=CLOSED, failures=0, updated_at=time.time())
+                return
+            self._update(
+                "UPDATE circuit_breakers SET state = ?, failures = 0, updated_at = ? "
+                "WHERE name = ? AND (state != ? OR failures > 0)",
+                (CLOSED, time.time(), self.name, CLOSED)
+            )
+        except sqlite3.Error as e:
+            print(f"Circuit breaker error: {str(e)}")
+
+    def record_failure(self) -> None:
+        """A call failed: count it, opening the breaker at the threshold (or on a failed probe)"""
+        now = time.time()
+        try:
+            if self.path is None:
+                with self._lock:
+                    self._memory["failures"] += 1
+                    self._memory["updated_at"] = now
+                    if self._memory["state"] == HALF_OPEN or (
+                            self._memory["state"] == CLOSED and self._memory["failures"] >= self.failure_threshold):
+                        self._memory.update(state=OPEN, opened_at=now)
+                    opened = self._memory["state"] == OPEN
+                if opened:
+                    self._schedule_probe()
+                return
+            # SET expressions all see the row as it was before the update
+            opens = "state = ? OR (state = ? AND failures + 1 >= ?)"
+            self._update(
+                "UPDATE circuit_breakers SET failures = failures + 1, updated_at = ?, "
+                f"opened_at = CASE WHEN {opens} THEN ? ELSE opened_at END, "
+                f"state = CASE WHEN {opens} THEN ? ELSE state END "
+                "WHERE name = ?",
+                (now, HALF_OPEN, CLOSED, self.failure_threshold, now,
+                 HALF_OPEN, CLOSED, self.failure_threshold, OPEN, self.name)
+            )
+            if self.probe is not None and self.state() == OPEN:
+                self._schedule_probe()
+        except sqlite3.Error as e:
+            print(f"Circuit breaker error: {str(e)}")
+
+    def reset(self) -> None:
+        """Force the breaker closed"""
+        self.record_success()
@@ -0,0 +1,367 @@
+"""
+Asyncio client for the generative model.
+Reuses a single model handle, caps the number of in-flight calls with a
+semaphore (and sync models' calls with a thread pool of the same size, since
+a thread can't be stopped when its call times out), gives every call a deadline and retries failures with jittered
+exponential backoff. Responses can also be streamed chunk by chunk. Token
+usage, latency and failures of every call go to an optional recorder
+(see utils.ai_metrics), and an optional circuit breaker makes calls fail
+fast while the provider is unhealthy (see utils.circuit_breaker). Sync
+code (Django views, job queue workers) drives it through one shared event
+loop running in a background thread.
+"""
+
+import os
+import time
+import queue
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
+
+from utils.ai_metrics import estimate_tokens
+from utils.circuit_breaker import CircuitOpenError
+
+# Settings (overridable from the environment)
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "4"))
+AI_TIMEOUT = float(os.environ.get("AI_TIMEOUT", "30"))  # Seconds per attempt
+AI_RETRIES = int(os.environ.get("AI_RETRIES", "2"))  # Retries after the first attempt
+AI_BACKOFF = float(os.environ.get("AI_BACKOFF", "0.5"))  # Base backoff in seconds
+
+
+class GenerationError(Exception):
+    """Raised when the model couldn't produce a response after all retries"""
+
+
+def response_text(response: Any) -> str:
+    """Get the text out of a model response across library versions"""
+    if hasattr(response, "text"):
+        return response.text
+    if hasattr(response, "result"):
+        return response.result
+    return str(response)
+
+
+def usage_tokens(response: Any) -> Optional[Tuple[int, int]]:
+    """(prompt, response) token counts reported by the API, if it reports them"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if prompt_tokens is None and response_tokens is None:
+        return None
+    return int(prompt_tokens or 0), int(response_tokens or 0)
+
+
+def request_model(model: Any, prompt: str) -> Any:
+    """Call a model synchronously, handling different API versions; returns the raw response"""
+    try:
+        return model.generate_content(prompt)
+    except AttributeError:
+        # Alternative API formats
+        if hasattr(model, "predict"):
+            return model.predict(prompt)
+        return model.generate(prompt)
+
+
+def stream_model(model: Any, prompt: str) -> Iterator[Any]:
+    """Stream raw response chunks from a model synchronously, or the whole reply if it can't stream"""
+    try:
+        response = model.generate_content(prompt, stream=True)
+    except (AttributeError, TypeError):
+        yield request_model(model, prompt)
+        return
+    yield from response
+
+
+class EventLoopThread:
+    """An asyncio event loop running forever in a daemon thread"""
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="ai-event-loop", daemon=True)
+                thread.start()
+            return self._loop
+
+    def run(self, coroutine, timeout: Optional[float] = None):
+        """Run a coroutine on the loop from sync code and wait for the result"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return future.result(timeout)
+
+
+# Shared by every client in the process
+LOOP_THREAD = EventLoopThread()
+
+
+class AsyncGenerationClient:
+    """Concurrency-limited, deadline-bound, retrying wrapper around a model"""
+
+    def __init__(self, model_factory: Callable[[], Any], concurrency: int = AI_CONCURRENCY,
+                 timeout: float = AI_TIMEOUT, retries: int = AI_RETRIES, backoff: float = AI_BACKOFF,
+                 loop_thread: EventLoopThread = LOOP_THREAD, recorder: Optional[Any] = None,
+                 breaker: Optional[Any] = None):
+        self.model_factory = model_factory
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.loop_thread = loop_thread
+        self.recorder = recorder  # e.g. utils.ai_metrics.AIMetrics
+        self.breaker = breaker  # e.g. utils.circuit_breaker.CircuitBreaker
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._semaphore = None
+        self._executor = None
+
+    @property
+    def model(self) -> Any:
+        """The model handle, created once and reused"""
+        with self._model_lock:
+            if self._model is None:
+                self._model = self.model_factory()
+            return self._model
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Only ever touched from the loop thread, so no lock is needed
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        Threads for sync models. A call that times out keeps running in its
+        thread after its semaphore slot is released, so the pool is what
+        keeps the number of blocking calls at `concurrency`; later calls
+        queue until such a thread finishes.
+        """
+        # Only ever touched from the loop thread, like the semaphore
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ai-call")
+        return self._executor
+
+    async def _in_thread(self, fn: Callable, *args: Any) -> Any:
+        """Run a blocking model call on the client's thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _call(self, prompt: str) -> Any:
+        model = self.model
+        if model is None:
+            raise GenerationError("Model unavailable")
+        if hasattr(model, "generate_content_async"):
+            return await model.generate_content_async(prompt)
+        return await self._in_thread(request_model, model, prompt)
+
+    def _record_call(self, operation: str, prompt: str, text: str, usage: Optional[Tuple[int, int]],
+                     started: float) -> None:
+        if self.recorder is None:
+            return
+        # Estimate from the text when the API doesn't report usage
+        prompt_tokens, response_tokens = usage or (estimate_tokens(prompt), estimate_tokens(text))
+        self.recorder.record_call(operation, prompt_tokens, response_tokens, time.monotonic() - started)
+
+    def _record_failure(self, reason: str) -> None:
+        if self.recorder is not None:
+            self.recorder.record_failure(reason)
+
+    def _check_breaker(self, use_breaker: bool) -> None:
+        if use_breaker and self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError("AI provider circuit is open")
+
+    def _report(self, success: bool, use_breaker: bool) -> None:
+        """Tell the breaker how a whole call (after retries) went"""
+        if use_breaker and self.breaker is not None:
+            if success:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def generate(self, prompt: str, use_breaker: bool = True) -> str:
+        """Generate a response, retrying timeouts and errors"""
+        self._check_breaker(use_breaker)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._delay(attempt - 1))
+            try:
+                async with self.semaphore:
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(self._call(prompt), self.timeout)
+                text = response_text(response)
+                self._record_call("generate", prompt, text, usage_tokens(response), started)
+                self._report(True, use_breaker)
+                return text
+            except GenerationError:
+                self._record_failure("model_unavailable")
+                self._report(False, use_breaker)
+                raise
+            except asyncio.TimeoutError:
+                self._record_failure("timeout")
+                last_error = GenerationError(f"Timed out after {self.timeout}s")
+            except Exception as e:
+                self._record_failure(type(e).__name__)
+                last_error = e
+        self._report(False, use_breaker)
+        raise GenerationError(f"Generation failed after {self.retries + 1} attempts: {last_error}")
+
+    async def generate_many(self, prompts: List[str]) -> List[Any]:
+        """Generate several responses concurrently; failures are returned as exceptions"""
+        return await asyncio.gather(*(self.generate(p) for p in prompts), return_exceptions=True)
+
+    async def _stream(self, prompt: str) -> AsyncIterator[Any]:
+        model = self.model
+        if model is None:
+            raise GenerationError("Model unavailable")
+        if hasattr(model, "generate_content_async"):
+            response = await model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                yield chunk
+            return
+
+        # Pull the sync stream one chunk at a time without blocking the loop
+        chunks = stream_model(model, prompt)
+        while True:
+            chunk = await self._in_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Stream a response as text chunks. `timeout` applies to the wait for
+        each chunk. Failures before the first chunk are retried; a failure
+        after that raises GenerationError, leaving the caller whatever it has
+        already received.
+        """
+        self._check_breaker(True)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._delay(attempt - 1))
+            started = False
+            try:
+                async with self.semaphore:
+                    began = time.monotonic()
+                    chunks = self._stream(prompt).__aiter__()
+                    parts = []
+                    usage = None
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            # Usage is reported on the final chunk
+                            self._record_call("stream", prompt, "".join(parts), usage, began)
+                            self._report(True, True)
+                            return
+                        started = True
+                        usage = usage_tokens(chunk) or usage
+                        text = response_text(chunk)
+                        parts.append(text)
+                        yield text
+            except GenerationError:
+                self._record_failure("model_unavailable")
+                self._report(False, True)
+                raise
+            except asyncio.TimeoutError:
+                self._record_failure("timeout")
+                last_error = GenerationError(f"Timed out after {self.timeout}s")
+            except Exception as e:
+                self._record_failure(type(e).__name__)
+                last_error = e
+            if started:
+                self._report(False, True)
+                raise GenerationError(f"Stream interrupted: {last_error}")
+        self._report(False, True)
+        raise GenerationError(f"Generation failed after {self.retries + 1} attempts: {last_error}")
+
+    def generate_sync(self, prompt: str, use_breaker: bool = True) -> str:
+        """Generate from sync code via the shared event loop"""
+        return self.loop_thread.run(self.generate(prompt, use_breaker))
+
+    def generate_many_sync(self, prompts: List[str]) -> List[Any]:
+        """Generate several responses from sync code via the shared event loop"""
+        return self.loop_thread.run(self.generate_many(prompts))
+
+    def stream_sync(self, prompt: str) -> Iterator[str]:
+        """Stream a response from sync code; chunks are handed over through a queue"""
+        chunks: "queue.Queue" = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for chunk in self.stream(prompt):
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop_thread.loop)
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop generating if the caller stops reading early
+            future.cancel()
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModel:
+    """
+    Stand-in for the generative model in tests and local runs.
+    Returns canned responses in order (repeating the last one), with optional
+    latency and a number of initial failures. Streamed responses are split
+    into `chunk_size` pieces.
+    """
+
+    def __init__(self, responses: Optional[List[str]] = None, latency: float = 0.0, failures: int = 0,
+                 chunk_size: int = 64):
+        self.responses = list(responses or ['{"id": "fake_1", "title": "Fake", "description": "Fake", '
+                                            '"category": "Communication Boosters", "difficulty": "easy"}'])
+        self.latency = latency
+        self.failures = failures
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt: str, stream: bool = False) -> Any:
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            call = self.calls
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if call <= self.failures:
+                raise RuntimeError("Fake model failure")
+            text = self.responses[min(call - 1, len(self.responses) - 1)]
+            if stream:
+                return [FakeResponse(text[i:i + self.chunk_size]) for i in range(0, len(text), self.chunk_size)]
+            return FakeResponse(text)
+        finally:
+            with self._lock:
+                self.active -= 1
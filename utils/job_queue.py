@@ -0,0 +1,224 @@
+"""
+Background job queue for slow work such as AI challenge generation.
+Jobs are stored in a small SQLite file so they survive restarts and can be
+shared by every worker process on the host, and are executed by a pool of
+daemon threads inside the web process. No external broker is needed.
+Failed jobs are retried with exponential backoff, and finished jobs are
+deleted once they are older than the retention period.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import traceback
+from typing import Any, Callable, Dict, Optional, Union
+
+from utils.sqlite_store import SQLiteStore, StorePath
+
+# Location of the queue database (from Django settings) and pool settings
+QUEUE_PATH = StorePath("JOB_QUEUE_PATH", "job_queue.db")
+WORKER_COUNT = int(os.environ.get("JOB_QUEUE_WORKERS", "2"))
+POLL_INTERVAL = 2.0  # Seconds between polls when idle
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30.0  # Seconds before the first retry; doubles with each attempt
+STALE_AFTER = 15 * 60  # Seconds before a running job is considered abandoned
+RETENTION = 7 * 24 * 60 * 60  # Done and failed jobs are deleted after 7 days
+PURGE_INTERVAL = 60 * 60  # Seconds between retention sweeps in each process
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    dedupe_key TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    available_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- At most one active job per dedupe key
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_dedupe
+    ON jobs (dedupe_key) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, updated_at);
+"""
+
+
+class JobQueue(SQLiteStore):
+    """Durable job queue with an in-process thread pool"""
+
+    schema = SCHEMA
+
+    def __init__(self, path: Union[str, StorePath] = QUEUE_PATH, workers: int = WORKER_COUNT,
+                 retry_backoff: float = RETRY_BACKOFF, retention: float = RETENTION):
+        super().__init__(path)
+        self.workers = workers
+        self.retry_backoff = retry_backoff
+        self.retention = retention
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]) -> None:
+        """Register the function that runs jobs of the given kind"""
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> bool:
+        """
+        Add a job to the queue and wake a worker.
+        Returns False if an identical job (same dedupe key) is already
+        pending or running.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (kind, payload, dedupe_key, status, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), dedupe_key, PENDING, now, now, now)
+            )
+            added = cursor.rowcount == 1
+        self.start()
+        self._wakeup.set()
+        return added
+
+    def _claim(self) -> Optional[tuple]:
+        """
+        Atomically move the oldest pending job that is due to running. Only
+        kinds with a handler in this process are claimed, so workers leave
+        other processes' jobs alone.
+        """
+        kinds = list(self.handlers)
+        if not kinds:
+            return None
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs "
+                f"WHERE status = ? AND available_at <= ? AND kind IN ({','.join('?' * len(kinds))}) "
+                "ORDER BY id LIMIT 1",
+                [PENDING, now] + kinds
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, now, row[0])
+                )
+            conn.execute("COMMIT")
+            return row
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None, delay: float = 0.0) -> None:
+        """Record a job's outcome; a job put back to pending isn't run again for `delay` seconds"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                (status, error, now + delay, now, job_id)
+            )
+
+    def run_next(self) -> bool:
+        """Run one pending job in the current thread. Returns False if none was pending."""
+        row = self._claim()
+        if not row:
+            return False
+
+        job_id, kind, payload, attempts = row
+        handler = self.handlers.get(kind)
+        if handler is None:
+            self._finish(job_id, FAILED, f"No handler registered for {kind}")
+            return True
+
+        try:
+            handler(json.loads(payload))
+            self._finish(job_id, DONE)
+        except Exception:
+            # Retry with exponential backoff until the attempt limit, then give up
+            if attempts + 1 < MAX_ATTEMPTS:
+                self._finish(job_id, PENDING, traceback.format_exc(), self.retry_backoff * 2 ** attempts)
+            else:
+                self._finish(job_id, FAILED, traceback.format_exc())
+        return True
+
+    def purge(self) -> int:
+        """Delete done and failed jobs older than the retention period. Returns the number deleted."""
+        now = time.time()
+        self._last_purge = now
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, now - self.retention)
+            ).rowcount
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if self.run_next():
+                    continue
+                if time.time() - self._last_purge >= PURGE_INTERVAL:
+                    self.purge()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {str(e)}")
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def recover(self) -> None:
+        """Requeue jobs left running by a process that died"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (PENDING, now, RUNNING, now - STALE_AFTER)
+            )
+
+    def start(self) -> None:
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            self.recover()
+            self._stopping.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the worker threads"""
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def stats(self) -> Dict[str, int]:
+        """Count jobs by status"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """Get the process-wide job queue, creating it on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,77 @@
+"""
+Incremental parser for JSON objects in model output.
+Scans text as it streams in and yields each top-level object as soon as its
+closing brace arrives, whether the objects sit in a JSON array, a code fence
+or loose prose. A malformed object is skipped instead of failing the whole
+response, and objects completed before a truncation are kept.
+"""
+
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+class JSONObjectStream:
+    """Feed text chunks in, get complete top-level JSON objects out"""
+
+    def __init__(self):
+        self._buffer: List[str] = []  # Characters of the object being read
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.malformed = 0  # Objects that closed but weren't valid JSON
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk of text and return the objects it completed"""
+        objects = []
+        for char in chunk:
+            if self._depth == 0:
+                # Outside an object only an opening brace matters
+                if char == "{":
+                    self._buffer = [char]
+                    self._depth = 1
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    parsed = self._parse("".join(self._buffer))
+                    if parsed is not None:
+                        objects.append(parsed)
+                    self._buffer = []
+        return objects
+
+    def _parse(self, text: str):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            self.malformed += 1
+            return None
+
+    @property
+    def truncated(self) -> bool:
+        """True if the text ended in the middle of an object"""
+        return self._depth > 0
+
+
+def iter_json_objects(chunks: Iterable[str], stream: Optional[JSONObjectStream] = None) -> Iterator[Dict[str, Any]]:
+    """Yield each top-level JSON object from an iterable of text chunks"""
+    stream = stream or JSONObjectStream()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+
+
+def parse_json_objects(text: str) -> List[Dict[str, Any]]:
+    """Every complete top-level JSON object in a piece of text"""
+    return JSONObjectStream().feed(text)
@@ -0,0 +1,279 @@
+"""
+Pluggable LLM backends for challenge generation.
+A backend knows whether it can be used (API key, library installed) and
+creates the model handle AsyncGenerationClient drives. Every model exposes
+Gemini's `generate_content(prompt, stream=False)` and returns responses with
+`.text` and `.usage_metadata`, so retries, streaming, metrics and parsing
+work the same whichever backend is selected.
+The AI_BACKEND setting (from Django settings, falling back to the
+environment) is a comma-separated list of backend names in order of
+preference (cheapest first); the first available one is used. "local"
+composes challenges from the static catalog with no network access, for
+load tests and CI.
+"""
+
+import os
+import re
+import json
+import time
+import random
+import threading
+import importlib.util
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import google.generativeai as genai
+from django.conf import settings
+
+from data.challenges import CATALOG
+from utils.ai_metrics import estimate_tokens
+
+# Settings (overridable from the environment; the backend list from Django settings)
+GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-1.5-pro")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+LOCAL_LATENCY = float(os.environ.get("AI_LOCAL_LATENCY", "0"))  # Simulated seconds per call
+
+
+class Usage:
+    """Token counts in the shape of Gemini's usage_metadata"""
+
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class ModelResponse:
+    """A response (or streamed chunk) in the shape of Gemini's"""
+
+    def __init__(self, text: str, usage: Optional[Usage] = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class Backend(ABC):
+    """A generation backend; subclasses say whether they're usable and build the model"""
+
+    name = ""
+
+    @abstractmethod
+    def available(self) -> bool:
+        """Whether the backend can be used (API key set, library installed)"""
+
+    @abstractmethod
+    def create_model(self) -> Any:
+        """Build the model handle AsyncGenerationClient calls"""
+
+
+class GeminiBackend(Backend):
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = GOOGLE_API_KEY, model_name: str = GEMINI_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._configured = None
+
+    def available(self) -> bool:
+        """Configure the Google API once, handling different library versions"""
+        if self._configured is None:
+            self._configured = self._configure()
+        return self._configured
+
+    def _configure(self) -> bool:
+        if not self.api_key:
+            return False
+        try:
+            # Try the newer syntax
+            genai.configure(api_key=self.api_key)
+            return True
+        except (AttributeError, TypeError):
+            try:
+                # Try older syntax or alternative approach
+                genai.api_key = self.api_key
+                return True
+            except Exception as e:
+                print(f"Failed to initialize Google AI: {str(e)}")
+                return False
+
+    def create_model(self) -> Any:
+        """Create the model with version compatibility"""
+        try:
+            try:
+                return genai.GenerativeModel(self.model_name)
+            except AttributeError:
+                try:
+                    return genai.get_model(self.model_name)
+                except AttributeError:
+                    return genai.models.get_model(self.model_name)
+        except Exception as e:
+            print(f"Error creating model: {str(e)}")
+            return None
+
+
+def openai_usage(usage: Any) -> Optional[Usage]:
+    if usage is None:
+        return None
+    return Usage(getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+
+
+class OpenAIModel:
+    """Chat completions behind Gemini's generate_content interface"""
+
+    def __init__(self, client: Any, model_name: str = OPENAI_MODEL):
+        self.client = client
+        self.model_name = model_name
+
+    def generate_content(self, prompt: str, stream: bool = False) -> Any:
+        messages = [{"role": "user", "content": prompt}]
+        if stream:
+            return self._stream(messages)
+        completion = self.client.chat.completions.create(model=self.model_name, messages=messages)
+        return ModelResponse(completion.choices[0].message.content or "", openai_usage(completion.usage))
+
+    def _stream(self, messages: List[Dict[str, str]]) -> Iterator[ModelResponse]:
+        chunks = self.client.chat.completions.create(
+            model=self.model_name, messages=messages, stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in chunks:
+            # The usage chunk at the end has no choices
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            yield ModelResponse(text or "", openai_usage(getattr(chunk, "usage", None)))
+
+
+class OpenAIBackend(Backend):
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, model_name: str = OPENAI_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+
+    def available(self) -> bool:
+        return bool(self.api_key) and importlib.util.find_spec("openai") is not None
+
+    def create_model(self) -> Any:
+        try:
+            from openai import OpenAI
+            return OpenAIModel(OpenAI(api_key=self.api_key), self.model_name)
+        except Exception as e:
+            print(f"Error creating model: {str(e)}")
+            return None
+
+
+# Ways the local model varies a catalog challenge: (title suffix, extra step)
+TEMPLATE_TWISTS = [
+    ("Screen-Free Edition", "Put both phones in another room before you start."),
+    ("Outdoors", "Do it somewhere outside, on a walk or in a park."),
+    ("By Candlelight", "Dim the lights and light a candle first."),
+    ("Morning Version", "Do it first thing in the morning, before the day gets busy."),
+    ("Role Reversal", "Swap who leads halfway through."),
+    ("Ten-Minute Version", "Set a timer for ten minutes and stop when it rings."),
+    ("With a Playlist", "Pick three songs that matter to you both and play them in the background."),
+    ("Journal Follow-Up", "Afterwards, each write two sentences about how it felt and swap notes."),
+    ("Weekend Edition", "Save it for a slow weekend afternoon and take your time."),
+    ("Surprise Start", "One of you starts it unannounced at a moment of your choosing."),
+]
+TEMPLATE_DIFFICULTIES = ["easy", "medium", "hard"]
+
+
+class TemplateModel:
+    """
+    Deterministic, offline stand-in for an LLM. Reads the number of
+    challenges and the categories from the generation prompt and composes
+    challenges from the static catalog plus a twist, returned as the JSON
+    the prompt asks for. Output depends only on the prompt and the call
+    number, so runs are reproducible. Token usage is estimated from text.
+    """
+
+    def __init__(self, catalog: Any = CATALOG, latency: float = LOCAL_LATENCY, chunk_size: int = 64):
+        self.catalog = catalog
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def parse_prompt(self, prompt: str) -> Tuple[int, List[str], bool]:
+        """(count, categories, is_batch) requested by a generation prompt"""
+        categories = self.catalog.categories()
+        match = re.search(r"Generate (\d+) unique relationship challenges", prompt)
+        if match:
+            listed = re.search(r"across these categories: (.+)", prompt)
+            if listed:
+                categories = [c for c in listed.group(1).strip().split(", ") if self.catalog.category_size(c)]
+            return int(match.group(1)), categories or self.catalog.categories(), True
+        single = re.search(r"Challenge category: (.+)", prompt)
+        if single and self.catalog.category_size(single.group(1).strip()):
+            categories = [single.group(1).strip()]
+        return 1, categories, False
+
+    def compose(self, rng: random.Random, category: str) -> Dict[str, Any]:
+        base = rng.choice(self.catalog.by_category(category))
+        suffix, step = rng.choice(TEMPLATE_TWISTS)
+        return {
+            "id": f"local_{base['id']}_{rng.randrange(10 ** 6)}",
+            "title": f"{base['title']}: {suffix}",
+            "description": f"{base['description']} {step}",
+            "category": category,
+            "difficulty": rng.choice(TEMPLATE_DIFFICULTIES),
+        }
+
+    def respond(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        count, categories, is_batch = self.parse_prompt(prompt)
+        rng = random.Random(f"{prompt}:{call}")
+        challenges = [self.compose(rng, categories[i % len(categories)]) for i in range(count)]
+        return "```json\n" + json.dumps(challenges if is_batch else challenges[0], indent=2) + "\n```"
+
+    def generate_content(self, prompt: str, stream: bool = False) -> Any:
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.respond(prompt)
+        usage = Usage(estimate_tokens(prompt), estimate_tokens(text))
+        if not stream:
+            return ModelResponse(text, usage)
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        # Usage comes with the last chunk, as the real APIs report it
+        return [ModelResponse(piece, usage if i == len(pieces) - 1 else None) for i, piece in enumerate(pieces)]
+
+
+class LocalBackend(Backend):
+    name = "local"
+
+    def available(self) -> bool:
+        return True
+
+    def create_model(self) -> Any:
+        return TemplateModel()
+
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, OpenAIBackend, LocalBackend)}
+
+
+def configured_backends() -> str:
+    """The AI_BACKEND setting, read when a backend is picked"""
+    return getattr(settings, "AI_BACKEND", os.environ.get("AI_BACKEND", "gemini"))
+
+
+def get_backend(names: Optional[str] = None) -> Backend:
+    """
+    The first available backend from a comma-separated list of names (the
+    AI_BACKEND setting by default). If none is available the first known
+    one is returned anyway, so callers see it as unavailable and serve
+    static challenges.
+    """
+    names = names or configured_backends()
+    backends = []
+    for name in names.split(","):
+        name = name.strip().lower()
+        if name not in BACKENDS:
+            print(f"Unknown AI backend: {name}")
+            continue
+        backends.append(BACKENDS[name]())
+
+    for backend in backends:
+        if backend.available():
+            return backend
+    return backends[0] if backends else GeminiBackend()
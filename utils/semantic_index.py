@@ -0,0 +1,195 @@
+"""
+Semantic retrieval index over challenge text.
+Title and description are embedded as hashed bag-of-words vectors (signed
+feature hashing of words and word pairs, sublinear term frequency) and
+scored by TF-IDF weighted cosine similarity, all in NumPy with no network
+or fitted vocabulary. Rows are appended in place as challenges arrive;
+document frequencies update incrementally, and IDF weights (with every
+row norm) are only recomputed once the index has grown by a few percent,
+so an insert costs O(new rows) and never re-embeds existing rows.
+Queries are batched: one matrix product per chunk of rows, with a
+running top-k per query.
+"""
+
+import os
+import zlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.challenge_index import normalize_text
+
+DIMENSIONS = int(os.environ.get("SEMANTIC_INDEX_DIMENSIONS", "512"))  # Hashed feature space size
+CHUNK_ROWS = 65536  # Rows scored per matrix product, bounds temporary memory
+REWEIGHT_FRACTION = 0.05  # Recompute IDF and all row norms once the index has grown by this much
+
+Match = Tuple[str, float]
+
+
+def tokens(text: str) -> List[str]:
+    """Words and adjacent word pairs of the normalized text"""
+    words = normalize_text(text).split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def challenge_text(challenge: Dict[str, Any]) -> str:
+    return f"{challenge.get('title', '')} {challenge.get('description', '')}"
+
+
+def embed(texts: Sequence[str], dimensions: int = DIMENSIONS) -> np.ndarray:
+    """
+    Hashed term-frequency vectors, one row per text: each token adds ±1 to
+    a bucket (the sign halves the cost of collisions), then counts are
+    damped with log1p.
+    """
+    rows, columns, values = [], [], []
+    for row, text in enumerate(texts):
+        for token in tokens(text):
+            h = zlib.crc32(token.encode())
+            rows.append(row)
+            columns.append(h % dimensions)
+            values.append(1.0 if h & 0x80000000 else -1.0)
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(vectors, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)),
+              np.array(values, dtype=np.float32))
+    return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+
+class SemanticIndex:
+    """Thread-safe, append-only TF-IDF cosine index keyed by challenge id"""
+
+    def __init__(self, dimensions: int = DIMENSIONS, capacity: int = 1024):
+        self.dimensions = dimensions
+        self._vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._df = np.zeros(dimensions, dtype=np.float64)  # Rows with a non-zero value per bucket
+        self._weights: Optional[np.ndarray] = None  # IDF as of the last reweight
+        self._norms = np.zeros(0, dtype=np.float32)  # Row norms under those weights
+        self._weighted_count = 0  # Rows in the index at the last reweight
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, challenge_id: str) -> bool:
+        return challenge_id in self._rows
+
+    def add(self, challenges: Iterable[Dict[str, Any]]) -> int:
+        """Insert challenges (dicts with id, title, description); known ids are skipped. Returns the number added."""
+        with self._lock:
+            new = []
+            for challenge in challenges:
+                challenge_id = challenge.get("id")
+                if challenge_id and challenge_id not in self._rows:
+                    self._rows[challenge_id] = -1  # Reserve against repeats in this batch
+                    new.append(challenge)
+            if not new:
+                return 0
+
+            vectors = embed([challenge_text(c) for c in new], self.dimensions)
+            start = len(self._ids)
+            self._reserve(start + len(new))
+            self._vectors[start:start + len(new)] = vectors
+            for offset, challenge in enumerate(new):
+                self._rows[challenge["id"]] = start + offset
+                self._ids.append(challenge["id"])
+            self._df += np.count_nonzero(vectors, axis=0)
+            return len(new)
+
+    def _reserve(self, size: int) -> None:
+        """Grow the row buffer geometrically so inserts are amortized O(1) per row"""
+        if size <= len(self._vectors):
+            return
+        capacity = max(len(self._vectors), 1)
+        while capacity < size:
+            capacity *= 2
+        grown = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        grown[:len(self._ids)] = self._vectors[:len(self._ids)]
+        self._vectors = grown
+
+    def _norms_of(self, start: int, stop: int, idf: np.ndarray) -> np.ndarray:
+        squared = idf * idf
+        norms = np.empty(stop - start, dtype=np.float32)
+        for offset in range(start, stop, CHUNK_ROWS):
+            chunk = self._vectors[offset:min(stop, offset + CHUNK_ROWS)]
+            norms[offset - start:offset - start + len(chunk)] = np.sqrt((chunk * chunk) @ squared)
+        norms[norms == 0] = 1.0
+        return norms
+
+    def _current_weights(self) -> Tuple[np.ndarray, np.ndarray]:
+        """IDF weights and row norms, reweighting everything only after enough growth"""
+        count = len(self._ids)
+        if self._weights is None or count - self._weighted_count > REWEIGHT_FRACTION * self._weighted_count:
+            self._weights = (np.log((1 + count) / (1 + self._df)) + 1).astype(np.float32)
+            self._norms = self._norms_of(0, count, self._weights)
+            self._weighted_count = count
+        elif len(self._norms) < count:
+            # Rows added since: norms under the weights already in use
+            self._norms = np.concatenate([self._norms, self._norms_of(len(self._norms), count, self._weights)])
+        return self._weights, self._norms
+
+    def _search(self, queries: np.ndarray, k: int, exclude: Sequence[Iterable[str]]) -> List[List[Match]]:
+        """Top-k rows for each raw query vector, best first"""
+        count = len(self._ids)
+        if not count or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        idf, norms = self._current_weights()
+        # cos(q*idf, d*idf) = (q*idf^2) . d / (|q*idf| |d*idf|)
+        weighted = queries * idf
+        query_norms = np.linalg.norm(weighted, axis=1)
+        query_norms[query_norms == 0] = 1.0
+        weighted = (weighted * idf) / query_norms[:, None]
+
+        excluded = [[self._rows[i] for i in ids if self._rows.get(i, -1) >= 0] for ids in exclude]
+        take = min(count, k + max((len(rows) for rows in excluded), default=0))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.intp)
+        for start in range(0, count, CHUNK_ROWS):
+            chunk = self._vectors[start:min(count, start + CHUNK_ROWS)]
+            scores = (weighted @ chunk.T) / norms[start:start + len(chunk)]
+            scores = np.concatenate([best_scores, scores], axis=1)
+            positions = np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))
+            rows = np.concatenate([best_rows, positions], axis=1)
+            if scores.shape[1] > take:
+                top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+
+        results = []
+        for query, (scores, rows) in enumerate(zip(best_scores, best_rows)):
+            skip = set(excluded[query])
+            order = np.argsort(-scores, kind="stable")
+            matches = [(self._ids[rows[i]], float(scores[i])) for i in order if rows[i] not in skip]
+            results.append(matches[:k])
+        return results
+
+    def search(self, texts: Sequence[str], k: int = 10,
+               exclude: Optional[Iterable[str]] = None) -> List[List[Match]]:
+        """Top-k (id, cosine) matches for each query text, best first"""
+        queries = embed(list(texts), self.dimensions)
+        excluded = list(exclude or [])
+        with self._lock:
+            return self._search(queries, k, [excluded] * len(queries))
+
+    def similar(self, challenge_ids: Iterable[str], k: int = 10,
+                exclude: Optional[Iterable[str]] = None) -> List[Match]:
+        """Challenges most like the given ones as a group (e.g. ones a couple liked), excluding them"""
+        with self._lock:
+            known = [i for i in dict.fromkeys(challenge_ids) if self._rows.get(i, -1) >= 0]
+            if not known:
+                return []
+            # Centroid of the liked rows, each normalized so none dominates
+            rows = self._vectors[[self._rows[i] for i in known]]
+            lengths = np.linalg.norm(rows, axis=1)
+            lengths[lengths == 0] = 1.0
+            query = (rows / lengths[:, None]).mean(axis=0, keepdims=True)
+            return self._search(query, k, [known + list(exclude or [])])[0]
+
+    def nearest(self, challenge: Dict[str, Any]) -> Optional[Match]:
+        """Closest indexed challenge other than itself, for near-duplicate checks"""
+        matches = self.search([challenge_text(challenge)], 1, [challenge.get("id")] if challenge.get("id") else None)
+        return matches[0][0] if matches[0] else None
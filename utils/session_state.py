@@ -3,6 +3,8 @@ import datetime
 import random
 from database.connection import get_db
 from database import models, crud, utils
+from data.badges import crossed_badges, earned_badges, progress_metrics
+from data.streaks import advance_streak
 from typing import Optional, List
 
 def initialize_session_state():
@@ -154,26 +156,30 @@ def complete_challenge(challenge_id, category):
     """Mark a challenge as completed and update progress"""
     today = datetime.date.today()
     
+    before = progress_metrics(st.session_state.user_progress["total_completed"],
+                              st.session_state.user_progress["streak"])
+    
     # Add to completed challenges list (memory)
     if challenge_id not in st.session_state.user_progress["completed_challenges"]:
         st.session_state.user_progress["completed_challenges"].append(challenge_id)
         st.session_state.user_progress["total_completed"] += 1
     
-    # Update last completed date
+    # Update streak from the previous completion day, then record today's
+    last_completed = st.session_state.user_progress.get("last_completed")
+    last_day = datetime.date.fromisoformat(last_completed[:10]) if last_completed else None
+    st.session_state.user_progress["streak"] = advance_streak(
+        st.session_state.user_progress["streak"], last_day, today
+    )
     st.session_state.user_progress["last_completed"] = today.isoformat()
     
-    # Update streak
-    if st.session_state.user_progress["last_completed"] == (today - datetime.timedelta(days=1)).isoformat():
-        st.session_state.user_progress["streak"] += 1
-    elif st.session_state.user_progress["last_completed"] != today.isoformat():
-        st.session_state.user_progress["streak"] = 1
-    
     # Update spark level (max 100%)
     new_spark = min(st.session_state.user_progress["spark_level"] + 5, 100)
     st.session_state.user_progress["spark_level"] = new_spark
     
-    # Check for badges (memory)
-    check_for_new_badges()
+    # Check for badges crossed by this completion (memory)
+    after = progress_metrics(st.session_state.user_progress["total_completed"],
+                             st.session_state.user_progress["streak"])
+    check_for_new_badges(before, after)
     
     # Generate new challenge (memory)
     generate_new_challenge()
@@ -205,31 +211,25 @@ def complete_challenge(challenge_id, category):
                 category=current_category
             )
 
-def check_for_new_badges():
-    """Check and award new badges based on progress"""
+def check_for_new_badges(before=None, after=None):
+    """
+    Check and award new badges based on progress.
+    With `before`/`after` snapshots only the thresholds crossed between them
+    are checked; without them every badge rule is evaluated.
+    """
     badges = st.session_state.user_progress["badges"]
-    total = st.session_state.user_progress["total_completed"]
-    streak = st.session_state.user_progress["streak"]
     
-    # Challenge completion badges
-    if total >= 1 and "First Spark" not in badges:
-        badges.append("First Spark")
-    if total >= 5 and "Flame Starter" not in badges:
-        badges.append("Flame Starter")
-    if total >= 10 and "Burning Bright" not in badges:
-        badges.append("Burning Bright")
-    if total >= 25 and "Inferno" not in badges:
-        badges.append("Inferno")
+    if after is None:
+        after = progress_metrics(st.session_state.user_progress["total_completed"],
+                                 st.session_state.user_progress["streak"])
+    
+    if before is None:
+        new_badges = earned_badges(after, badges)
+    else:
+        new_badges = crossed_badges(before, after, badges)
     
-    # Streak badges
-    if streak >= 3 and "3 Day Streak" not in badges:
-        badges.append("3 Day Streak")
-    if streak >= 7 and "1 Week Connection" not in badges:
-        badges.append("1 Week Connection")
-    if streak >= 14 and "2 Week Devotion" not in badges:
-        badges.append("2 Week Devotion")
-    if streak >= 30 and "Monthly Passion" not in badges:
-        badges.append("Monthly Passion")
+    badges.extend(new_badges)
+    return new_badges
 
 def generate_new_challenge(category=None):
     """Generate a new challenge for the user"""
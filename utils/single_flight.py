@@ -0,0 +1,159 @@
+"""
+Single-flight request coalescing.
+Concurrent callers asking for the same key share one execution of the
+underlying function instead of each making their own (expensive) model call.
+Within a process followers wait on the leader's result; across processes an
+optional SQLite lock table makes other workers wait for the leader to fill
+the cache instead of generating in parallel. The leader renews its lock
+while generating, so a slow call (timeouts plus retries) doesn't outlive it. Executions and shared calls
+are counted per process and, with a recorder, in the shared AI metrics.
+"""
+
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Optional, Union
+
+from utils.sqlite_store import SQLiteStore, StorePath
+
+LOCK_TTL = 60.0  # Seconds before a cross-process lock that isn't renewed is considered abandoned
+POLL_INTERVAL = 0.25  # Seconds between cache checks while another process generates
+
+
+class _Call:
+    """An in-flight call that followers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ProcessLocks(SQLiteStore):
+    """Expiring named locks stored in a SQLite file shared by all processes"""
+
+    schema = "CREATE TABLE IF NOT EXISTS flight_locks (lock_key TEXT PRIMARY KEY, expires_at REAL NOT NULL);"
+
+    def __init__(self, path: Union[str, StorePath], ttl: float = LOCK_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+
+    def acquire(self, key: str) -> bool:
+        """Try to take the lock; returns False if another process holds it"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM flight_locks WHERE lock_key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO flight_locks (lock_key, expires_at) VALUES (?, ?)",
+                (key, now + self.ttl)
+            )
+            return cursor.rowcount == 1
+
+    def is_held(self, key: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM flight_locks WHERE lock_key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    def renew(self, key: str) -> None:
+        """Push the lock's expiry back by a full TTL"""
+        with self._connect() as conn:
+            conn.execute("UPDATE flight_locks SET expires_at = ? WHERE lock_key = ?", (time.time() + self.ttl, key))
+
+    def release(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM flight_locks WHERE lock_key = ?", (key,))
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls for the same key"""
+
+    def __init__(self, locks: Optional[ProcessLocks] = None, poll_interval: float = POLL_INTERVAL,
+                 recorder: Optional[Any] = None):
+        self.locks = locks
+        self.poll_interval = poll_interval
+        self.recorder = recorder  # e.g. utils.ai_metrics.AIMetrics
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.metrics = {"executions": 0, "shared_in_process": 0, "shared_across_processes": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.metrics[name] += 1
+        if self.recorder is not None:
+            self.recorder.record_flight(name)
+
+    def _keep_lock(self, key: str, stop: threading.Event) -> None:
+        """Renew the lock for `key` every third of its TTL until `stop` is set"""
+        while not stop.wait(self.locks.ttl / 3):
+            try:
+                self.locks.renew(key)
+            except sqlite3.Error as e:
+                print(f"Error renewing generation lock: {str(e)}")
+
+    def _wait_for_other_process(self, key: str, check: Callable[[], Any]) -> Any:
+        """Poll `check` while another process holds the lock for `key`"""
+        while True:
+            value = check()
+            if value is not None:
+                return value
+            if not self.locks.is_held(key):
+                return check()
+            time.sleep(self.poll_interval)
+
+    def do(self, key: str, fn: Callable[[], Any], check: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Run `fn` once for all concurrent callers with the same key.
+        `check` looks for a value another process produced (e.g. a cache
+        lookup returning None on a miss); it enables cross-process waiting.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            self._count("shared_in_process")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        holds_lock = False
+        renewing = threading.Event()
+        try:
+            if self.locks is not None and check is not None:
+                holds_lock = self.locks.acquire(key)
+                if holds_lock:
+                    threading.Thread(target=self._keep_lock, args=(key, renewing),
+                                     name="flight-lock-renewal", daemon=True).start()
+                else:
+                    value = self._wait_for_other_process(key, check)
+                    if value is not None:
+                        self._count("shared_across_processes")
+                        call.result = value
+                        return value
+                    # The other process gave up without a value; generate ourselves
+
+            self._count("executions")
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            if holds_lock:
+                renewing.set()
+                self.locks.release(key)
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """Executions and the number of calls saved by coalescing"""
+        with self._lock:
+            stats = dict(self.metrics)
+        stats["calls_saved"] = stats["shared_in_process"] + stats["shared_across_processes"]
+        return stats
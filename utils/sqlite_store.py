@@ -0,0 +1,90 @@
+"""
+Base for the small SQLite stores shared by every worker process on the host
+(AI challenge cache, metrics, call budgets, circuit breaker, job queue).
+Locations come from Django settings, where they are anchored at BASE_DIR so
+they don't depend on the working directory. A store reads its setting and
+creates its schema on first use, so importing a module never creates a file.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+from django.conf import settings
+
+
+class StorePath:
+    """A store location named by a Django setting, read when the store is first used"""
+
+    def __init__(self, setting: str, filename: str):
+        self.setting = setting
+        self.filename = filename
+
+    def resolve(self) -> Optional[str]:
+        """The configured path (`filename` in BASE_DIR if unset); None means keep the store in memory"""
+        path = getattr(settings, self.setting, Path(settings.BASE_DIR) / self.filename)
+        return None if path is None else str(path)
+
+
+class SQLiteStore:
+    """
+    A store in one SQLite file, opened lazily. Subclasses set `schema` and
+    may extend prepare(). Stores that can run in memory set
+    `memory_fallback`: if the file can't be opened (or the path is None)
+    `path` becomes None and they keep per-process state instead; other
+    stores raise, and try again on the next use.
+    """
+
+    schema = ""
+    memory_fallback = False
+    unavailable_message = "SQLite store unavailable"
+
+    def __init__(self, path: Union[str, StorePath, None]):
+        self.location = path  # As given: a path, a StorePath or None
+        self._path: Optional[str] = None
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    @property
+    def path(self) -> Optional[str]:
+        """Path of the database file, created with its schema on first access"""
+        if not self._opened:
+            with self._open_lock:
+                if not self._opened:
+                    self._path = self._open()
+                    self._opened = True
+        return self._path
+
+    def _open(self) -> Optional[str]:
+        location = self.location
+        path = location.resolve() if isinstance(location, StorePath) else location
+        if path is None:
+            return None
+        try:
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            try:
+                self.prepare(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            if not self.memory_fallback:
+                raise
+            print(f"{self.unavailable_message}: {str(e)}")
+            return None
+        return path
+
+    def prepare(self, conn: sqlite3.Connection) -> None:
+        """Create the schema; called once, on first use"""
+        conn.executescript(self.schema)
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived autocommit connection (one per call, so threads never share one)"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()